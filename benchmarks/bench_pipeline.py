@@ -0,0 +1,213 @@
+"""
+入力読み込み・抽出プロファイル・NG照合・市区町村フィルタ・テンプレート書き込みのベンチマーク。
+
+使い方（リポジトリ直下で）:
+    python benchmarks/bench_pipeline.py                      # 1k/10k/100k を計測してベースラインと比較
+    python benchmarks/bench_pipeline.py --record             # 計測結果をベースラインとして保存
+    python benchmarks/bench_pipeline.py --sizes 1000 --only extract ng_match
+
+各ケースは rows/秒（スループット）で比較し、ベースラインより --threshold 以上
+遅くなったケースがあれば終了コード 1 で失敗する。
+ベースラインはマシン依存なので、比較する環境で --record したものを使うこと。
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import pandas as pd  # noqa: E402
+
+import synthetic  # noqa: E402
+from g_change_core import (  # noqa: E402
+    add_match_keys,
+    build_city_town_index,
+    canonical_company_name,
+    canonical_phone_keys,
+    clean_dataframe_except_phone,
+    extract_google_free_vertical,
+    extract_google_vertical,
+    extract_shigoto_arua,
+    extract_warehouse_association,
+    filter_by_city,
+    normalize_text,
+    read_upload_frame,
+    remove_ng_matches,
+    write_template_workbook,
+)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+EXTRACTORS = {
+    "google_vertical": lambda df: extract_google_vertical(df.iloc[:, 0].tolist()),
+    "google_free_vertical": extract_google_free_vertical,
+    "shigoto_arua": extract_shigoto_arua,
+    "warehouse_association": extract_warehouse_association,
+}
+
+
+def best_of(fn, repeat: int) -> float:
+    """fn を repeat 回実行して最短時間（秒）を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def input_blobs(raw: pd.DataFrame) -> dict:
+    """同じ入力を xlsx / csv / parquet のバイト列にしたもの（parquet は pyarrow がある場合だけ）"""
+    blobs = {}
+    buf = io.BytesIO()
+    raw.to_excel(buf, index=False, header=False)
+    blobs["xlsx"] = buf.getvalue()
+    blobs["csv"] = raw.to_csv(index=False, header=False).encode("utf-8")
+    try:
+        buf = io.BytesIO()
+        raw.rename(columns=str).to_parquet(buf, index=False)
+        blobs["parquet"] = buf.getvalue()
+    except ImportError:
+        pass
+    return blobs
+
+
+def prepared_frame(n: int) -> pd.DataFrame:
+    """フィルタ・照合系ケース用: Google縦型を抽出・整形・キー付与した状態"""
+    df = extract_google_vertical(synthetic.google_vertical(n).iloc[:, 0].tolist())
+    return add_match_keys(clean_dataframe_except_phone(df))
+
+
+def build_cases(sizes, only, ng_size: int, template_max: int):
+    """(ケース名, 件数, 入力行数, 実行関数) を順に返す"""
+    template_bytes = (ROOT / "template.xlsx").read_bytes()
+    ken = synthetic.ken_all_subset()
+    ken["__pref_norm"] = ken.iloc[:, 6].map(normalize_text)
+    ken["__city_norm"] = ken.iloc[:, 7].map(normalize_text)
+    ken["__town_norm"] = ken.iloc[:, 8].map(normalize_text)
+    town_index = build_city_town_index(ken)
+    pref, city, _ = synthetic.PREFS[0]
+    town_tokens = set(town_index[(normalize_text(pref), normalize_text(city))])
+
+    for n in sizes:
+        if not only or "read" in only:
+            raw = synthetic.google_vertical(n)
+            for ext, blob in input_blobs(raw).items():
+                yield (f"read/{ext}", n, len(raw),
+                       (lambda blob=blob, name=f"bench.{ext}": read_upload_frame(io.BytesIO(blob), name)))
+
+        if not only or "extract" in only:
+            for name, gen in synthetic.PROFILE_GENERATORS.items():
+                raw = gen(n)
+                yield f"extract/{name}", n, len(raw), (lambda raw=raw, f=EXTRACTORS[name]: f(raw))
+
+        needs_frame = not only or {"clean", "ng_match", "city_filter", "template_write"} & set(only)
+        if not needs_frame:
+            continue
+        df = prepared_frame(n)
+
+        if not only or "clean" in only:
+            base = df[["企業名", "業種", "住所", "電話番号"]]
+            yield "clean", n, len(base), (lambda base=base: clean_dataframe_except_phone(base))
+
+        if not only or "ng_match" in only:
+            ng = synthetic.ng_list(ng_size, source=df)
+            ng_names = [c for c in ng["企業名"].map(canonical_company_name) if c]
+            ng_phones = set(int(k) for k in canonical_phone_keys(ng["電話番号"])["key"].dropna())
+            yield (f"ng_match/ng{ng_size}", n, len(df),
+                   (lambda df=df, a=ng_names, b=ng_phones: remove_ng_matches(df, a, b, [])))
+
+        if not only or "city_filter" in only:
+            yield "city_filter", n, len(df), (lambda df=df: filter_by_city(df, town_tokens))
+
+        if (not only or "template_write" in only) and n <= template_max:
+            export = df[["企業名", "業種", "住所", "電話番号"]].reset_index(drop=True)
+            yield ("template_write", n, len(export),
+                   (lambda export=export: write_template_workbook(export, template_bytes, "物流業")))
+
+
+def run(args) -> dict:
+    results = {}
+    for case, n, rows, fn in build_cases(args.sizes, args.only, args.ng_size, args.template_max):
+        # 大きいケースは繰り返しを減らす（100k×3回は待ち時間が長すぎる）
+        repeat = args.repeat if n < 100_000 else max(1, args.repeat // 3)
+        sec = best_of(fn, repeat)
+        key = f"{case}@{n}"
+        results[key] = {"rows": rows, "seconds": round(sec, 4), "rows_per_sec": round(rows / sec, 1) if sec else None}
+        print(f"{key:<40} {rows:>9} rows  {sec:>9.4f} s  {results[key]['rows_per_sec']:>12,.0f} rows/s", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """ベースラインより threshold 以上スループットが落ちたケースを返す"""
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base or not base.get("rows_per_sec") or not cur.get("rows_per_sec"):
+            continue
+        ratio = cur["rows_per_sec"] / base["rows_per_sec"]
+        if ratio < 1.0 - threshold:
+            regressions.append((key, base["rows_per_sec"], cur["rows_per_sec"], ratio))
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--only", nargs="+", choices=["read", "extract", "clean", "ng_match", "city_filter", "template_write"])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--ng-size", type=int, default=2_000, help="NGリストの件数（実際のNGリストは最大2千件程度）")
+    ap.add_argument("--template-max", type=int, default=10_000, help="テンプレ書き込みを計測する最大件数")
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--record", action="store_true", help="結果をベースラインとして保存する")
+    ap.add_argument("--threshold", type=float, default=0.25, help="許容するスループット低下率（0.25=25%%）")
+    ap.add_argument("--json", type=Path, help="今回の結果を JSON で保存する先")
+    args = ap.parse_args(argv)
+
+    results = run(args)
+    payload = {
+        "meta": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.json:
+        args.json.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.record:
+        merged = {}
+        if args.baseline.exists():
+            merged = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+        merged.update(results)
+        payload["results"] = merged
+        args.baseline.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"ベースラインを保存しました: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"ベースラインがありません（{args.baseline}）。--record で作成してください。")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ スループットが {args.threshold:.0%} 以上低下したケース:")
+        for key, base, cur, ratio in regressions:
+            print(f"  {key:<40} {base:>12,.0f} -> {cur:>12,.0f} rows/s ({ratio:.0%})")
+        return 1
+    print("\n✅ ベースライン比で劣化なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
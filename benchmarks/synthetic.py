@@ -0,0 +1,146 @@
+"""
+ベンチマーク用の合成データ生成。
+
+実際のスクレイプ結果に近い形（行の並び・ノイズ行・表記ゆれ）で、
+抽出プロファイルごとに指定件数のレコードを持つ入力を作る。
+乱数は seed 固定なので、同じ引数なら毎回同じデータになる。
+"""
+import random
+
+import pandas as pd
+
+PREFS = [
+    ("愛知県", "名古屋市中区", ["栄", "錦", "丸の内", "大須", "千代田"]),
+    ("愛知県", "豊田市", ["元城町", "挙母町", "喜多町", "若宮町", "小坂本町"]),
+    ("茨城県", "水戸市", ["南町", "泉町", "宮町", "三の丸", "千波町"]),
+    ("静岡県", "浜松市中央区", ["鍛冶町", "砂山町", "板屋町", "田町", "旭町"]),
+    ("大阪府", "大阪市北区", ["梅田", "曽根崎", "天満", "中之島", "西天満"]),
+]
+NAME_HEADS = ["トヨタ", "中部", "東海", "三河", "日本", "丸栄", "新和", "大成", "協和", "平和", "昭和", "富士"]
+NAME_TAILS = ["工業", "製作所", "精機", "金属", "化成", "物流", "運輸", "電機", "技研", "産業"]
+FORMS = ["株式会社{}", "{}株式会社", "(株){}", "{}（株）", "合同会社{}", "有限会社{}"]
+INDUSTRIES = ["金属加工業", "部品製造業", "運送会社", "倉庫", "プラスチック製品製造業", "建設会社", "自動車部品工場", "食品製造業"]
+AREA_CODES = ["052", "0565", "029", "053", "06", "03"]
+META_LINES = ["ウェブサイト", "ルート・乗換", "営業時間外 · 営業開始: 9:00", "共有", "オンラインで予約"]
+
+
+def _rng(seed):
+    return random.Random(seed)
+
+
+def company_name(r: random.Random, i: int) -> str:
+    base = f"{r.choice(NAME_HEADS)}{r.choice(NAME_TAILS)}{i}"
+    return r.choice(FORMS).format(base)
+
+
+def address(r: random.Random) -> str:
+    pref, city, towns = r.choice(PREFS)
+    return f"{pref}{city}{r.choice(towns)}{r.randint(1, 9)}丁目{r.randint(1, 30)}-{r.randint(1, 20)}"
+
+
+def phone(r: random.Random, i: int) -> str:
+    code = r.choice(AREA_CODES)
+    local = f"{i % 10000:04d}"
+    mid = f"{r.randint(100, 999)}" if len(code) <= 3 else f"{r.randint(10, 99)}"
+    if len(code) == 2:
+        mid = f"{r.randint(1000, 9999)}"
+    style = r.random()
+    if style < 0.1:
+        return f"+81 {code[1:]}-{mid}-{local}"
+    if style < 0.2:
+        return f"{code}{mid}{local}"
+    return f"{code}-{mid}-{local}"
+
+
+def google_vertical(n: int, seed: int = 1) -> pd.DataFrame:
+    """Google縦型: 企業名 / 業種 / 住所 / 電話 の4行1組（ときどき空行）"""
+    r = _rng(seed)
+    lines = []
+    for i in range(n):
+        lines += [company_name(r, i), r.choice(INDUSTRIES), address(r), phone(r, i)]
+        if r.random() < 0.2:
+            lines.append("")
+    return pd.DataFrame({0: lines})
+
+
+def google_free_vertical(n: int, seed: int = 2) -> pd.DataFrame:
+    """Google縦型（業種＋住所同セル）: 評価行・メタ行・『クチコミはありません』を混ぜる"""
+    r = _rng(seed)
+    lines = []
+    for i in range(n):
+        lines.append(company_name(r, i))
+        if r.random() < 0.3:
+            lines.append("クチコミはありません")
+            lines.append(f"{r.choice(INDUSTRIES)} · {address(r)}")
+        else:
+            lines.append(f"{r.randint(1, 4)}.{r.randint(0, 9)}({r.randint(1, 300)})")
+            lines.append(f"{r.choice(INDUSTRIES)} · {address(r)}")
+            lines.append(r.choice(META_LINES))
+        lines.append(phone(r, i))
+        lines += r.sample(META_LINES, k=r.randint(0, 2))
+    return pd.DataFrame({0: lines})
+
+
+def shigoto_arua(n: int, seed: int = 3) -> pd.DataFrame:
+    """シゴトアルワ: 企業名行のあとに 住所/電話番号/業種 のキー・値が縦に並ぶ2列型"""
+    r = _rng(seed)
+    rows = []
+    for i in range(n):
+        rows.append([company_name(r, i), ""])
+        rows.append([r.choice(["住所", "所在地", "本社所在地"]), address(r)])
+        rows.append([r.choice(["電話番号", "TEL", "電話"]), phone(r, i)])
+        rows.append([r.choice(["業種", "事業内容"]), r.choice(INDUSTRIES)])
+        if r.random() < 0.3:
+            rows.append(["従業員数", f"{r.randint(5, 500)}名"])
+    return pd.DataFrame(rows)
+
+
+def warehouse_association(n: int, seed: int = 4) -> pd.DataFrame:
+    """日本倉庫協会: A=企業名(+営業所/会社HP), B=〒＋住所（複数行）, C=TEL/FAX, D=業種 の4列型"""
+    r = _rng(seed)
+    rows = []
+    for i in range(n):
+        tel = phone(r, i)
+        rows.append([company_name(r, i), f"〒{r.randint(100, 999)}-{r.randint(0, 9999):04d}",
+                     f"TEL {tel} FAX {tel[:-1]}9", r.choice(["普通倉庫", "冷蔵倉庫", "危険品倉庫"])])
+        addr = address(r)
+        rows.append([f"{r.choice(['名古屋', '豊田', '水戸'])}営業所", addr[:8], "", ""])
+        rows.append(["会社HP", addr[8:], "", ""])
+        if r.random() < 0.3:
+            rows.append(["", "", "", ""])
+    return pd.DataFrame(rows)
+
+
+def ng_list(n: int, source: pd.DataFrame = None, overlap: float = 0.05, seed: int = 5) -> pd.DataFrame:
+    """
+    NGリスト（1列目=企業名, 2列目=電話番号）。
+    source（抽出済みの 企業名/電話番号 を持つ DataFrame）を渡すと、その一部を混ぜてヒットさせる。
+    """
+    r = _rng(seed)
+    names = [company_name(r, 900000 + i) for i in range(n)]
+    phones = [phone(r, 900000 + i) for i in range(n)]
+    if source is not None and len(source):
+        k = min(int(n * overlap), len(source))
+        picked = source.sample(n=k, random_state=seed)
+        names[:k] = picked["企業名"].tolist()
+        phones[:k] = picked["電話番号"].tolist()
+    return pd.DataFrame({"企業名": names, "電話番号": phones})
+
+
+def ken_all_subset(towns_per_city: int = 200, seed: int = 6) -> pd.DataFrame:
+    """KEN_ALL 互換（G列=都道府県, H列=市区町村, I列=町域名）の小さな部分集合"""
+    r = _rng(seed)
+    rows = []
+    for pref, city, towns in PREFS:
+        names = list(towns) + [f"{r.choice(NAME_HEADS)}町{j}" for j in range(towns_per_city - len(towns))]
+        for town in names:
+            rows.append(["", "", "", "", "", "", pref, city, town])
+    return pd.DataFrame(rows)
+
+
+PROFILE_GENERATORS = {
+    "google_vertical": google_vertical,
+    "google_free_vertical": google_free_vertical,
+    "shigoto_arua": shigoto_arua,
+    "warehouse_association": warehouse_association,
+}
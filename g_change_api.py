@@ -0,0 +1,455 @@
+"""
+G-Change Next のローカル HTTP API（スクレイプ処理から結果を自動で受け渡すためのもの）。
+
+起動（リポジトリ直下で）:
+    python g_change_api.py                 # 127.0.0.1:8765 で待ち受け
+    GCHANGE_API_TOKEN=xxxx python g_change_api.py --port 9000
+
+エンドポイント:
+    POST   /jobs?profile=...&industry=...&nglist=...&pref=...&city=...
+           本文 = 整形対象の xlsx / csv / tsv / parquet（生バイト）。 → 202 {"id", "status", ...}
+           形式は name=ファイル名 の拡張子で判別する（省略時は xlsx）。
+           profile は auto（既定・先頭行から自動判定）か、profiles/*.json の id
+           （google_vertical / google_free_vertical / shigoto_arua / warehouse_association など）。
+           任意: fuzzy=0.80（NG企業名あいまい照合のしきい値）,
+                 dedup_company=1（企業名＋住所が似ている行も重複として除去する。既定はしない）,
+                 sheets=シート1,シート2（xlsx の抽出するシート。省略時はすべてのシートを並行して抽出し、
+                                       1つにまとめてから照合・重複除去する。取り出したシートは『シート』列に残る）,
+                 chunked=1（100万行級向けの分割処理。結果は /result の xlsx（整形済み＋削除ログ）だけで、
+                            企業名＋住所の重複除去・結果ストアへの保存・template.xlsx への書き込みはしない）
+    GET    /jobs/<id>           ジョブの状態・進捗・各ステージの除外件数
+    GET    /jobs/<id>/result    template.xlsx へ書き込んだ結果（完了後のみ）
+    GET    /jobs/<id>/removals  削除ログ（完了後のみ、?format=csv|parquet、既定 csv）
+    GET    /jobs/<id>/cleaned   整形済みデータ＋電話キー・市区町村（完了後のみ、?format=csv|parquet）
+    DELETE /jobs/<id>           キャンセル
+    GET    /stored              結果ストアに保存済みのリスト一覧
+    DELETE /stored/<file_id>    保存済みのリストを削除
+    POST   /stored/<file_id>/jobs?industry=...&nglist=...&pref=...&city=...&area=水戸市,日立市
+           保存済みの行から作り直す（本文なし）。area は住所から取った市区町村での絞り込み。
+           結果は /jobs/<id> 以下で同じように取得する
+    GET    /health              ワーカーの稼働状況
+
+待機中＋実行中のジョブが GCHANGE_API_MAX_ACTIVE_JOBS（既定 20）件に達すると、POST は 429 を返す。
+GCHANGE_API_TOKEN を設定した場合は、リクエストに
+「Authorization: Bearer <トークン>」または「X-API-Token: <トークン>」が必要。
+NGリスト・町域辞書・template.xlsx は一度読んだらプロセス内に保持し、
+ファイルが更新されたとき（mtime が変わったとき）だけ読み直す。
+--prewarm（または GCHANGE_PREWARM=1）なら待ち受け前にそれらを読み込んでおく。
+GCHANGE_STORE_PATH を設定すると（1 ならアプリ直下、パスならその場所）、POST /jobs で処理した行を
+結果ストアにも保存する（最初に処理したときだけ。保存しておくのは新しい GCHANGE_STORE_MAX_FILES 件まで）。
+"""
+import argparse
+import hmac
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit
+
+from g_change_core import (
+    EXPORT_FORMATS,
+    PROFILE_AUTO,
+    PROFILE_IDS,
+    PROFILES,
+    REMOVAL_COUNT_KEYS,
+    TEMPLATE_FILENAME,
+    JobManager,
+    cached_city_town_index,
+    cached_ng_data,
+    cached_template_bytes,
+    cleaned_export_frame,
+    export_frame_bytes,
+    find_ken_all,
+    find_nglist,
+    normalize_text,
+    open_result_store,
+    prewarm,
+    prewarm_enabled,
+    process_file,
+    process_stored,
+    removal_log_frame,
+    run_pipeline_chunked,
+)
+
+APP_DIR = Path(__file__).resolve().parent
+
+# スクリプトから指定しやすい英字の別名（profiles/*.json の id）
+PROFILE_ALIASES = {"auto": PROFILE_AUTO, **PROFILE_IDS}
+INDUSTRY_OPTIONS = ("製造業", "物流業", "その他")
+INDUSTRY_ALIASES = {"manufacturing": "製造業", "logistics": "物流業", "other": "その他"}
+
+MAX_UPLOAD_BYTES = int(os.environ.get("GCHANGE_API_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+MAX_KEPT_JOBS = int(os.environ.get("GCHANGE_API_MAX_KEPT_JOBS", "200"))
+MAX_ACTIVE_JOBS = int(os.environ.get("GCHANGE_API_MAX_ACTIVE_JOBS", "20"))
+STORED_JOBS_RE = re.compile(r"^/stored/(\d+)/jobs$")
+STORED_FILE_RE = re.compile(r"^/stored/(\d+)$")
+JOB_ID_RE = re.compile(r"^/jobs/([0-9a-f]{32})(/result|/removals|/cleaned)?$")
+EXPORT_MIME = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+class ApiError(Exception):
+    """クライアントへそのまま返すエラー（status と メッセージ）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# ===============================
+# 参照データ（プロセス内キャッシュ）
+# ===============================
+def ng_data(nglist: str):
+    """NGリスト名（拡張子なし、UI の選択肢と同じ）から (企業名, 電話キー, インデックス) を返す"""
+    path = find_nglist(APP_DIR, nglist)
+    if path is None:
+        raise ApiError(400, f"NGリストが見つかりません: {nglist}")
+    return cached_ng_data(path)
+
+def town_tokens_for(pref: str, city: str) -> frozenset:
+    if find_ken_all(APP_DIR) is None:
+        raise ApiError(400, "KEN_ALL.xlsx / KEN_ALL.csv が無いため市区町村フィルタは使えません。")
+    index = cached_city_town_index(APP_DIR)
+    tokens = index.get((normalize_text(pref), normalize_text(city)))
+    if not tokens:
+        raise ApiError(400, f"KEN_ALL に『{pref} {city}』の町域が見つかりません。")
+    return frozenset(tokens)
+
+def template_bytes() -> bytes:
+    path = APP_DIR / TEMPLATE_FILENAME
+    if not path.exists():
+        raise ApiError(500, f"template.xlsx が見つかりません（期待パス: {path}）")
+    return cached_template_bytes(path)
+
+
+# ===============================
+# ジョブ登録
+# ===============================
+def resolve_profile(value: str) -> str:
+    if value in PROFILES or value == PROFILE_AUTO:
+        return value
+    if value in PROFILE_ALIASES:
+        return PROFILE_ALIASES[value]
+    raise ApiError(400, f"profile が不正です: {value}（{', '.join(PROFILE_ALIASES)} または画面の表示名）")
+
+def resolve_industry(value: str) -> str:
+    value = INDUSTRY_ALIASES.get(value, value)
+    if value not in INDUSTRY_OPTIONS:
+        raise ApiError(400, f"industry が不正です: {value}（{', '.join(INDUSTRY_OPTIONS)}）")
+    return value
+
+def job_kwargs(params: dict) -> dict:
+    """クエリパラメータを process_file の引数に変換する（不正なら ApiError）"""
+    def get(key, default=""):
+        return params.get(key, [default])[0].strip()
+
+    kwargs = {
+        "profile": resolve_profile(get("profile", "auto")),
+        "industry_option": resolve_industry(get("industry", "その他")),
+        "file_name": get("name"),
+        "dedup_company_address": get("dedup_company", "0") in ("1", "true", "yes"),
+        "chunked": get("chunked", "0") in ("1", "true", "yes"),
+        "sheets": [s.strip() for s in get("sheets").split(",") if s.strip()] or None,
+    }
+    pref, city = get("pref"), get("city")
+    if pref or city:
+        if not (pref and city):
+            raise ApiError(400, "市区町村フィルタには pref と city の両方が必要です。")
+        kwargs["town_tokens"] = town_tokens_for(pref, city)
+
+    nglist = get("nglist")
+    if nglist and nglist != "なし":
+        try:
+            kwargs["ng_names"], kwargs["ng_phones"], ng_index = ng_data(nglist)
+        except ValueError as e:
+            raise ApiError(400, str(e))
+        fuzzy = get("fuzzy")
+        if fuzzy:
+            try:
+                threshold = float(fuzzy)
+            except ValueError:
+                raise ApiError(400, f"fuzzy は 0〜1 の数値で指定してください: {fuzzy}")
+            if not 0.0 < threshold <= 1.0:
+                raise ApiError(400, f"fuzzy は 0〜1 の数値で指定してください: {fuzzy}")
+            kwargs["ng_index"] = ng_index
+            kwargs["ng_fuzzy_threshold"] = threshold
+    return kwargs
+
+
+def stored_job_kwargs(params: dict) -> dict:
+    """保存済みリストの作り直し用: 抽出関係の指定を外し、area（市区町村の絞り込み）を足す"""
+    kwargs = job_kwargs(params)
+    kwargs.pop("profile")
+    kwargs.pop("file_name")
+    kwargs.pop("chunked")
+    kwargs.pop("sheets")
+    areas = [a.strip() for a in params.get("area", [""])[0].split(",") if a.strip()]
+    kwargs["municipalities"] = areas or None
+    return kwargs
+
+
+class JobRegistry:
+    """
+    API から投げたジョブを id で引けるように保持する。
+    終わったジョブは MAX_KEPT_JOBS 件を超えたら古いものから捨てる（結果の xlsx を抱えたままにしない）。
+    """
+
+    def __init__(self, manager: JobManager, store=None, max_kept: int = MAX_KEPT_JOBS,
+                 max_active: int = MAX_ACTIVE_JOBS):
+        self.manager = manager
+        self.store = store
+        self.max_kept = max_kept
+        self.max_active = max_active
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, owner: str, data: bytes, kwargs: dict):
+        """アップロードされたファイルを処理するジョブ（chunked なら分割処理）"""
+        if kwargs.pop("chunked", False):
+            kwargs.pop("dedup_company_address", None)
+            return self._submit(owner, run_pipeline_chunked, data, **kwargs)
+        return self._submit(owner, process_file, data, template_bytes(), store=self.store, **kwargs)
+
+    def submit_stored(self, owner: str, file_id: int, kwargs: dict):
+        """結果ストアの保存済みの行から作り直すジョブ"""
+        if self.store is None:
+            raise ApiError(400, "結果ストアが無効です（GCHANGE_STORE_PATH を設定してください）。")
+        if self.store.file_info(file_id) is None:
+            raise ApiError(404, f"保存済みのリストが見つかりません: {file_id}")
+        return self._submit(owner, process_stored, self.store, file_id, template_bytes(), **kwargs)
+
+    def delete_stored(self, file_id: int) -> dict:
+        """結果ストアの保存済みのリストを削除して、その情報を返す"""
+        if self.store is None:
+            raise ApiError(400, "結果ストアが無効です（GCHANGE_STORE_PATH を設定してください）。")
+        info = self.store.file_info(file_id)
+        if info is None:
+            raise ApiError(404, f"保存済みのリストが見つかりません: {file_id}")
+        self.store.delete(file_id)
+        return info
+
+    def _submit(self, owner: str, fn, *args, **kwargs):
+        """
+        ジョブを投入して保持する。待機中＋実行中が max_active 件に達していたら 429 で断る
+        （終わったジョブしか捨てないので、上限が無いと待ち行列がいくらでも伸びる）。
+        """
+        with self._lock:
+            active = sum(not j.done for j in self._jobs.values())
+            if active >= self.max_active:
+                raise ApiError(429, f"待機中・実行中のジョブが上限（{self.max_active}件）に達しています。"
+                                    "しばらくしてから送ってください。")
+            job = self.manager.submit(owner, fn, *args, **kwargs)
+            self._jobs[job.id] = job
+            finished = [jid for jid, j in self._jobs.items() if j.done]
+            for jid in finished[:max(0, len(self._jobs) - self.max_kept)]:
+                del self._jobs[jid]
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise ApiError(404, f"ジョブが見つかりません: {job_id}")
+        return job
+
+
+def job_status(job) -> dict:
+    status = {
+        "id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": round(job.progress, 3),
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == "done":
+        res = job.result
+        status["profile"] = res["profile"]
+        status["sheets"] = res["sheets"]
+        status["rows"] = res["rows"] if res["df"] is None else len(res["df"])
+        status["removed"] = {key: res[key] for key in REMOVAL_COUNT_KEYS}
+        status["metrics"] = res["metrics"].to_dict()
+    return status
+
+def finished_result(job):
+    if job.status in ("queued", "running"):
+        raise ApiError(409, f"ジョブはまだ完了していません（{job.status}）")
+    if job.status != "done":
+        raise ApiError(409, f"ジョブは完了しませんでした（{job.status}）: {job.error or ''}")
+    return job.result
+
+
+# ===============================
+# HTTP ハンドラ
+# ===============================
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "GChangeAPI/1.0"
+    registry: JobRegistry = None
+    token: str = ""
+
+    def do_GET(self):
+        self._dispatch(self._get)
+
+    def do_POST(self):
+        self._dispatch(self._post)
+
+    def do_DELETE(self):
+        self._dispatch(self._delete)
+
+    def _dispatch(self, handler):
+        try:
+            self._check_token()
+            handler(urlsplit(self.path))
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _check_token(self):
+        if not self.token:
+            return
+        auth = self.headers.get("Authorization", "")
+        given = auth[7:] if auth.startswith("Bearer ") else self.headers.get("X-API-Token", "")
+        if not hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+            raise ApiError(401, "認証トークンが違います。")
+
+    def _owner(self) -> str:
+        """同時実行数の上限は呼び出し元ごと（X-Client-Id ヘッダ、無ければ接続元アドレス）にかける"""
+        return self.headers.get("X-Client-Id") or self.client_address[0]
+
+    def _get(self, url):
+        if url.path == "/health":
+            self._send_json(200, self.registry.manager.stats())
+            return
+        if url.path == "/stored":
+            store = self.registry.store
+            files = store.list_files().to_dict(orient="records") if store is not None else []
+            self._send_json(200, {"files": files})
+            return
+        m = JOB_ID_RE.match(url.path)
+        if not m:
+            raise ApiError(404, f"不明なパスです: {url.path}")
+        job = self.registry.get(m.group(1))
+        if m.group(2) is None:
+            self._send_json(200, job_status(job))
+        elif m.group(2) == "/result":
+            res = finished_result(job)
+            stem = Path(res["metrics"].file_name or "output").stem
+            self._send_bytes(
+                res["output"].getvalue(),
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                f"{stem}リスト.xlsx" if res["df"] is not None else f"{stem}_整形済み.xlsx",
+            )
+        else:
+            res = finished_result(job)
+            if res["df"] is None:
+                raise ApiError(400, "分割処理のジョブは、整形済みデータと削除ログを /result の xlsx に入れています。")
+            fmt = parse_qs(url.query).get("format", ["csv"])[0]
+            if fmt not in EXPORT_FORMATS:
+                raise ApiError(400, f"format は {' / '.join(EXPORT_FORMATS)} のどれかです: {fmt}")
+            stem = Path(res["metrics"].file_name or "output").stem
+            if m.group(2) == "/removals":
+                frame, out_name = removal_log_frame(res["removal_logs"]), f"removal_logs_{stem}.{fmt}"
+            else:
+                frame, out_name = cleaned_export_frame(res["df"]), f"{stem}_cleaned.{fmt}"
+            try:
+                body = export_frame_bytes(frame, fmt)
+            except ValueError as e:
+                raise ApiError(400, str(e))
+            self._send_bytes(body, EXPORT_MIME[fmt], out_name)
+
+    def _post(self, url):
+        m = STORED_JOBS_RE.match(url.path)
+        if m:
+            kwargs = stored_job_kwargs(parse_qs(url.query))
+            job = self.registry.submit_stored(self._owner(), int(m.group(1)), kwargs)
+            self._send_json(202, job_status(job))
+            return
+        if url.path != "/jobs":
+            raise ApiError(404, f"不明なパスです: {url.path}")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise ApiError(400, "本文に整形対象のファイルを入れてください。")
+        if length > MAX_UPLOAD_BYTES:
+            raise ApiError(413, f"ファイルが大きすぎます（上限 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB）")
+        kwargs = job_kwargs(parse_qs(url.query))
+        data = self.rfile.read(length)
+        job = self.registry.submit(self._owner(), data, kwargs)
+        self._send_json(202, job_status(job))
+
+    def _delete(self, url):
+        m = STORED_FILE_RE.match(url.path)
+        if m:
+            self._send_json(200, {"deleted": self.registry.delete_stored(int(m.group(1)))})
+            return
+        m = JOB_ID_RE.match(url.path)
+        if not m or m.group(2):
+            raise ApiError(404, f"不明なパスです: {url.path}")
+        job = self.registry.get(m.group(1))
+        job.cancel()
+        self._send_json(202, job_status(job))
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self._send_bytes(body, "application/json; charset=utf-8", status=status)
+
+    def _send_bytes(self, body: bytes, content_type: str, file_name: str = "", status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if file_name:
+            # 日本語ファイル名は RFC 5987 形式で渡す
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(file_name)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host: str, port: int, token: str = "", manager: JobManager = None,
+                store=None) -> ThreadingHTTPServer:
+    """
+    ハンドラにジョブ管理・結果ストア・トークンを持たせたサーバーを作る（serve_forever は呼び出し側で）。
+    store を省略すると open_result_store()（GCHANGE_STORE_PATH）を使う。
+    """
+    if manager is None:
+        manager = JobManager(
+            max_workers=int(os.environ.get("GCHANGE_MAX_WORKERS", "4")),
+            per_owner_limit=int(os.environ.get("GCHANGE_MAX_JOBS_PER_SESSION", "2")),
+        )
+    if store is None:
+        store = open_result_store()
+    handler = type("BoundApiHandler", (ApiHandler,), {"registry": JobRegistry(manager, store), "token": token})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=os.environ.get("GCHANGE_API_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.environ.get("GCHANGE_API_PORT", "8765")))
+    ap.add_argument("--prewarm", action="store_true", default=prewarm_enabled(),
+                    help="待ち受け前に KEN_ALL・NGリスト・template.xlsx を読み込んでおく（GCHANGE_PREWARM=1 と同じ）")
+    args = ap.parse_args(argv)
+
+    token = os.environ.get("GCHANGE_API_TOKEN", "")
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not token:
+        print("⚠ ローカル以外で待ち受ける場合は GCHANGE_API_TOKEN を設定してください。")
+        return 1
+    if args.prewarm:
+        for name, sec in prewarm(APP_DIR).items():
+            print(f"  prewarm {name}: {sec}")
+    server = make_server(args.host, args.port, token)
+    print(f"G-Change Next API: http://{args.host}:{args.port}/ （Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,2654 @@
+"""
+G-Change Next の処理本体（Streamlit に依存しない部分）。
+
+画面（g_change_next.py）・ベンチマーク・バッチ処理から同じ関数を使えるように、
+正規化・抽出プロファイル・フィルタ・NG照合・テンプレート書き込みをここにまとめている。
+"""
+import re
+import unicodedata
+import codecs
+import io
+import json
+import hashlib
+import os
+import sqlite3
+import time
+import threading
+import tracemalloc
+import uuid
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from copy import copy
+from itertools import chain, groupby
+from difflib import SequenceMatcher
+from functools import lru_cache
+from operator import itemgetter
+from importlib import import_module
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# openpyxl は template.xlsx へ書き込むときに初めて import する（起動を軽くするため）。
+# 先に読み込んでおきたい場合は prewarm() を使う。
+OPENPYXL_MODULES = ["openpyxl", "openpyxl.styles", "openpyxl.worksheet.datavalidation"]
+
+# ===============================
+# テキスト正規化
+# ===============================
+def nfkc(s: str) -> str:
+    return unicodedata.normalize("NFKC", s)
+
+def normalize_text(x):
+    if x is None or (isinstance(x, float) and pd.isna(x)):
+        return ""
+    s = str(x).replace("\u3000", " ").replace("\xa0", " ")
+    s = re.sub(r'[−–—―ー]', '-', s)
+    return nfkc(s).strip()
+
+def clean_address(address: str) -> str:
+    address = normalize_text(address)
+    return address.strip()
+
+def extract_industry(line: str) -> str:
+    return normalize_text(line)
+
+# ===============================
+# 企業名正規化（NG照合用）
+# ===============================
+COMPANY_SUFFIXES = ["株式会社", "(株)", "（株）", "有限会社", "(有)", "（有）", "合同会社"]
+def canonical_company_name(name: str) -> str:
+    s = normalize_text(name)
+    for suf in sorted(COMPANY_SUFFIXES, key=len, reverse=True):
+        s = s.replace(suf, "")
+    s = re.sub(r"[\s\-・/,.·･\(\)（）【】＆&＋+_|]", "", s)
+    return s
+
+# ===============================
+# 電話番号処理（原文保持）
+# ===============================
+HYPHENS = "-‒–—―−－ー‐﹣\u2011"
+HYPHENS_CLASS = re.escape(HYPHENS)
+
+# 電話番号候補抽出（誤検出防止）: 数字＋ハイフン/空白が続く8文字以上の塊
+CANDIDATE_RE = re.compile(rf"[+]?\d(?:[\d{HYPHENS_CLASS}\s]{{6,}})\d")
+
+def pick_phone_token_raw(line: str) -> str:
+    """1行から電話番号らしい文字列を抽出。digits 長が 9〜11 以外は不採用。原文表記（ハイフン位置）をそのまま返す。"""
+    if not line:
+        return ""
+    s = unicodedata.normalize("NFKC", str(line))
+    raw_cands = CANDIDATE_RE.findall(s)
+    cands = []
+    for token in raw_cands:
+        tok = token.strip()
+        if ":" in tok:           # 時刻混入などは除外
+            continue
+        digits = re.sub(r"\D", "", tok)
+        if not (9 <= len(digits) <= 11):
+            continue             # 11-10 のような短い塊は除外
+        if not (digits.startswith("0") or digits.startswith("81")):
+            continue             # 国内先頭0 or 国番号81のみ許可
+        score = (len(digits), tok.count("-"))  # 長いdigits＆ハイフン多い＝電話っぽい
+        cands.append((score, tok))
+    if not cands:
+        return ""
+    cands.sort(key=lambda x: x[0], reverse=True)
+    return cands[0][1]
+
+def phone_digits_only(s: str) -> str:
+    """内部照合用に数字だけ抽出（原文表記は保持）"""
+    return re.sub(r"\D", "", str(s or ""))
+
+# ===============================
+# 電話番号の正規化キー（NG照合・重複判定用）
+# ===============================
+MOBILE_PREFIXES = ("060", "070", "080", "090")
+FREE_DIAL_PREFIXES = ("0120", "0800")
+
+def canonical_phone_keys(phones: pd.Series) -> pd.DataFrame:
+    """
+    電話番号の列をまとめて正規化する（行ごとの Python ループなし）。
+    ・全角数字は半角にそろえる（原文保持の電話番号セルには全角のものもある）
+    ・+81 / 81 始まりは国内表記（0始まり）に直す: +81 52-xxx-xxxx → 052xxxxxxx
+    ・Excel で数値になり先頭の0が落ちたもの（9〜10桁）は0を補う
+    ・国内表記で10〜11桁、かつ 00 始まり・全桁0 ではないものだけを有効とする
+    ・ただし 0 始まりの9桁（03-1234-567 のような桁落ちの入力ミス）は、補正せずに原文の数字のまま
+      キーにする（以前と同じく、同じ書き間違い同士の重複判定と NGリストとの照合だけは効くように）
+    戻り値の列:
+      digits : 国内表記の数字列（無効なら ""）… 削除ログ表示用
+      key    : digits を整数にしたもの（Int64、無効なら <NA>）… 照合・重複判定用
+               先頭は必ず0なので、9桁・10桁・11桁の番号が同じ整数になることはない
+      type   : landline / mobile / free / other（0始まり9桁は other、無効なら ""）
+    """
+    s = phones.astype(str).str.normalize("NFKC").str.replace(r"\.0$", "", regex=True)
+    d = s.str.replace(r"[^0-9]", "", regex=True)  # \D だと全角数字も残るので ASCII の数字だけにする
+    intl = d.str.startswith("81") & d.str.len().between(10, 12)
+    d = d.where(~intl, "0" + d.str[2:].str.lstrip("0"))
+    lost_zero = ~intl & ~d.str.startswith("0") & d.str.len().between(9, 10)
+    d = d.where(~lost_zero, "0" + d)
+    short = ~intl & d.str.len().eq(9)  # 0 始まりの9桁（lost_zero で補った番号は10桁になっている）
+    valid = (
+        d.str.startswith("0")
+        & ~d.str.startswith("00")
+        & (d.str.len().between(10, 11) | short)
+        & (d.str.strip("0") != "")
+    )
+    digits = d.where(valid, "")
+    key = pd.to_numeric(digits.where(valid), errors="coerce").astype("Int64")
+
+    phone_type = pd.Series("landline", index=phones.index)
+    phone_type = phone_type.mask(digits.str.len().eq(11) & digits.str[:3].isin(MOBILE_PREFIXES), "mobile")
+    phone_type = phone_type.mask(digits.str.startswith(FREE_DIAL_PREFIXES), "free")
+    phone_type = phone_type.mask(digits.str.startswith(("050", "0570", "020")) | short, "other")
+    phone_type = phone_type.where(valid, "")
+    return pd.DataFrame({"digits": digits, "key": key, "type": phone_type}, index=phones.index)
+
+# ===============================
+# 住所らしさ・営業時間行の判定（抽出・自動判定で共用）
+# ===============================
+JP_LOC_PATTERN = re.compile(r"(丁目|番地?|号|市|区|町|村|郡|県|府|道)")
+
+def is_hours_or_business_line(text: str) -> bool:
+    """営業時間・診療時間系の行かどうか（住所候補からは除外）"""
+    t = normalize_text(text)
+    if not t:
+        return False
+    keywords = [
+        "営業時間", "営業中", "営業時間外", "営業開始",
+        "まもなく営業開始", "診療時間", "診察時間", "24時間営業",
+    ]
+    return any(k in t for k in keywords)
+
+def is_address_like(text: str) -> bool:
+    """住所らしいかどうかのゆるい判定（Google縦型の旧ロジック用）"""
+    t = normalize_text(text)
+    if not t:
+        return False
+
+    # ★ 営業時間系の行は住所扱いしない
+    if is_hours_or_business_line(t):
+        return False
+
+    has_digit = bool(re.search(r"\d", t))
+    has_loc_word = bool(JP_LOC_PATTERN.search(t))
+    has_block = bool(re.search(r"\d{1,3}[-－ー‐]\d{1,3}", t))
+
+    if has_digit and (has_loc_word or has_block):
+        return True
+
+    # 数字がなくても「○○市」「○○町」など住所語だけのケースを弱めに許可
+    if has_loc_word and not has_digit:
+        return True
+
+    return False
+
+# ===============================
+# 抽出プロファイル（profiles/*.json を読み込んでスキャナにコンパイル）
+# ===============================
+# 入力レイアウトごとの抽出ルールはコードではなく profiles/ の JSON に書く。
+# kind ごとに同じスキャナ（列をまとめて前処理してから走査する）を使うので、
+# 新しい取得元は JSON を1つ置くだけで追加できる。
+#   anchor-offset : 電話行を起点に、決まった行数だけ上下の行を各項目として取る
+#   anchor-search : 電話行を起点に、ルール・ノイズ語・メタ行を見ながら企業名と「業種 · 住所」を探す
+#   key-value     : 企業名だけの行のあとに「見出し / 値」の行が続く
+#   block         : 開始パターン（郵便番号など）の行から次の開始行までを1社とする
+# 大きなファイルを分割して読むとき（run_pipeline_chunked）は、各スキャナの chunk_split が
+# 「チャンク内で完結したレコードの範囲」と「次のチャンクへ持ち越す行」を決める。
+PROFILE_DIR = Path(__file__).resolve().parent / "profiles"
+OUTPUT_COLUMNS = ["企業名", "業種", "住所", "電話番号"]
+FIELD_TRANSFORMS = {"raw": lambda s: s, "normalize": normalize_text}
+
+def _words_re(words):
+    """部分一致させたい語の一覧を1本の正規表現にまとめる（無ければ None）"""
+    return re.compile("|".join(re.escape(w) for w in words)) if words else None
+
+def _last_true_index(flags: list) -> list:
+    """各位置について、その位置以前で flags が True の最後の位置（無ければ -1）"""
+    out, last = [], -1
+    for i, f in enumerate(flags):
+        if f:
+            last = i
+        out.append(last)
+    return out
+
+def _output_frame(results: list) -> pd.DataFrame:
+    return pd.DataFrame(results, columns=OUTPUT_COLUMNS)
+
+def split_industry_address(text: str, separators=("·", "・", "･")):
+    """セル内の右端の区切り記号（既定は「·/・/･」）で業種と住所に分割"""
+    t = normalize_text(text)
+    if not t:
+        return "", ""
+    # 右から1つ目の区切りを探す
+    last_pos = max(t.rfind(ch) for ch in separators)
+    if last_pos == -1:
+        # 区切りがなければ全体を住所扱い
+        return "", t.strip()
+    left = t[:last_pos].strip()
+    right = t[last_pos + 1 :].strip()
+    if not right:
+        # 右側が空なら住所扱いに倒す
+        return "", left
+    return left, right
+
+
+class ProfileScanner:
+    """コンパイル済みの抽出プロファイル。extract() で抽出、score() で自動判定用の点数を返す"""
+
+    def __init__(self, spec: dict, source: str = ""):
+        self.id = spec["id"]
+        self.name = spec["name"]
+        self.description = spec.get("description", "")
+        self.order = spec.get("order", 100)
+        self.detect_priority = spec.get("detect_priority", 100)
+        self.source = source
+
+    def extract(self, df_like: pd.DataFrame) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def score(self, df_sample: pd.DataFrame) -> float:
+        """先頭行の並びがこの方式の「レコードらしい」割合（0〜1）"""
+        raise NotImplementedError
+
+    def chunk_split(self, df_like: pd.DataFrame):
+        """
+        分割処理用: (stop, keep_from) を返す。
+        起点が stop 行目より前のレコードはこの範囲だけで完結している。
+        keep_from 行目以降は次のチャンクの先頭へ持ち越す（keep_from〜stop は前後関係を見るためだけに使う）。
+        """
+        raise NotImplementedError
+
+    def extract_chunk(self, df_like: pd.DataFrame, skip: int, stop: int) -> pd.DataFrame:
+        """分割処理用: 起点が [skip, stop) 行目にあるレコードだけを抽出する（既定は行を切り出して extract）"""
+        return self.extract(df_like.iloc[skip:stop])
+
+
+class AnchorOffsetScanner(ProfileScanner):
+    """電話行からの相対位置（offset）で各項目を取る"""
+
+    def __init__(self, spec: dict, source: str = ""):
+        super().__init__(spec, source)
+        self.column = spec.get("column", 0)
+        self.skip_blank = spec.get("skip_blank", True)
+        self.fields = [
+            (col, f["offset"], FIELD_TRANSFORMS[f.get("transform", "normalize")])
+            for col, f in spec["fields"].items()
+        ]
+        # 電話行を含めた1レコードの行数（自動判定で電話行の間隔と比べる）
+        self.span = max(abs(off) for _, off, _ in self.fields) + 1
+        # 電話行より前・後ろに何行使うか（分割処理で持ち越す行数）
+        self.rows_before = max([0] + [-off for _, off, _ in self.fields])
+        self.rows_after = max([0] + [off for _, off, _ in self.fields])
+
+    def _rows(self, values) -> list:
+        rows = [str(v) for v in values]
+        return [r for r in rows if r.strip() != ""] if self.skip_blank else rows
+
+    def _positions(self, rows: list) -> list:
+        """_rows で残る行の、元の行番号"""
+        if not self.skip_blank:
+            return list(range(len(rows)))
+        return [i for i, r in enumerate(rows) if r.strip() != ""]
+
+    def extract_lines(self, lines, skip: int = 0, stop: int = None) -> pd.DataFrame:
+        """skip / stop を渡すと、元の行番号が [skip, stop) の電話行だけをレコードにする（分割処理用）"""
+        if skip == 0 and stop is None:
+            rows = self._rows(lines)
+            lo, hi = 0, len(rows)
+        else:
+            raw = [str(v) for v in lines]
+            pos = self._positions(raw)
+            rows = [raw[p] for p in pos]
+            lo, hi = bisect_left(pos, skip), bisect_left(pos, stop)
+        n = len(rows)
+        results = []
+        for i in range(lo, hi):
+            phone = pick_phone_token_raw(rows[i])
+            if not phone:
+                continue
+            rec = {"電話番号": phone}
+            for col, off, transform in self.fields:
+                j = i + off
+                rec[col] = transform(rows[j] if 0 <= j < n else "")
+            results.append([rec.get(c, "") for c in OUTPUT_COLUMNS])
+        return _output_frame(results)
+
+    def extract(self, df_like: pd.DataFrame) -> pd.DataFrame:
+        return self.extract_lines(df_like.iloc[:, self.column].tolist())
+
+    def extract_chunk(self, df_like: pd.DataFrame, skip: int, stop: int) -> pd.DataFrame:
+        return self.extract_lines(df_like.iloc[:, self.column].tolist(), skip, stop)
+
+    def chunk_split(self, df_like: pd.DataFrame):
+        """後ろに rows_after 行そろっている電話行までで区切り、その rows_before 行上から持ち越す"""
+        raw = [str(v) for v in df_like.iloc[:, self.column].tolist()]
+        pos = self._positions(raw)
+        n = len(pos)
+        stop_i = max(0, n - self.rows_after)
+        stop = pos[stop_i] if stop_i < n else len(raw)
+        keep_i = max(0, stop_i - self.rows_before)
+        return stop, (pos[keep_i] if keep_i < n else stop)
+
+    def score(self, df_sample: pd.DataFrame) -> float:
+        if df_sample.shape[1] <= self.column:
+            return 0.0
+        rows = self._rows(df_sample.iloc[:, self.column])
+        phone_pos = [i for i, r in enumerate(rows) if pick_phone_token_raw(r)]
+        if len(phone_pos) < DETECT_MIN_RECORDS:
+            return 0.0
+        gaps = [b - a for a, b in zip(phone_pos, phone_pos[1:])]
+        return sum(g == self.span for g in gaps) / len(gaps)
+
+
+class AnchorSearchScanner(ProfileScanner):
+    """
+    電話行から上にさかのぼって企業名と「業種 · 住所」のセルを探す。
+    行ごとの正規化・企業名らしさ・メタ行判定は最初に1回だけ計算し、
+    「その位置以前で最後に条件を満たす行」を配列で持っておくので、電話ごとの上方向スキャンは O(1)。
+    """
+
+    def __init__(self, spec: dict, source: str = ""):
+        super().__init__(spec, source)
+        self.column = spec.get("column", 0)
+        company = spec["company"]
+        self.company_rules = company.get("rules", [])
+        self.scan_up = company.get("scan_up", True)
+        self.noise_re = _words_re(company.get("noise_words", []))
+        self.reject_res = [re.compile(p) for p in company.get("reject_patterns", [])]
+        self.require_re = re.compile(company["require_pattern"]) if company.get("require_pattern") else None
+        meta = spec.get("meta", {})
+        self.meta_re = _words_re(meta.get("words", []))
+        self.meta_pattern_res = [re.compile(p) for p in meta.get("patterns", [])]
+        self.separators = tuple(spec.get("split_separators", ["·", "・", "･"]))
+        # 企業名ルールが見に行く一番上の行（電話行からの相対位置、分割処理で持ち越す行数）
+        self.rules_lookback = min(
+            [0] + [r["offset"] for r in self.company_rules] + [r.get("if_offset", 0) for r in self.company_rules]
+        )
+
+    def is_company_candidate(self, s: str) -> bool:
+        """正規化済みの行が企業名として使えそうかどうか"""
+        if not s:
+            return False
+        if self.noise_re is not None and self.noise_re.search(s):
+            return False
+        if any(r.match(s) for r in self.reject_res):
+            return False
+        if self.require_re is not None and not self.require_re.search(s):
+            return False
+        return True
+
+    def is_meta_line(self, t: str) -> bool:
+        """正規化済みの行がメタ情報行（住所・業種候補から外す）かどうか。空行もメタ扱い"""
+        if not t:
+            return True
+        if self.meta_re is not None and self.meta_re.search(t):
+            return True
+        return any(r.match(t) for r in self.meta_pattern_res)
+
+    def _company_index(self, i: int, norm: list, is_cand: list, last_cand: list):
+        company_idx = None
+        for rule in self.company_rules:
+            j = i + rule["offset"]
+            if j < 0:
+                continue
+            if "contains" in rule:
+                k = i + rule.get("if_offset", 0)
+                if k < 0 or rule["contains"] not in norm[k]:
+                    continue
+            company_idx = j
+            break
+        # 候補が企業名として微妙なら、上方向にスキャンして企業名らしい行を探す
+        if company_idx is not None and not is_cand[company_idx]:
+            company_idx = None
+        if company_idx is None and self.scan_up and i >= 1 and last_cand[i - 1] >= 0:
+            company_idx = last_cand[i - 1]
+        return company_idx
+
+    def extract(self, df_like: pd.DataFrame) -> pd.DataFrame:
+        return self.extract_chunk(df_like, 0, len(df_like))
+
+    def extract_chunk(self, df_like: pd.DataFrame, skip: int, stop: int) -> pd.DataFrame:
+        col = df_like.iloc[:, self.column].fillna("").astype(str).tolist()
+        norm = [normalize_text(c) for c in col]
+        is_cand = [self.is_company_candidate(s) for s in norm]
+        last_cand = _last_true_index(is_cand)
+        last_content = _last_true_index([not self.is_meta_line(t) for t in norm])
+
+        results = []
+        for i in range(skip, stop):
+            line = col[i]
+            phone = pick_phone_token_raw(line)
+            if not phone:
+                continue
+            company_idx = self._company_index(i, norm, is_cand, last_cand)
+            if company_idx is None:
+                # 企業名がどうしても見つからない場合はこの電話はスキップ
+                continue
+
+            # 業種＋住所セル: 電話の1行上から上へ、メタ行を飛ばして最初に見つかった行
+            industry = address = ""
+            indaddr_idx = last_content[i - 1] if i >= 1 else -1
+            if indaddr_idx >= 0:
+                ind_raw, addr_raw = split_industry_address(col[indaddr_idx], self.separators)
+                if addr_raw:
+                    industry = extract_industry(ind_raw)
+                    address = clean_address(addr_raw)
+                else:
+                    # 区切り記号が無い → 全体を住所扱い
+                    address = clean_address(col[indaddr_idx])
+            results.append([norm[company_idx], industry, address, phone])
+        return _output_frame(results)
+
+    def chunk_split(self, df_like: pd.DataFrame):
+        """
+        電話行は後ろを見ないので全行をこのチャンクで処理し、
+        次のチャンクの電話行がさかのぼって使いうる行（ルールの行・最後の企業名候補・最後の内容行）から持ち越す。
+        """
+        col = df_like.iloc[:, self.column].fillna("").astype(str).tolist()
+        n = len(col)
+        need_cand, need_content = self.scan_up, True
+        i = n - 1
+        while i >= 0 and (need_cand or need_content):
+            s = normalize_text(col[i])
+            if need_cand and self.is_company_candidate(s):
+                need_cand = False
+            if need_content and not self.is_meta_line(s):
+                need_content = False
+            i -= 1
+        return n, max(0, min(n + self.rules_lookback, i + 1))
+
+    def score(self, df_sample: pd.DataFrame) -> float:
+        """電話行の直前4行以内に「業種 · 住所」のセルがある割合"""
+        if df_sample.shape[1] <= self.column:
+            return 0.0
+        lines = [l for l in df_sample.iloc[:, self.column].astype(str) if l.strip()]
+        phone_pos = [i for i, l in enumerate(lines) if pick_phone_token_raw(l)]
+        if len(phone_pos) < DETECT_MIN_RECORDS:
+            return 0.0
+        hits = 0
+        for p in phone_pos:
+            for line in lines[max(0, p - 4):p]:
+                industry, address = split_industry_address(line, self.separators)
+                if industry and is_address_like(address):
+                    hits += 1
+                    break
+        return hits / len(phone_pos)
+
+
+class KeyValueScanner(ProfileScanner):
+    """
+    企業名だけの行（見出し列のみ・値列が空）でレコードを区切り、
+    そのあとの「見出し / 値」行を各項目に割り当てる（同じ項目が複数あれば後勝ち）。
+    行ループは使わず、列ごとの isin と groupby で組み立てる。
+    """
+
+    def __init__(self, spec: dict, source: str = ""):
+        super().__init__(spec, source)
+        self.key_column = spec.get("key_column", 0)
+        self.value_column = spec.get("value_column", 1)
+        self.keys = [
+            (col, list(k["labels"]), FIELD_TRANSFORMS[k.get("transform", "normalize")])
+            for col, k in spec["keys"].items()
+        ]
+        self.all_labels = [label for _, labels, _ in self.keys for label in labels]
+
+    def _columns(self, df_like: pd.DataFrame):
+        df = df_like.fillna("")
+        keys = df.iloc[:, self.key_column].astype(str)
+        if df.shape[1] > self.value_column:
+            vals = df.iloc[:, self.value_column].astype(str)
+        else:
+            vals = pd.Series("", index=df.index)
+        return keys.reset_index(drop=True), vals.reset_index(drop=True)
+
+    def extract(self, df_like: pd.DataFrame) -> pd.DataFrame:
+        keys, vals = self._columns(df_like)
+        is_key = keys.isin(self.all_labels)
+        name_rows = keys.ne("") & vals.eq("") & ~is_key
+        n_names = int(name_rows.sum())
+        if not n_names:
+            return _output_frame([])
+        # 最初の企業名より前の見出し行は、最初の企業に付く
+        group = name_rows.cumsum().clip(lower=1)
+
+        out = {"企業名": keys[name_rows].tolist()}
+        for col, labels, transform in self.keys:
+            hit = keys.isin(labels)
+            values = vals[hit].map(transform)
+            last = values.groupby(group[hit]).last()
+            out[col] = last.reindex(range(1, n_names + 1)).fillna("").tolist()
+        return pd.DataFrame(out).reindex(columns=OUTPUT_COLUMNS, fill_value="")
+
+    def score(self, df_sample: pd.DataFrame) -> float:
+        """企業名行のあとに見出し行が続く割合"""
+        if df_sample.shape[1] <= max(self.key_column, self.value_column):
+            return 0.0
+        keys, vals = self._columns(df_sample)
+        keys, vals = keys.str.strip(), vals.str.strip()
+        key_rows = keys.isin(self.all_labels) & vals.ne("")
+        name_rows = keys.ne("") & vals.eq("") & ~keys.isin(self.all_labels)
+        n_names = int(name_rows.sum())
+        if n_names < DETECT_MIN_RECORDS:
+            return 0.0
+        has_key = key_rows.groupby(name_rows.cumsum()).any().drop(0, errors="ignore")
+        return float(has_key.sum()) / n_names
+
+    def chunk_split(self, df_like: pd.DataFrame):
+        """最後の企業名行から持ち越す（企業名が1つしか無ければ、前に付く見出し行ごと全部持ち越す）"""
+        keys, vals = self._columns(df_like)
+        name_rows = keys.ne("") & vals.eq("") & ~keys.isin(self.all_labels)
+        starts = name_rows.index[name_rows]
+        if len(starts) < 2:
+            return 0, 0
+        return int(starts[-1]), int(starts[-1])
+
+
+class BlockScanner(ProfileScanner):
+    """
+    開始列が start_pattern に一致する行から、次の一致行の手前までを1社とする。
+    ・電話列に require_phone_word が無い開始行はレコードにしない
+    ・企業名: 開始行の企業名列＋その下に続く行（空行か name_stop_words まで）を結合
+    ・住所  : 開始行の次から、住所列の非空セルを上から結合
+    ・業種  : 開始行の業種列
+    """
+
+    def __init__(self, spec: dict, source: str = ""):
+        super().__init__(spec, source)
+        self.columns = spec["columns"]
+        self.start_re = re.compile(spec["start_pattern"])
+        self.require_phone_word = spec.get("require_phone_word", "").upper()
+        self.name_stop_words = set(spec.get("name_stop_words", []))
+
+    def _normalized(self, df_like: pd.DataFrame) -> dict:
+        df = df_like.fillna("")
+        n_cols = df.shape[1]
+        return {
+            col: (df.iloc[:, idx].map(normalize_text).tolist() if idx < n_cols else [""] * len(df))
+            for col, idx in self.columns.items()
+        }
+
+    def _is_start(self, text: str) -> bool:
+        return bool(self.start_re.search(text))
+
+    def extract(self, df_like: pd.DataFrame) -> pd.DataFrame:
+        cols = self._normalized(df_like)
+        names, addrs, phones, industries = cols["企業名"], cols["住所"], cols["電話番号"], cols["業種"]
+        starts = [i for i, v in enumerate(addrs) if self._is_start(v)]
+        results = []
+        for start, end in zip(starts, starts[1:] + [len(addrs)]):
+            phone_text = phones[start]
+            if self.require_phone_word not in phone_text.upper():
+                continue
+            phone = pick_phone_token_raw(phone_text)
+
+            company_lines = [names[start]] if names[start] else []
+            for r in range(start + 1, end):
+                if not names[r] or names[r] in self.name_stop_words:
+                    break
+                company_lines.append(names[r])
+            company = "".join(company_lines)
+
+            address_lines = []
+            for r in range(start + 1, end):
+                if not addrs[r]:
+                    continue
+                if self._is_start(addrs[r]):
+                    break
+                address_lines.append(addrs[r])
+            address = "".join(address_lines)
+
+            if not (company or address or phone):
+                continue
+            results.append([company, industries[start], clean_address(address), phone])
+        return _output_frame(results)
+
+    def score(self, df_sample: pd.DataFrame) -> float:
+        """開始行のうち、電話列に require_phone_word がある割合"""
+        if df_sample.shape[1] <= max(self.columns["住所"], self.columns["電話番号"]):
+            return 0.0
+        cols = self._normalized(df_sample)
+        starts = [i for i, v in enumerate(cols["住所"]) if self._is_start(v)]
+        if len(starts) < DETECT_MIN_RECORDS:
+            return 0.0
+        hits = sum(self.require_phone_word in cols["電話番号"][i].upper() for i in starts)
+        return hits / len(starts)
+
+    def chunk_split(self, df_like: pd.DataFrame):
+        """最後の開始行から持ち越す（開始行より前の行はどのレコードにも入らないので捨てる）"""
+        idx = self.columns["住所"]
+        n = len(df_like)
+        if idx >= df_like.shape[1]:
+            return n, n
+        addrs = df_like.iloc[:, idx].fillna("").map(normalize_text).tolist()
+        starts = [i for i, v in enumerate(addrs) if self._is_start(v)]
+        if not starts:
+            return n, n
+        return starts[-1], starts[-1]
+
+
+SCANNER_KINDS = {
+    "anchor-offset": AnchorOffsetScanner,
+    "anchor-search": AnchorSearchScanner,
+    "key-value": KeyValueScanner,
+    "block": BlockScanner,
+}
+
+def compile_profile(spec: dict, source: str = "") -> ProfileScanner:
+    """JSON 1件分の定義をスキャナにする。定義がおかしければ ValueError"""
+    kind = spec.get("kind")
+    if kind not in SCANNER_KINDS:
+        raise ValueError(f"{source}: kind は {' / '.join(SCANNER_KINDS)} のどれかです（{kind}）")
+    try:
+        return SCANNER_KINDS[kind](spec, source)
+    except (KeyError, TypeError, re.error) as e:
+        raise ValueError(f"{source}: 抽出プロファイルの定義が不正です（{type(e).__name__}: {e}）")
+
+def load_profiles(profile_dir: Path = PROFILE_DIR) -> dict:
+    """profiles/*.json を読み込んで {表示名: スキャナ} を order 順に返す"""
+    scanners = []
+    for path in sorted(Path(profile_dir).glob("*.json")):
+        with open(path, encoding="utf-8") as f:
+            scanners.append(compile_profile(json.load(f), path.name))
+    scanners.sort(key=lambda sc: (sc.order, sc.id))
+    return {sc.name: sc for sc in scanners}
+
+PROFILE_SCANNERS = load_profiles()
+PROFILE_IDS = {sc.id: sc.name for sc in PROFILE_SCANNERS.values()}
+
+# 既存の4方式（コードから名前で参照する用）
+PROFILE_GOOGLE_VERTICAL = PROFILE_IDS["google_vertical"]
+PROFILE_GOOGLE_FREE_VERTICAL = PROFILE_IDS["google_free_vertical"]
+PROFILE_SHIGOTO_ARUA = PROFILE_IDS["shigoto_arua"]
+PROFILE_WAREHOUSE = PROFILE_IDS["warehouse_association"]
+PROFILES = list(PROFILE_SCANNERS)
+
+def extract_google_vertical(lines):
+    return PROFILE_SCANNERS[PROFILE_GOOGLE_VERTICAL].extract_lines(lines)
+
+def extract_google_free_vertical(df_like: pd.DataFrame) -> pd.DataFrame:
+    return PROFILE_SCANNERS[PROFILE_GOOGLE_FREE_VERTICAL].extract(df_like)
+
+def extract_shigoto_arua(df_like: pd.DataFrame) -> pd.DataFrame:
+    return PROFILE_SCANNERS[PROFILE_SHIGOTO_ARUA].extract(df_like)
+
+def extract_warehouse_association(df_like: pd.DataFrame) -> pd.DataFrame:
+    return PROFILE_SCANNERS[PROFILE_WAREHOUSE].extract(df_like)
+
+
+# ===============================
+# KEN_ALL 読み込み＆市区町村辞書
+# ===============================
+KEN_ALL_FILENAMES = ["KEN_ALL.xlsx", "KEN_ALL.XLSX", "KEN_ALL.csv", "KEN_ALL.CSV"]
+
+def find_ken_all(base: Path):
+    """base 直下の KEN_ALL.xlsx / KEN_ALL.csv を探す（無ければ None）"""
+    for fname in KEN_ALL_FILENAMES:
+        path = Path(base) / fname
+        if path.exists():
+            return path
+    return None
+
+def read_ken_all(path: Path) -> pd.DataFrame:
+    """
+    KEN_ALL を読み込む。
+    G列=都道府県, H列=市区町村, I列=町域名 という前提。
+    読み込み時に一度だけ正規化して __pref_norm / __city_norm / __town_norm に持つ。
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".xlsx":
+        df = pd.read_excel(path, engine="openpyxl").fillna("")
+    else:
+        df = pd.read_csv(path, header=None, encoding="cp932").fillna("")
+    df["__pref_norm"] = df.iloc[:, 6].map(normalize_text)
+    df["__city_norm"] = df.iloc[:, 7].map(normalize_text)
+    df["__town_norm"] = df.iloc[:, 8].map(normalize_text)
+    return df
+
+def build_city_town_index(ken_df: pd.DataFrame) -> dict:
+    """(都道府県, 市区町村) -> 町域セット への辞書を作る。"""
+    city_town = {}
+    for pref, city, town in zip(
+        ken_df["__pref_norm"],
+        ken_df["__city_norm"],
+        ken_df["__town_norm"],
+    ):
+        if not pref or not city or not town:
+            continue
+        if "以下に掲載がない場合" in town:
+            continue
+        key = (pref, city)
+        if key not in city_town:
+            city_town[key] = set()
+        city_town[key].add(town)
+
+    # キャッシュに載せやすいようにフリーズしておく
+    return {k: frozenset(v) for k, v in city_town.items()}
+
+def address_matches_city_towns(address: str, town_tokens: set) -> bool:
+    """
+    住所が、指定市区町村の町域セットにマッチするかどうか。
+    ・町名(I列)のどれかが住所に含まれていれば True
+    それ以外は False（＝別地域とみなして除外）
+    """
+    t = normalize_text(address)
+    if not t:
+        return False
+
+    for token in town_tokens:
+        if token and token in t:
+            return True
+
+    return False
+
+
+# ===============================
+# 業種のフィルター/ハイライト
+# ===============================
+remove_exact = [
+    "オフィス機器レンタル業", "足場レンタル会社", "電気工", "廃棄物リサイクル業",
+    "プロパン販売業者", "看板専門店", "給水設備工場", "警備業", "建設会社",
+    "工務店", "写真店", "人材派遣業", "整備店", "倉庫", "肉店", "米販売店",
+    "スーパーマーケット", "ロジスティクスサービス", "建材店",
+    "自動車整備工場", "自動車販売店", "車体整備店", "協会/組織", "建設請負業者", "電器店", "家電量販店", "建築会社", "ハウス クリーニング業", "焼肉店",
+    "建築設計事務所", "左官", "作業服店", "空調設備工事業者", "金属スクラップ業者", "害獣駆除サービス", "モーター修理店", "アーチェリーショップ", "アスベスト検査業", "事務用品店",
+    "測量士", "配管業者", "労働組合", "ガス会社", "ガソリンスタンド", "ガラス/ミラー店", "ワイナリー", "屋根ふき業者", "高等学校", "金物店", "史跡", "商工会議所", "清掃業", "清掃業者", "配管工", "お手頃"
+]
+remove_partial = ["販売店", "販売業者"]
+
+highlight_partial = [
+    "運輸", "ロジスティクスサービス", "倉庫", "輸送サービス",
+    "運送会社企業のオフィス", "運送会社"
+]
+
+# ===============================
+# 業種ノイズ除去（レビュー/評価など）
+# ===============================
+def clean_industry_noise(s: str) -> str:
+    if not s:
+        return ""
+    t = str(s)
+    t = re.sub(r"\s+", " ", t).strip()
+
+    # 先頭の評価スコア + 件数
+    t = re.sub(r"^\s*\d+(?:\.\d+)?\s*[\(（]\s*\d+\s*[\)）]\s*(?:件)?\s*[・･]?\s*", "", t)
+
+    # --- レビュー / クチコミ 処理 ---
+    def norm_token(x: str) -> str:
+        return re.sub(r"\s+", "", x)
+
+    noise_basic = {"レビュー", "レビューなし", "レビュー無し", "クチコミ", "口コミ"}
+    noise_nashi = {"なし"}
+
+    if t.startswith("レビュー"):
+        parts = [p.strip() for p in re.split(r"[・･]", t) if p.strip()]
+        if not parts:
+            return ""
+        if all(norm_token(p) in noise_basic | noise_nashi for p in parts):
+            return ""
+        cleaned_parts = []
+        for p in parts:
+            pn = norm_token(p)
+            if pn in noise_basic or pn in noise_nashi:
+                continue
+            cleaned_parts.append(p)
+        t = "・".join(cleaned_parts)
+    else:
+        t = re.sub(r"(?:^|[・･])\s*(Google\s*の?\s*クチコミ|口コミ|クチコミ)\s*(?=[・･]|$)", "", t)
+        t = re.sub(r"[・･]?\s*\d+\s*件の?(レビュー|口コミ|クチコミ)\s*(?=[・･]|$)", "", t)
+
+    parts = [p.strip() for p in re.split(r"[・･]", t) if p.strip()]
+    t = "・".join(parts) if parts else ""
+    t = re.sub(r"[・･]{2,}", "・", t).strip(" ・･")
+
+    # --- 🎯 追加：末尾の特殊文字（絵文字・UI記号等）削除 ---
+    # 例： /  / ↗ / ★ など
+    t = re.sub(r"[^\w一-龥ぁ-んァ-ヶ・\s\-、,。/()（）]+$", "", t)
+
+    return t if t else ""
+
+# ===============================
+# 共通整形（電話は触らない）
+# ===============================
+def clean_dataframe_except_phone(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for c in ["企業名", "業種", "住所"]:
+        df[c] = df[c].map(normalize_text)
+    df["業種"] = df["業種"].map(clean_industry_noise)
+    return df.fillna("")
+
+# ===============================
+# 入力の読み込み＆抽出プロファイルの振り分け
+# ===============================
+TEMPLATE_MASTER_SHEET = "入力マスター"
+
+INPUT_EXTENSIONS = ["xlsx", "csv", "tsv", "parquet"]
+CSV_ENCODINGS = ["utf-8-sig", "cp932"]
+
+def read_upload_frame(source, file_name: str = ""):
+    """
+    アップロードされたファイルを拡張子で読み分ける（拡張子が無ければ xlsx 扱い）。
+    戻り値: (df_raw, is_template)
+      ・xlsx: 『入力マスター』シートがあれば template 互換としてそのシートを返す
+              なければ1枚目のシートをヘッダーなしで返す
+      ・csv / tsv: ヘッダーなし・全列文字列で読む（UTF-8 → だめなら CP932）
+      ・parquet: 列名は捨てて 0,1,2,... に振り直す（pyarrow が必要）
+    """
+    ext = Path(file_name).suffix.lower().lstrip(".")
+    if ext in ("csv", "tsv"):
+        return read_delimited(source, sep="\t" if ext == "tsv" else ","), False
+    if ext == "parquet":
+        return read_parquet_frame(source), False
+
+    xl = pd.ExcelFile(source, engine="openpyxl")
+    if TEMPLATE_MASTER_SHEET in xl.sheet_names:
+        df_raw = pd.read_excel(xl, sheet_name=TEMPLATE_MASTER_SHEET, header=None, engine="openpyxl")
+        return df_raw.fillna(""), True
+    return pd.read_excel(xl, header=None, engine="openpyxl").fillna(""), False
+
+def read_delimited(source, sep: str = ",") -> pd.DataFrame:
+    """CSV/TSV をヘッダーなし・全列文字列で読む。文字コードは CSV_ENCODINGS の順に試す"""
+    data = source.getvalue() if hasattr(source, "getvalue") else Path(source).read_bytes()
+    for encoding in CSV_ENCODINGS:
+        try:
+            text = data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return pd.read_csv(
+            io.StringIO(text), sep=sep, header=None, dtype=str,
+            keep_default_na=False, skip_blank_lines=False,
+        )
+    raise ValueError(f"CSV の文字コードを判別できませんでした（{' / '.join(CSV_ENCODINGS)} を試しました）。")
+
+def read_parquet_frame(source) -> pd.DataFrame:
+    try:
+        df = pd.read_parquet(source)
+    except ImportError:
+        raise ValueError("Parquet の読み込みには pyarrow が必要です（pip install pyarrow）。")
+    df.columns = range(df.shape[1])
+    return df.astype(object).where(df.notna(), "").astype(str)
+
+# ===============================
+# 複数シートの読み込み＆抽出（シートごとにワーカーで並行して処理する）
+# ===============================
+SHEET_COLUMN = "シート"
+SHEET_MAX_WORKERS = 4
+
+def list_upload_sheets(data: bytes, file_name: str = "") -> list:
+    """抽出対象に選べるシート名（xlsx 以外と、『入力マスター』のある template 互換ファイルは空リスト）"""
+    if Path(file_name).suffix.lower().lstrip(".") in ("csv", "tsv", "parquet"):
+        return []
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(data), read_only=True, keep_links=False)
+    try:
+        names = list(wb.sheetnames)
+    finally:
+        wb.close()
+    return [] if TEMPLATE_MASTER_SHEET in names else names
+
+def select_sheets(available: list, sheets=None) -> list:
+    """sheets（省略・空ならすべて）を available の中から選ぶ。無いシート名があれば ValueError"""
+    if not sheets:
+        return list(available)
+    missing = [s for s in sheets if s not in available]
+    if missing:
+        raise ValueError(f"シートが見つかりません: {', '.join(missing)}（{' / '.join(available)}）")
+    return list(dict.fromkeys(sheets))
+
+def read_upload_sheets(source, file_name: str = "", sheets=None, max_workers: int = SHEET_MAX_WORKERS):
+    """
+    read_upload_frame の複数シート版。戻り値: ({シート名: df_raw}, is_template)
+      ・xlsx: sheets（省略時はすべてのシート）を、開いた1つのブックからワーカーで並行して読む
+              （共有文字列の読み込みは1回だけで済む）。『入力マスター』があればそのシートだけ
+      ・csv / tsv / parquet: シートは無いので {"": df_raw}
+    """
+    ext = Path(file_name).suffix.lower().lstrip(".")
+    if ext in ("csv", "tsv", "parquet"):
+        df_raw, is_template = read_upload_frame(source, file_name)
+        return {"": df_raw}, is_template
+
+    xl = pd.ExcelFile(source, engine="openpyxl")
+    if TEMPLATE_MASTER_SHEET in xl.sheet_names:
+        df_raw = pd.read_excel(xl, sheet_name=TEMPLATE_MASTER_SHEET, header=None, engine="openpyxl")
+        return {TEMPLATE_MASTER_SHEET: df_raw.fillna("")}, True
+    names = select_sheets(xl.sheet_names, sheets)
+
+    def read(name):
+        return pd.read_excel(xl, sheet_name=name, header=None, engine="openpyxl").fillna("")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names)))) as pool:
+        return dict(zip(names, pool.map(read, names))), False
+
+def profile_label(used: dict) -> str:
+    """シートごとに使った抽出プロファイルを1つの表示名にまとめる（全シート同じならその名前）"""
+    if len(set(used.values())) <= 1:
+        return next(iter(used.values()), "")
+    return " / ".join(f"{sheet}: {name}" for sheet, name in used.items())
+
+def resolve_sheet_profile(df_raw: pd.DataFrame, profile: str, sheet: str = "") -> str:
+    """resolve_profile と同じ。判定できないときのエラーにシート名を付ける"""
+    try:
+        return resolve_profile(df_raw, profile)
+    except ValueError as e:
+        raise ValueError(f"シート『{sheet}』: {e}" if sheet else str(e))
+
+def extract_sheets(frames: dict, profile: str, max_workers: int = SHEET_MAX_WORKERS):
+    """
+    シートごとの df_raw をワーカーで並行して抽出し、シートの順に1つの DataFrame にまとめる。
+    profile=PROFILE_AUTO ならシートごとに判定する（判定できないシートがあれば、シート名つきで ValueError）。
+    シートが2枚以上なら、どのシートから取った行かを SHEET_COLUMN 列に残す。空のシートは飛ばす。
+    すべて空なら判定はせず、空の df を返す（抽出プロファイルは指定があればそれ、自動判定なら ""）。
+    戻り値: (df, {シート名: 使った抽出プロファイル})
+    """
+    targets = {name: df_raw for name, df_raw in frames.items() if len(df_raw)}
+    if not targets:
+        return _output_frame([]), {"": "" if profile == PROFILE_AUTO else profile}
+
+    def extract(item):
+        name, df_raw = item
+        used = resolve_sheet_profile(df_raw, profile, name)
+        return used, extract_by_profile(df_raw, used)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        results = list(pool.map(extract, targets.items()))
+
+    parts = []
+    for name, (_, df) in zip(targets, results):
+        parts.append(df.assign(**{SHEET_COLUMN: name}) if len(frames) > 1 else df)
+    return pd.concat(parts, ignore_index=True), {name: used for name, (used, _) in zip(targets, results)}
+
+# ===============================
+# 分割読み込み（大きなファイルを chunk_rows 行ずつ DataFrame にする）
+# ===============================
+CHUNK_ROWS = 50_000
+CHUNK_MAX_CARRY_ROWS = 10_000  # 次のチャンクへ持ち越す行の上限（レコードの区切りが見つからない異常な入力用）
+ENCODING_SNIFF_BYTES = 1 << 20
+
+def sniff_encoding(data: bytes) -> str:
+    """CSV_ENCODINGS のうち、全体をデコードできる最初のもの（1MB ずつ確かめるので全文の str は作らない）"""
+    for encoding in CSV_ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            for i in range(0, len(data), ENCODING_SNIFF_BYTES):
+                decoder.decode(data[i:i + ENCODING_SNIFF_BYTES])
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    raise ValueError(f"CSV の文字コードを判別できませんでした（{' / '.join(CSV_ENCODINGS)} を試しました）。")
+
+def _excel_cell(v):
+    """pd.read_excel と同じ値にそろえる（空セルは ""、整数値の float は int）"""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+def _xlsx_chunks(data: bytes, chunk_rows: int, sheets=None):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    is_template = TEMPLATE_MASTER_SHEET in wb.sheetnames
+    names = [TEMPLATE_MASTER_SHEET] if is_template else select_sheets(wb.sheetnames, sheets)
+    worksheets = [wb[name] for name in names]
+    # 見出し情報の値（無い・不正確なこともあるので進捗の目安にだけ使う）
+    total = sum(ws.max_row or 0 for ws in worksheets)
+    for ws in worksheets:
+        ws.reset_dimensions()
+
+    def chunks():
+        try:
+            for name, ws in zip(names, worksheets):
+                batch = []
+                for row in ws.iter_rows(values_only=True):
+                    batch.append([_excel_cell(v) for v in row])
+                    if len(batch) >= chunk_rows:
+                        yield name, pd.DataFrame(batch).fillna("")
+                        batch = []
+                if batch:
+                    yield name, pd.DataFrame(batch).fillna("")
+        finally:
+            wb.close()
+    return is_template, total, names, chunks()
+
+def _delimited_chunks(data: bytes, sep: str, chunk_rows: int):
+    encoding = sniff_encoding(data)
+    reader = pd.read_csv(
+        io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline=""), sep=sep, header=None, dtype=str,
+        keep_default_na=False, skip_blank_lines=False, chunksize=chunk_rows,
+    )
+    return False, data.count(b"\n") + 1, [""], (("", chunk.reset_index(drop=True)) for chunk in reader)
+
+def _parquet_chunks(data: bytes, chunk_rows: int):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet の読み込みには pyarrow が必要です（pip install pyarrow）。")
+    pf = pq.ParquetFile(io.BytesIO(data))
+
+    def chunks():
+        for batch in pf.iter_batches(batch_size=chunk_rows):
+            df = batch.to_pandas()
+            df.columns = range(df.shape[1])
+            yield "", df.astype(object).where(df.notna(), "").astype(str)
+    return False, pf.metadata.num_rows, [""], chunks()
+
+def iter_upload_chunks(data: bytes, file_name: str = "", chunk_rows: int = CHUNK_ROWS, sheets=None):
+    """
+    read_upload_sheets の分割版。ファイル全体を DataFrame にせず、シートの順に chunk_rows 行ずつ返す。
+    戻り値: (is_template, 全行数の目安（不明なら None）, 読むシート名のリスト, (シート名, DataFrame) のイテレータ)
+    各チャンクの列名は 0,1,2,...、値は read_upload_frame と同じ形（空セルは ""）。
+    xlsx 以外のシート名は ""、1つのチャンクに複数のシートの行は混ざらない。
+    """
+    ext = Path(file_name).suffix.lower().lstrip(".")
+    if ext in ("csv", "tsv"):
+        return _delimited_chunks(data, "\t" if ext == "tsv" else ",", chunk_rows)
+    if ext == "parquet":
+        return _parquet_chunks(data, chunk_rows)
+    return _xlsx_chunks(data, chunk_rows, sheets)
+
+def extract_template_master(df_raw: pd.DataFrame, header: bool = True) -> pd.DataFrame:
+    """template互換: 入力マスターから読み取り（電話は原文のまま）。header=False なら1行目もデータ扱い"""
+    rows = df_raw.iloc[1:] if header else df_raw
+    if rows.shape[1] < 5:
+        # 分割読み込みでは、B〜E列が空の行だけのチャンクは列が足りないことがある
+        rows = rows.reindex(columns=range(5), fill_value="")
+    return pd.DataFrame({
+        "企業名": rows.iloc[:, 1].astype(str),
+        "業種": rows.iloc[:, 2].astype(str),
+        "住所": rows.iloc[:, 3].astype(str),
+        "電話番号": rows.iloc[:, 4].astype(str),
+    })
+
+def extract_by_profile(df0: pd.DataFrame, profile: str) -> pd.DataFrame:
+    """選択された抽出プロファイルで 企業名/業種/住所/電話番号 を取り出す"""
+    if profile not in PROFILE_SCANNERS:
+        raise ValueError(f"抽出プロファイルが見つかりません: {profile}")
+    return PROFILE_SCANNERS[profile].extract(df0)
+
+def extract_chunks(chunks, scanner: ProfileScanner, removal_logs: list = None):
+    """
+    分割読み込みしたチャンクを順に抽出し、抽出済みの DataFrame を順に返す。
+    レコードがチャンクの境目をまたぐときは、scanner.chunk_split が決めた行から後ろを
+    次のチャンクの先頭へ持ち越してから抽出するので、一括で extract した場合と同じ結果になる。
+    持ち越しが CHUNK_MAX_CARRY_ROWS 行を超える異常な入力だけは、そこで打ち切る
+    （そのレコードは欠けたまま抽出されるので、removal_logs に『chunk-carry-truncated』を残す）。
+    """
+    pending, skip = None, 0
+    for chunk in chunks:
+        buf = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True).fillna("")
+        stop, keep_from = scanner.chunk_split(buf)
+        if keep_from < len(buf) - CHUNK_MAX_CARRY_ROWS:
+            cut = len(buf) - CHUNK_MAX_CARRY_ROWS - keep_from
+            if removal_logs is not None:
+                removal_logs.append({
+                    "reason": "chunk-carry-truncated",
+                    "company": "",
+                    "phone_raw": "",
+                    "match": f"レコードの区切りが {CHUNK_MAX_CARRY_ROWS:,} 行以上見つからず、{cut:,} 行を持ち越さずに抽出しました",
+                })
+            keep_from = len(buf) - CHUNK_MAX_CARRY_ROWS
+        stop = max(stop, keep_from, skip)
+        yield scanner.extract_chunk(buf, skip, stop)
+        pending, skip = buf.iloc[keep_from:].reset_index(drop=True), stop - keep_from
+    if pending is not None and len(pending) > skip:
+        yield scanner.extract_chunk(pending, skip, len(pending))
+
+# ===============================
+# 抽出プロファイルの自動判定（先頭の数百行だけを見る）
+# ===============================
+PROFILE_AUTO = "自動判定（先頭300行から推定）"
+DETECT_SAMPLE_ROWS = 300
+DETECT_MIN_RECORDS = 3    # これ未満しかレコードらしきものが無ければ、その方式は 0 点
+DETECT_MIN_SCORE = 0.5    # 最高点がこれ未満なら「判定できない」
+def detect_profile(df_sample: pd.DataFrame):
+    """
+    先頭の数百行（df_raw.head(DETECT_SAMPLE_ROWS)）から抽出プロファイルを推定する。
+    各プロファイルの score()（レコードらしい並びになっている割合、0〜1）を比べて最も高いものを選ぶ。
+    戻り値: (プロファイル名 or None, {プロファイル名: 点数})
+      最高点が DETECT_MIN_SCORE 未満なら None（手動で選んでもらう）
+    """
+    df = df_sample.fillna("").astype(str)
+    # 同点のときは、目印がはっきりしている方式（detect_priority が小さいもの）を優先する
+    scanners = sorted(PROFILE_SCANNERS.values(), key=lambda sc: sc.detect_priority)
+    scores = {sc.name: sc.score(df) for sc in scanners}
+    best = max(scores, key=scores.get)
+    if scores[best] < DETECT_MIN_SCORE:
+        return None, scores
+    return best, scores
+
+def resolve_profile(df_raw: pd.DataFrame, profile: str) -> str:
+    """profile が PROFILE_AUTO なら先頭行から推定する。判定できなければ ValueError"""
+    if profile != PROFILE_AUTO:
+        return profile
+    detected, scores = detect_profile(df_raw.head(DETECT_SAMPLE_ROWS))
+    if detected is None:
+        detail = " / ".join(f"{name}: {score:.2f}" for name, score in scores.items())
+        raise ValueError(f"抽出プロファイルを自動判定できませんでした。手動で選択してください。（{detail}）")
+    return detected
+
+# ===============================
+# 住所から都道府県・市区町村を取り出す（重複判定のブロック分け用）
+# ===============================
+# 区まで取る市（政令指定都市）。ほかの市の「○○区」は町域名の一部なので含めない
+DESIGNATED_CITIES = (
+    "札幌", "仙台", "さいたま", "千葉", "横浜", "川崎", "相模原", "新潟", "静岡", "浜松",
+    "名古屋", "京都", "大阪", "堺", "神戸", "岡山", "広島", "北九州", "福岡", "熊本",
+)
+# 名前の途中に 市・町・村・郡 を含み、最短一致では途中で切れる（または郡部と取り違える）市町村
+IRREGULAR_MUNICIPALITIES = (
+    "四日市市", "廿日市市", "野々市市", "十日町市", "大町市", "東村山市", "武蔵村山市", "羽村市", "田村市", "大村市",
+    "大和郡山市", "蒲郡市", "杵島郡大町町", "佐波郡玉村町",
+    "余市郡仁木町", "余市郡余市町", "余市郡赤井川村", "高市郡明日香村", "高市郡高取町",
+)
+ADDRESS_AREA_RE = (
+    r"^(?:〒?\d{3}-?\d{4})?\s*"
+    r"(?P<pref>東京都|北海道|(?:京都|大阪)府|[^\d\s]{2,3}県)?"
+    r"(?P<city>" + "|".join(IRREGULAR_MUNICIPALITIES)
+    + r"|(?:" + "|".join(DESIGNATED_CITIES) + r")市[^\d\s]+?区"
+    r"|[^\d\s市]+?郡[^\d\s]+?[町村]|[^\d\s]+?[市区町村])?"
+)
+
+def resolve_municipality(addresses: pd.Series) -> pd.DataFrame:
+    """
+    住所の列から 都道府県(pref) と 市区町村(city) を正規表現でまとめて取り出す。
+    政令市は「○○市○○区」、郡部は「○○郡○○町」まで含める。取れなければ ""。
+    「市」の後ろの「郡山町」などを郡部と取り違えないよう、郡の名前には「市」を含めない（余市郡などは個別に持つ）。
+    """
+    area = addresses.fillna("").astype(str).str.extract(ADDRESS_AREA_RE)
+    return area.fillna("")
+
+# ===============================
+# フィルタ・NG照合・重複除去（各ステージは (df, 除外件数) を返す）
+# ===============================
+def filter_by_city(df: pd.DataFrame, town_tokens: set):
+    """市区町村フィルタ（KEN_ALL の G/H/I を使用）"""
+    before = len(df)
+    df = df[df["住所"].apply(lambda x: address_matches_city_towns(x, town_tokens))]
+    return df, before - len(df)
+
+def add_match_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """NG照合・重複判定用の比較キー列を追加"""
+    df = df.copy()
+    df["__company_canon"] = df["企業名"].map(canonical_company_name)
+    keys = canonical_phone_keys(df["電話番号"])
+    df["__digits"] = keys["digits"]
+    df["__phone_key"] = keys["key"]
+    df["__phone_type"] = keys["type"]
+    area = resolve_municipality(df["住所"])
+    df["__pref"] = area["pref"]
+    df["__municipality"] = area["city"]
+    return df
+
+YUGEN_PATTERN = r"(?:有限会社|\(有\)|（有）)"
+
+def filter_industry(df: pd.DataFrame, industry_option: str):
+    """業種フィルター（製造業のみ除外ルール適用）＋ 有限会社は全業種で除外"""
+    before = len(df)
+    if industry_option == "製造業":
+        all_ng_words = remove_exact + remove_partial
+        if all_ng_words:
+            pat = "|".join(map(re.escape, all_ng_words))
+            df = df[~df["業種"].str.contains(pat, na=False)]
+    df = df[~df["企業名"].str.contains(YUGEN_PATTERN, na=False)]
+    return df, before - len(df)
+
+def ng_phone_column(ng_df: pd.DataFrame):
+    """
+    NGリストの電話番号列の位置を返す（無ければ None）。
+    見出しに「電話」「TEL」を含む列を優先し、無ければ従来どおり2列目。
+    （「企業名 / 支店、工場名 / 電話番号」の3列型があるため）
+    """
+    for i, col in enumerate(ng_df.columns):
+        label = normalize_text(col).upper()
+        if i > 0 and ("電話" in label or "TEL" in label):
+            return i
+    return 1 if ng_df.shape[1] >= 2 else None
+
+def load_ng_list(path):
+    """
+    NGリスト xlsx を読み込み、(企業名の正規化リスト, 電話番号の正規化キーのセット) を返す。
+    1列目=企業名、電話番号列（任意）は見出しで判定（無ければ2列目）。
+    """
+    ng_df = pd.read_excel(path, engine="openpyxl").fillna("")
+    if ng_df.shape[1] < 1:
+        raise ValueError("NGリストは少なくとも1列（企業名）が必要です。2列目に電話番号があれば照合に利用します。")
+    ng_names = [n for n in ng_df.iloc[:, 0].map(canonical_company_name).tolist() if n]
+    phone_col = ng_phone_column(ng_df)
+    if phone_col is not None:
+        keys = canonical_phone_keys(ng_df.iloc[:, phone_col])["key"].dropna()
+        ng_phones = set(int(k) for k in keys)
+    else:
+        ng_phones = set()
+    return ng_names, ng_phones
+
+def _log_removed(removal_logs: list, rows: pd.DataFrame, reason: str, match_col: str):
+    for company, phone_raw, match in zip(rows["企業名"], rows["電話番号"], rows[match_col]):
+        removal_logs.append({
+            "reason": reason,
+            "company": company,
+            "phone_raw": phone_raw,
+            "match": match,
+        })
+
+def remove_ng_matches(df: pd.DataFrame, ng_names: list, ng_phones: set, removal_logs: list):
+    """
+    NG照合。戻り値: (df, 企業名で除外した件数, 電話で除外した件数)
+    ・企業名: 正規化後の部分一致（相互包含）
+    ・電話: 正規化キー（canonical_phone_keys の key）の完全一致
+    """
+    # 企業名（部分一致・相互包含）
+    before = len(df)
+    canon = df["__company_canon"]
+    hit = canon.map(lambda c: bool(c) and any((n in c or c in n) for n in ng_names))
+    if hit.any():
+        _log_removed(removal_logs, df[hit], "ng-company", "__company_canon")
+        df = df[~hit]
+    company_removed = before - len(df)
+
+    # 電話番号（正規化キー）一致
+    before = len(df)
+    mask = df["__phone_key"].isin(ng_phones).fillna(False).astype(bool)
+    if mask.any():
+        _log_removed(removal_logs, df[mask], "ng-phone", "__digits")
+        df = df[~mask]
+    phone_removed = before - len(df)
+    return df, company_removed, phone_removed
+
+# ===============================
+# NG企業名のあいまい照合（文字 n-gram 転置インデックス）
+# ===============================
+NG_FUZZY_NGRAM = 2
+NG_FUZZY_MIN_LEN = 4        # これより短いNG名はあいまい照合しない（「日本」などで誤爆するため）
+NG_FUZZY_TOP_K = 5          # 類似度を計算する候補数の上限
+NG_FUZZY_MAX_POSTING = 500  # これ以上のNG名に出てくる n-gram（「工業」など）は候補探しに使わない
+
+def char_ngrams(s: str, n: int = NG_FUZZY_NGRAM) -> set:
+    if len(s) <= n:
+        return {s} if s else set()
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+def fuzzy_name_score(name: str, ng_name: str) -> float:
+    """
+    正規化済み企業名どうしの類似度（0〜1）。
+    支店名などが後ろに付いているケースを拾うため、
+    全体どうしの比較と「NG名と同じ長さの先頭部分」との比較の高い方を採る。
+    """
+    score = SequenceMatcher(None, name, ng_name).ratio()
+    if len(name) > len(ng_name):
+        score = max(score, SequenceMatcher(None, name[:len(ng_name)], ng_name).ratio())
+    return score
+
+class NgNameIndex:
+    """
+    正規化済みNG企業名（canonical_company_name 済み）の文字 n-gram 転置インデックス。
+    NGリスト全件と総当たりで類似度を計算せず、n-gram を共有する候補だけを引いてから
+    上位 NG_FUZZY_TOP_K 件にだけ類似度を計算する。
+    """
+
+    def __init__(self, names, n: int = NG_FUZZY_NGRAM):
+        self.n = n
+        self.names = [x for x in dict.fromkeys(names) if len(x) >= NG_FUZZY_MIN_LEN]
+        self._sizes = []
+        self._postings = {}
+        for i, name in enumerate(self.names):
+            grams = char_ngrams(name, n)
+            self._sizes.append(len(grams))
+            for g in grams:
+                self._postings.setdefault(g, []).append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def candidates(self, name: str, min_overlap: float = 0.5) -> list:
+        """
+        name と n-gram を共有するNG名のうち、NG名側の n-gram の min_overlap 以上を
+        共有しているものを、共有率の高い順に最大 NG_FUZZY_TOP_K 件返す。
+        """
+        shared = {}
+        for g in char_ngrams(name, self.n):
+            posting = self._postings.get(g)
+            if not posting or len(posting) > NG_FUZZY_MAX_POSTING:
+                continue
+            for i in posting:
+                shared[i] = shared.get(i, 0) + 1
+        scored = [(cnt / self._sizes[i], i) for i, cnt in shared.items() if cnt / self._sizes[i] >= min_overlap]
+        scored.sort(reverse=True)
+        return [self.names[i] for _, i in scored[:NG_FUZZY_TOP_K]]
+
+    def best_match(self, name: str, threshold: float):
+        """類似度が threshold 以上で最も高いNG名と類似度を返す（無ければ (None, 0.0)）"""
+        best, best_score = None, 0.0
+        # 候補の足切りは類似度のしきい値より緩めにしておく（誤字1文字で n-gram は2つ崩れるため）
+        for ng_name in self.candidates(name, min_overlap=max(threshold - 0.35, 0.3)):
+            score = fuzzy_name_score(name, ng_name)
+            if score > best_score:
+                best, best_score = ng_name, score
+        if best_score >= threshold:
+            return best, best_score
+        return None, 0.0
+
+def remove_ng_fuzzy_matches(df: pd.DataFrame, ng_index: NgNameIndex, threshold: float, removal_logs: list):
+    """
+    NG企業名のあいまい照合（部分一致で落ちなかった行だけが対象）。
+    戻り値: (df, 除外件数)。削除ログには一致したNG名と類似度（score）を残す。
+    """
+    before = len(df)
+    if not len(ng_index) or df.empty:
+        return df, 0
+    hits = []
+    for idx, company, phone_raw, canon in zip(df.index, df["企業名"], df["電話番号"], df["__company_canon"]):
+        if len(canon) < NG_FUZZY_MIN_LEN:
+            continue
+        ng_name, score = ng_index.best_match(canon, threshold)
+        if ng_name is None:
+            continue
+        hits.append(idx)
+        removal_logs.append({
+            "reason": "ng-company-fuzzy",
+            "company": company,
+            "phone_raw": phone_raw,
+            "match": ng_name,
+            "score": round(score, 3),
+        })
+    if hits:
+        df = df.drop(index=hits)
+    return df, before - len(df)
+
+class PhoneKeySet:
+    """
+    分割処理で、前のチャンクまでに残した電話キーを覚えておく集合。
+    Python の set ではなく整列済みの int64 配列で持つ（1件8バイト、100万件でも約8MB）。
+    """
+
+    def __init__(self):
+        self._keys = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def contains(self, keys: pd.Series) -> pd.Series:
+        """keys（Int64、欠損あり）のうち、すでに入っているものを True にしたマスク"""
+        values = keys.to_numpy(dtype=np.int64, na_value=-1)
+        pos = np.searchsorted(self._keys, values).clip(max=max(len(self._keys) - 1, 0))
+        hit = (self._keys[pos] == values) if len(self._keys) else np.zeros(len(values), dtype=bool)
+        return pd.Series(hit, index=keys.index) & keys.notna()
+
+    def add(self, keys: pd.Series):
+        self._keys = np.union1d(self._keys, keys.dropna().to_numpy(dtype=np.int64))
+
+def remove_duplicate_phones(df: pd.DataFrame, removal_logs: list, seen: PhoneKeySet = None):
+    """
+    重複（電話番号の正規化キー）除去（※このファイル内だけ）。
+    seen を渡すと、そこに入っている（前のチャンクまでに残した）電話キーも重複として除き、
+    残した行のキーを seen に足す（分割処理用）。
+    """
+    before = len(df)
+    key = df["__phone_key"]
+    dup_mask = key.notna() & key.duplicated(keep="first")
+    if seen is not None:
+        dup_mask |= seen.contains(key)
+    if dup_mask.any():
+        _log_removed(removal_logs, df[dup_mask], "dup-phone", "__digits")
+        df = df[~dup_mask]
+    if seen is not None:
+        seen.add(df["__phone_key"])
+    return df, before - len(df)
+
+# 企業名＋住所の重複判定（ブロック分け）
+DEDUP_NAME_PREFIX = 4          # ブロックキーに使う正規化企業名の先頭文字数
+DEDUP_NAME_THRESHOLD = 0.9     # 企業名の類似度しきい値
+DEDUP_ADDRESS_THRESHOLD = 0.85  # 住所の類似度しきい値
+ADDRESS_KEY_RE = re.compile(r"[\s\-,、。・/()（）]")
+DIGITS_RE = re.compile(r"\d+")
+
+def _similar(a: str, b: str, threshold: float):
+    """real_quick_ratio / quick_ratio で足切りしてから ratio を計算する。しきい値未満なら None"""
+    if a == b:
+        return 1.0
+    sm = SequenceMatcher(None, a, b)
+    if sm.real_quick_ratio() < threshold or sm.quick_ratio() < threshold:
+        return None
+    score = sm.ratio()
+    return score if score >= threshold else None
+
+def remove_duplicate_companies(df: pd.DataFrame, removal_logs: list):
+    """
+    同じ企業が電話番号違い・電話なしで複数回出てくるものを除去する（※このファイル内だけ）。
+    ・ブロックキー = 正規化企業名の先頭 DEDUP_NAME_PREFIX 文字 ＋ 住所から取った都道府県・市区町村
+    ・同じブロックの中だけで、先に残した行と 企業名・住所 の類似度を比べる
+      （全行どうしの総当たりにしないので、ほぼ行数に比例した時間で済む）
+    ・企業名・住所に含まれる数字（番地など）が食い違うものは別企業として扱う
+    ・住所がどちらか空なら、企業名が完全一致するときだけ重複とみなす
+    戻り値: (df, 除外件数)
+    """
+    before = len(df)
+    if df.empty:
+        return df, 0
+    addr_keys = df["住所"].map(lambda a: ADDRESS_KEY_RE.sub("", normalize_text(a)))
+    blocks = {}
+    hits = []
+    for idx, company, phone_raw, canon, pref, city, addr in zip(
+        df.index, df["企業名"], df["電話番号"], df["__company_canon"], df["__pref"], df["__municipality"], addr_keys
+    ):
+        if not canon:
+            continue
+        block = blocks.setdefault((canon[:DEDUP_NAME_PREFIX], pref, city), [])
+        digits = (tuple(DIGITS_RE.findall(canon)), tuple(DIGITS_RE.findall(addr)))
+        dup_of = None
+        for kept_company, kept_canon, kept_addr, kept_digits in block:
+            if digits[0] != kept_digits[0]:
+                continue
+            if not addr or not kept_addr:
+                if canon == kept_canon:
+                    dup_of, score = kept_company, 1.0
+                    break
+                continue
+            name_score = _similar(canon, kept_canon, DEDUP_NAME_THRESHOLD)
+            if name_score is None or digits[1] != kept_digits[1]:
+                continue
+            addr_score = _similar(addr, kept_addr, DEDUP_ADDRESS_THRESHOLD)
+            if addr_score is None:
+                continue
+            dup_of, score = kept_company, min(name_score, addr_score)
+            break
+        if dup_of is None:
+            block.append((company, canon, addr, digits))
+            continue
+        hits.append(idx)
+        removal_logs.append({
+            "reason": "dup-company-address",
+            "company": company,
+            "phone_raw": phone_raw,
+            "match": dup_of,
+            "score": round(score, 3),
+        })
+    if hits:
+        df = df.drop(index=hits)
+    return df, before - len(df)
+
+def drop_empty_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """4列すべて空の行を除去して index を振り直す"""
+    empty = (df["企業名"] == "") & (df["業種"] == "") & (df["住所"] == "") & (df["電話番号"] == "")
+    return df[~empty].reset_index(drop=True)
+
+# ===============================
+# template.xlsx へ書き込み（高速版）
+# ===============================
+LEAD_SHEET = "開拓先リスト"
+LEAD_CARD_FIRST_ROW = 2   # 1件目のカードの先頭行（1行目は見出し）
+LEAD_CARD_ROWS = 6        # 1件分のカードの行数（A列の番号で 入力マスター を VLOOKUP する）
+LEAD_STATUS_COLUMN = "H"  # 架電結果のプルダウンの列
+LEAD_STATUS_OFFSET = 1    # カードの先頭行から、架電結果のプルダウンまでの行数
+LEAD_LAST_COLUMN = "L"    # 印刷範囲の右端
+LEAD_STATUS_CHOICES = '"-,アポ,見込み,断り,留守,担当者不在,不使用,削除依頼"'
+
+def fit_lead_cards(ws, n_cards: int):
+    """
+    開拓先リストのカードを n_cards 件分にそろえる。
+    テンプレの件数より少なければ後ろのカードを削り、多ければ最後のカードを写して足す
+    （セルの値・書式・結合・行の高さ・条件付き書式。数式の相対参照は行をずらして写す）。
+    """
+    from openpyxl.formula.translate import Translator
+    from openpyxl.formatting.formatting import ConditionalFormatting, ConditionalFormattingList
+    from openpyxl.worksheet.cell_range import CellRange
+    from openpyxl.worksheet.merge import MergedCellRange
+
+    template_cards = (ws.max_row - LEAD_CARD_FIRST_ROW + 1) // LEAD_CARD_ROWS
+    if template_cards < 1 or n_cards == template_cards:
+        return
+    last_row = LEAD_CARD_FIRST_ROW + n_cards * LEAD_CARD_ROWS - 1
+    src_top = LEAD_CARD_FIRST_ROW + (template_cards - 1) * LEAD_CARD_ROWS
+    src_bottom = src_top + LEAD_CARD_ROWS - 1
+
+    def shifted(cr, k):
+        dr = (k - template_cards + 1) * LEAD_CARD_ROWS
+        return CellRange(min_col=cr.min_col, min_row=cr.min_row + dr, max_col=cr.max_col, max_row=cr.max_row + dr)
+
+    extra = range(template_cards, n_cards)  # 足すカードの番号（0始まり）
+
+    # --- 結合セル ---
+    card_merges = [cr for cr in ws.merged_cells.ranges if src_top <= cr.min_row <= src_bottom]
+    for cr in list(ws.merged_cells.ranges):
+        if cr.min_row > last_row:
+            ws.merged_cells.remove(cr)
+    # ws.merge_cells は既存の結合すべてと重なりを調べるので（件数の2乗になる）、範囲を直接足す。
+    # 結合の内側のセルは、下で書式ごと写す
+    for k in extra:
+        for cr in card_merges:
+            ws.merged_cells.ranges.add(MergedCellRange(ws, shifted(cr, k).coord))
+
+    # --- セル（値・書式）と行の高さ ---
+    if n_cards < template_cards:
+        ws.delete_rows(last_row + 1, ws.max_row - last_row)
+        for r in [r for r in ws.row_dimensions if r > last_row]:
+            del ws.row_dimensions[r]
+    else:
+        card_cells = []
+        for row in ws.iter_rows(min_row=src_top, max_row=src_bottom):
+            for cell in row:
+                value = cell.value
+                if isinstance(value, str) and value.startswith("="):
+                    value = Translator(value, origin=cell.coordinate)
+                card_cells.append((cell.row - src_top, cell.column, value, cell._style))
+        heights = [ws.row_dimensions[src_top + i].height for i in range(LEAD_CARD_ROWS)]
+        for k in extra:
+            top = LEAD_CARD_FIRST_ROW + k * LEAD_CARD_ROWS
+            for i, col, value, style in card_cells:
+                cell = ws.cell(row=top + i, column=col)
+                if isinstance(value, Translator):
+                    cell.value = value.translate_formula(row_delta=top - src_top)
+                elif value is not None:
+                    cell.value = value
+                cell._style = copy(style)
+            for i, height in enumerate(heights):
+                ws.row_dimensions[top + i].height = height
+
+    # --- 条件付き書式（カードごとの範囲を削る・足す） ---
+    # 規則の数式はその書式の範囲全体の左上セルからの相対参照なので、左上が変わったときは数式も写し直す
+    formats = ConditionalFormattingList()
+    for cf in ws.conditional_formatting:
+        ranges = [cr for cr in cf.sqref.ranges if cr.min_row <= last_row]
+        card_ranges = [cr for cr in cf.sqref.ranges if src_top <= cr.min_row <= src_bottom]
+        ranges += [shifted(cr, k) for k in extra for cr in card_ranges]
+        if not ranges:
+            continue
+        old_origin = (min(cr.min_row for cr in cf.sqref.ranges), min(cr.min_col for cr in cf.sqref.ranges))
+        new_origin = (min(cr.min_row for cr in ranges), min(cr.min_col for cr in ranges))
+        target = ConditionalFormatting(" ".join(cr.coord for cr in ranges))
+        for rule in cf.rules:
+            if new_origin != old_origin:
+                origin, dest = (CellRange(min_row=r, min_col=c, max_row=r, max_col=c).coord
+                                for r, c in (old_origin, new_origin))
+                rule.formula = [Translator(f"={f}", origin=origin).translate_formula(dest)[1:] for f in rule.formula]
+            formats.add(target, rule)
+    ws.conditional_formatting = formats
+
+def write_template_workbook(df_export: pd.DataFrame, template_bytes: bytes, industry_option: str,
+                            progress=None) -> io.BytesIO:
+    """
+    template.xlsx のバイト列から毎回新しい Workbook を作り、
+    入力マスター（B=企業名, C=業種, D=住所, E=電話）へ書き込んで xlsx を返す。
+    開拓先リストのカード・プルダウン・印刷範囲は、テンプレの行数ではなく書き込んだ件数に合わせる。
+    progress(ステージ名, 進捗0〜1) を渡すと書き込み中の進捗を通知する。
+    """
+    from openpyxl import load_workbook
+    from openpyxl.styles import PatternFill
+    from openpyxl.worksheet.datavalidation import DataValidation
+
+    if progress is not None:
+        progress("template_write", 0.0)  # テンプレの読み込み自体に時間がかかるので先に通知しておく
+    wb = load_workbook(io.BytesIO(template_bytes))
+
+    if TEMPLATE_MASTER_SHEET not in wb.sheetnames:
+        raise ValueError("template.xlsx に『入力マスター』というシートが存在しません。")
+
+    sheet_master = wb[TEMPLATE_MASTER_SHEET]
+    template_master_rows = sheet_master.max_row
+
+    # ※ここでは「既存データを全クリアする処理」は不要
+    #   毎回、まっさらな template.xlsx から作り直している前提。
+    #   もしテンプレにサンプル行が入っている場合は、
+    #   そのサンプルを消した「空テンプレ」を1つ作っておくとさらに速くなります。
+
+    # 物流ハイライト（業種に特定語が含まれる場合、C列を赤く）
+    red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+
+    def is_logi(val: str) -> bool:
+        v = (val or "").strip()
+        return any(word in v for word in highlight_partial)
+
+    # データ書き込み（B=企業名, C=業種, D=住所, E=電話）
+    n_export = max(len(df_export), 1)
+    for idx_row, row in df_export.iterrows():
+        if progress is not None and idx_row % 500 == 0:
+            progress("template_write", idx_row / n_export)
+        r = idx_row + 2
+        sheet_master.cell(row=r, column=2, value=row["企業名"])
+        sheet_master.cell(row=r, column=3, value=row["業種"])
+        sheet_master.cell(row=r, column=4, value=row["住所"])
+        sheet_master.cell(row=r, column=5, value=row["電話番号"])
+        if industry_option == "物流業" and is_logi(row["業種"]):
+            sheet_master.cell(row=r, column=3).fill = red_fill
+
+    # 入力マスターの No（A列、カードが VLOOKUP で引く番号）がテンプレの行数より足りなければ足す
+    n_cards = max(len(df_export), 1)
+    no_cell = sheet_master.cell(row=template_master_rows, column=1)
+    if isinstance(no_cell.value, str) and no_cell.value.startswith("="):
+        for r in range(template_master_rows + 1, n_cards + 2):
+            cell = sheet_master.cell(row=r, column=1, value=no_cell.value)
+            cell._style = copy(no_cell._style)
+
+    # ===============================
+    # 開拓先リストシートのカード枚数・プルダウン＆印刷範囲設定（件数に合わせる）
+    # ===============================
+    if LEAD_SHEET in wb.sheetnames:
+        sheet_k = wb[LEAD_SHEET]
+        fit_lead_cards(sheet_k, n_cards)
+        last_row_k = LEAD_CARD_FIRST_ROW + n_cards * LEAD_CARD_ROWS - 1
+
+        # プルダウン（データ検証）: H列の H3, H9, H15, ... を1つの検証の範囲（空白区切り）にまとめる
+        try:
+            dv = DataValidation(
+                type="list",
+                formula1=LEAD_STATUS_CHOICES,
+                allow_blank=True,
+                sqref=" ".join(
+                    f"{LEAD_STATUS_COLUMN}{LEAD_CARD_FIRST_ROW + LEAD_STATUS_OFFSET + k * LEAD_CARD_ROWS}"
+                    for k in range(n_cards)
+                ),
+            )
+            sheet_k.add_data_validation(dv)
+        except Exception:
+            pass
+
+        # 印刷範囲を A〜L、カードのある行までに設定
+        try:
+            sheet_k.print_area = f"A1:{LEAD_LAST_COLUMN}{last_row_k}"
+        except Exception:
+            pass
+
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+# ===============================
+# ステージ計測（時間・行数・ピークメモリ）
+# ===============================
+# tracemalloc はプロセス全体で1つなので、計測中のジョブ数を数えて
+# 最初のジョブが開始し、最後のジョブが終わったときに止める（外で開始済みなら止めない）。
+_TRACE_LOCK = threading.Lock()
+_trace_state = {"users": 0, "joins": 0, "owned": False}
+
+def _trace_acquire():
+    with _TRACE_LOCK:
+        if _trace_state["users"] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_state["owned"] = True
+        _trace_state["users"] += 1
+        _trace_state["joins"] += 1
+
+def _trace_release():
+    with _TRACE_LOCK:
+        _trace_state["users"] -= 1
+        if _trace_state["users"] == 0 and _trace_state["owned"]:
+            tracemalloc.stop()
+            _trace_state["owned"] = False
+
+class StageMetrics:
+    """
+    1ファイル分の処理をステージごとに計測する。
+    ・seconds : 壁時計時間（perf_counter）
+    ・rows_in / rows_out : ステージ前後の行数
+    ・peak_mb : ステージ中に Python が確保したメモリのピーク（tracemalloc、開始時点比。プロセス全体の値）
+    ・memory_shared : ステージ中に別のジョブも計測していたか。True のときはピークを他のジョブと共有しているので
+      reset_peak() できず、peak_mb は他の処理分やステージ開始前のピークを含むプロセス全体の目安になる
+    """
+
+    def __init__(self, file_name: str, track_memory: bool = False):
+        self.file_name = file_name
+        self.track_memory = track_memory
+        self.stages = []
+        self._tracing = False
+
+    @contextmanager
+    def stage(self, name: str, rows_in=None):
+        rec = {"stage": name, "rows_in": rows_in, "rows_out": None, "seconds": None,
+               "peak_mb": None, "memory_shared": None}
+        base = joins = 0
+        if self.track_memory:
+            if not self._tracing:
+                _trace_acquire()
+                self._tracing = True
+            with _TRACE_LOCK:
+                rec["memory_shared"] = _trace_state["users"] > 1
+                joins = _trace_state["joins"]
+                if not rec["memory_shared"]:
+                    tracemalloc.reset_peak()  # 他に計測中のジョブがいないときだけ
+                base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["seconds"] = round(time.perf_counter() - t0, 4)
+            if self._tracing:
+                with _TRACE_LOCK:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    rec["memory_shared"] = (rec["memory_shared"] or _trace_state["users"] > 1
+                                            or _trace_state["joins"] != joins)
+                rec["peak_mb"] = round(max(peak - base, 0) / (1024 * 1024), 2)
+            self.stages.append(rec)
+
+    def finish(self):
+        """このジョブの計測を終える（最後のジョブなら tracemalloc を止める）"""
+        if self._tracing:
+            _trace_release()
+        self._tracing = False
+
+    def collapse(self):
+        """同じ名前のステージを1行にまとめる（分割処理でチャンクごとに計測した分を合計する。peak_mb は最大値）"""
+        merged = {}
+        for rec in self.stages:
+            cur = merged.get(rec["stage"])
+            if cur is None:
+                merged[rec["stage"]] = dict(rec)
+                continue
+            for key in ("rows_in", "rows_out", "seconds"):
+                if rec[key] is not None:
+                    cur[key] = (cur[key] or 0) + rec[key]
+            if rec["peak_mb"] is not None:
+                cur["peak_mb"] = max(cur["peak_mb"] or 0, rec["peak_mb"])
+                cur["memory_shared"] = bool(cur["memory_shared"] or rec["memory_shared"])
+        self.stages = [dict(r, seconds=round(r["seconds"], 4)) for r in merged.values()]
+
+    def combine(self, *others) -> "StageMetrics":
+        """別ジョブで計測したステージ（テンプレ書き込みなど）を後ろにつなげたコピーを返す"""
+        merged = StageMetrics(self.file_name, track_memory=self.track_memory)
+        merged.stages = list(self.stages)
+        for other in others:
+            merged.stages.extend(other.stages)
+        return merged
+
+    def total_seconds(self) -> float:
+        return round(sum(r["seconds"] or 0 for r in self.stages), 4)
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.stages, columns=["stage", "rows_in", "rows_out", "seconds", "peak_mb", "memory_shared"])
+        return df.astype({"rows_in": "Int64", "rows_out": "Int64"})
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.file_name,
+            "total_seconds": self.total_seconds(),
+            "stages": list(self.stages),
+        }
+
+
+# ===============================
+# 1ファイル分の処理（読み込み〜重複除去）
+# ===============================
+# 進捗表示用: 各ステージ開始時点の進捗率
+PIPELINE_PROGRESS = {
+    "read": 0.0,
+    "load": 0.0,
+    "extract": 0.15,
+    "clean": 0.45,
+    "keys": 0.5,
+    "store": 0.52,
+    "city_filter": 0.55,
+    "industry_filter": 0.65,
+    "ng_match": 0.7,
+    "ng_fuzzy": 0.8,
+    "dedup": 0.9,
+    "dedup_company": 0.95,
+}
+
+# 結果の dict に入る、ステージごとの除外件数
+REMOVAL_COUNT_KEYS = (
+    "removed_by_city_filter",
+    "removed_by_industry",
+    "company_removed",
+    "fuzzy_removed",
+    "phone_removed",
+    "dup_removed",
+    "company_dup_removed",
+)
+
+def _new_result() -> dict:
+    result = dict.fromkeys(REMOVAL_COUNT_KEYS, 0)
+    result.update({"profile": TEMPLATE_MASTER_SHEET, "sheets": [], "store_file_id": None})
+    return result
+
+def _progress_reporter(progress):
+    def report(stage):
+        if progress is not None:
+            progress(stage, PIPELINE_PROGRESS[stage])
+    return report
+
+def run_filters(df: pd.DataFrame, metrics: "StageMetrics", result: dict, removal_logs: list, report, *,
+                industry_option: str, town_tokens=None, ng_names=(), ng_phones=frozenset(),
+                ng_index=None, ng_fuzzy_threshold=None, dedup_company_address: bool = False,
+                seen_phone_keys: "PhoneKeySet" = None) -> pd.DataFrame:
+    """
+    比較キー付きの df に 市区町村フィルタ〜業種フィルタ〜NG照合〜重複除去 をかける。
+    アップロード直後（run_pipeline）と、保存済みの行から作り直すとき（run_stored）、
+    分割処理のチャンクごと（run_pipeline_chunked、seen_phone_keys で前のチャンクとの重複も見る）の共通部分。
+    除外件数は result に、削除ログは removal_logs に書き込む。
+    """
+    # ★ 市区町村フィルタ（KEN_ALL の G/H/I を使用）
+    if town_tokens:
+        report("city_filter")
+        with metrics.stage("city_filter", rows_in=len(df)) as m:
+            df, result["removed_by_city_filter"] = filter_by_city(df, town_tokens)
+            m["rows_out"] = len(df)
+
+    # --- 業種フィルター（製造業のみ除外ルール適用）＋ 有限会社は全業種で除外 ---
+    report("industry_filter")
+    with metrics.stage("industry_filter", rows_in=len(df)) as m:
+        df, result["removed_by_industry"] = filter_industry(df, industry_option)
+        m["rows_out"] = len(df)
+
+    # --- NG照合（任意） ---
+    if ng_names or ng_phones:
+        report("ng_match")
+        with metrics.stage("ng_match", rows_in=len(df)) as m:
+            df, result["company_removed"], result["phone_removed"] = remove_ng_matches(
+                df, ng_names, ng_phones, removal_logs
+            )
+            m["rows_out"] = len(df)
+
+    # --- NG企業名のあいまい照合（任意） ---
+    if ng_index is not None and ng_fuzzy_threshold:
+        report("ng_fuzzy")
+        with metrics.stage("ng_fuzzy", rows_in=len(df)) as m:
+            df, result["fuzzy_removed"] = remove_ng_fuzzy_matches(
+                df, ng_index, ng_fuzzy_threshold, removal_logs
+            )
+            m["rows_out"] = len(df)
+
+    # --- 重複（電話番号の正規化キー）除去（※このファイル内だけ） ---
+    report("dedup")
+    with metrics.stage("dedup", rows_in=len(df)) as m:
+        df, result["dup_removed"] = remove_duplicate_phones(df, removal_logs, seen_phone_keys)
+        m["rows_out"] = len(df)
+
+    # --- 重複（企業名＋住所、ブロック分け）除去 ---
+    if dedup_company_address:
+        report("dedup_company")
+        with metrics.stage("dedup_company", rows_in=len(df)) as m:
+            df, result["company_dup_removed"] = remove_duplicate_companies(df, removal_logs)
+            m["rows_out"] = len(df)
+
+    return drop_empty_rows(df)
+
+def run_pipeline(data: bytes, *, profile: str, industry_option: str, town_tokens=None,
+                 ng_names=(), ng_phones=frozenset(), ng_index=None, ng_fuzzy_threshold=None,
+                 dedup_company_address: bool = False, store=None, file_name: str = "", sheets=None,
+                 track_memory: bool = False, progress=None) -> dict:
+    """
+    アップロードされたファイルのバイト列を、抽出〜正規化〜フィルタ〜NG照合〜重複除去まで通す。
+    画面には触らないので、バックグラウンドのワーカーからも呼べる。
+    progress(ステージ名, 進捗0〜1) はステージの切り替わりごとに呼ばれる
+    （ジョブのキャンセル時はここから JobCancelled が送出される）。
+
+    profile=PROFILE_AUTO なら先頭行から抽出プロファイルを推定する（判定できなければ ValueError）。
+    xlsx は sheets のシート（省略時はすべてのシート）をワーカーで並行して読み込み・抽出し、
+    1つにまとめてからフィルタ以降へ流す（2枚以上なら取り出したシート名が SHEET_COLUMN 列に入る）。
+    ng_index と ng_fuzzy_threshold を両方渡すと、NG企業名のあいまい照合も行う。
+    dedup_company_address=True なら、企業名＋住所が似ている行の重複除去も行う。
+    store（ResultStore）を渡すと、フィルタ前の整形済みの行を保存しておく（あとで run_stored で作り直せる）。
+    保存済みの同じファイル・同じ抽出方式なら書き直さず、その file_id を返す。
+
+    戻り値の dict:
+      df / removal_logs / metrics / profile（実際に使った抽出方式、template互換なら『入力マスター』）/
+      sheets（抽出したシート名、空のシートは除く）/ store_file_id（保存しなければ None）と、各ステージの除外件数
+      （removed_by_city_filter, removed_by_industry, company_removed, fuzzy_removed,
+        phone_removed, dup_removed, company_dup_removed）
+    """
+    report = _progress_reporter(progress)
+    metrics = StageMetrics(file_name, track_memory=track_memory)
+    removal_logs = []
+    result = _new_result()
+    try:
+        # --- 抽出 ---
+        report("read")
+        with metrics.stage("read") as m:
+            frames, is_template = read_upload_sheets(io.BytesIO(data), file_name, sheets)
+            m["rows_out"] = raw_rows = sum(len(f) for f in frames.values())
+
+        report("extract")
+        with metrics.stage("extract", rows_in=raw_rows) as m:
+            if is_template:
+                df = extract_template_master(frames[TEMPLATE_MASTER_SHEET])
+            else:
+                df, used = extract_sheets(frames, profile)
+                result["profile"] = profile_label(used)
+                result["sheets"] = [name for name in used if name]
+            m["rows_out"] = len(df)
+        del frames
+
+        # --- 非電話列のみ正規化 ---
+        report("clean")
+        with metrics.stage("clean", rows_in=len(df)) as m:
+            df = clean_dataframe_except_phone(df)
+            m["rows_out"] = len(df)
+
+        # --- 比較キー ---
+        report("keys")
+        with metrics.stage("keys", rows_in=len(df)) as m:
+            df = add_match_keys(df)
+            m["rows_out"] = len(df)
+
+        # --- 結果ストアへ保存（フィルタ前の行。NGリストや市区町村を変えて作り直せるように） ---
+        if store is not None:
+            report("store")
+            with metrics.stage("store", rows_in=len(df)) as m:
+                # 同じファイルでも読んだシートが違えば別のリストとして保存する
+                source_hash = hashlib.sha1(data)
+                source_hash.update("\n".join(result["sheets"]).encode("utf-8"))
+                source_hash = source_hash.hexdigest()
+                # 保存するのは最初に抽出したときだけ（NGリストなどのオプション変更での再実行では書き直さない）
+                file_id = store.find(source_hash, result["profile"])
+                if file_id is None:
+                    file_id = store.save(df, file_name=file_name, profile=result["profile"], source_hash=source_hash)
+                result["store_file_id"] = file_id
+                m["rows_out"] = len(df)
+
+        df = run_filters(
+            df, metrics, result, removal_logs, report,
+            industry_option=industry_option, town_tokens=town_tokens,
+            ng_names=ng_names, ng_phones=ng_phones, ng_index=ng_index,
+            ng_fuzzy_threshold=ng_fuzzy_threshold, dedup_company_address=dedup_company_address,
+        )
+    finally:
+        metrics.finish()
+
+    result.update({"df": df, "removal_logs": removal_logs, "metrics": metrics})
+    return result
+
+def run_stored(store, file_id: int, *, industry_option: str, municipalities=None, town_tokens=None,
+               ng_names=(), ng_phones=frozenset(), ng_index=None, ng_fuzzy_threshold=None,
+               dedup_company_address: bool = False, track_memory: bool = False, progress=None) -> dict:
+    """
+    結果ストアに保存済みの行から、フィルタ〜NG照合〜重複除去だけをやり直す（読み込み・抽出は不要）。
+    municipalities（住所から取った市区町村名のリスト）を渡すと、その市区町村の行だけを読み出す。
+    戻り値は run_pipeline と同じ形。
+    """
+    info = store.file_info(file_id)
+    if info is None:
+        raise ValueError(f"保存済みのリストが見つかりません（id={file_id}）")
+    report = _progress_reporter(progress)
+    metrics = StageMetrics(info["file_name"], track_memory=track_memory)
+    removal_logs = []
+    result = _new_result()
+    result.update({"profile": info["profile"], "store_file_id": file_id})
+    try:
+        report("load")
+        with metrics.stage("load") as m:
+            df = store.load_rows(file_id, municipalities)
+            m["rows_out"] = len(df)
+
+        df = run_filters(
+            df, metrics, result, removal_logs, report,
+            industry_option=industry_option, town_tokens=town_tokens,
+            ng_names=ng_names, ng_phones=ng_phones, ng_index=ng_index,
+            ng_fuzzy_threshold=ng_fuzzy_threshold, dedup_company_address=dedup_company_address,
+        )
+    finally:
+        metrics.finish()
+
+    result.update({"df": df, "removal_logs": removal_logs, "metrics": metrics})
+    return result
+
+def render_template(df_export: pd.DataFrame, template_bytes: bytes, industry_option: str,
+                    file_name: str = "", track_memory: bool = False, progress=None) -> dict:
+    """テンプレ書き込みを計測付きで行う（ジョブとして投げる用）。戻り値: {"output", "metrics"}"""
+    metrics = StageMetrics(file_name, track_memory=track_memory)
+    try:
+        with metrics.stage("template_write", rows_in=len(df_export)) as m:
+            output = write_template_workbook(df_export, template_bytes, industry_option, progress=progress)
+            m["rows_out"] = len(df_export)
+    finally:
+        metrics.finish()
+    return {"output": output, "metrics": metrics}
+
+def _scaled_progress(progress, lo: float, hi: float):
+    if progress is None:
+        return None
+    return lambda stage, p=None: progress(stage, None if p is None else lo + (hi - lo) * p)
+
+def _with_template(result: dict, template_bytes: bytes, industry_option: str,
+                   track_memory: bool, progress) -> dict:
+    """run_pipeline / run_stored の結果を template.xlsx に書き込み、output と合算 metrics を足す"""
+    df_export = result["df"][OUTPUT_COLUMNS].reset_index(drop=True)
+    rendered = render_template(
+        df_export, template_bytes, industry_option,
+        file_name=result["metrics"].file_name, track_memory=track_memory,
+        progress=_scaled_progress(progress, 0.5, 1.0),
+    )
+    result["output"] = rendered["output"]
+    result["metrics"] = result["metrics"].combine(rendered["metrics"])
+    return result
+
+def process_file(data: bytes, template_bytes: bytes, *, industry_option: str,
+                 file_name: str = "", track_memory: bool = False, progress=None, **pipeline_kwargs) -> dict:
+    """
+    run_pipeline → render_template を続けて行う（画面を介さないジョブ用）。
+    pipeline_kwargs はそのまま run_pipeline へ渡す。
+    戻り値: run_pipeline の dict に output（xlsx の BytesIO）を足し、metrics を合算したもの。
+    """
+    result = run_pipeline(
+        data, industry_option=industry_option, file_name=file_name,
+        track_memory=track_memory, progress=_scaled_progress(progress, 0.0, 0.5), **pipeline_kwargs
+    )
+    return _with_template(result, template_bytes, industry_option, track_memory, progress)
+
+def process_stored(store, file_id: int, template_bytes: bytes, *, industry_option: str,
+                   track_memory: bool = False, progress=None, **filter_kwargs) -> dict:
+    """run_stored → render_template を続けて行う。戻り値は process_file と同じ形"""
+    result = run_stored(
+        store, file_id, industry_option=industry_option, track_memory=track_memory,
+        progress=_scaled_progress(progress, 0.0, 0.5), **filter_kwargs
+    )
+    return _with_template(result, template_bytes, industry_option, track_memory, progress)
+
+# ===============================
+# 大きなファイルの分割処理（ピークメモリをチャンクの大きさで抑える）
+# ===============================
+CHUNKED_SHEET = "整形済み"
+CHUNKED_LOG_SHEET = "削除ログ"
+
+def run_pipeline_chunked(data: bytes, *, profile: str, industry_option: str, town_tokens=None,
+                         ng_names=(), ng_phones=frozenset(), ng_index=None, ng_fuzzy_threshold=None,
+                         file_name: str = "", sheets=None, chunk_rows: int = CHUNK_ROWS,
+                         track_memory: bool = False, progress=None) -> dict:
+    """
+    100万行級の入力向けの run_pipeline。
+    読み込み〜抽出〜正規化〜フィルタ〜NG照合〜電話番号の重複除去を chunk_rows 行ずつ流し、
+    残った行と削除ログは xlsxwriter（constant_memory）でそのまま書き出す。
+    ファイル全体の DataFrame も削除ログのリストも持たないので、メモリは入力の大きさではなくチャンクの大きさで決まる。
+    ・チャンクの境目をまたぐレコードは extract_chunks が持ち越してつなぐ（一括抽出と同じ結果）
+    ・電話番号の重複は、それまでのチャンクで残した電話キーを PhoneKeySet に持って、ファイル全体で判定する
+    ・xlsx の複数シート（sheets、省略時はすべて）は1枚ずつ順に流す（並行にはしない。メモリを抑えるのが目的なので）
+    ・企業名＋住所の重複除去・結果ストアへの保存・template.xlsx への書き込みはしない
+      （全件を見比べる必要がある / テンプレは件数分のカードを並べるため、大きなリストには向かない）
+
+    戻り値の dict: run_pipeline と同じ除外件数・profile・metrics に加えて
+      output（『整形済み』『削除ログ』シートの xlsx の BytesIO）/ rows（残った件数）/ chunks（チャンク数）。
+      df と removal_logs は持たない（None / 空リスト）。
+    """
+    report = progress or (lambda stage, p=None: None)
+    metrics = StageMetrics(file_name, track_memory=track_memory)
+    result = _new_result()
+    result.update({"rows": 0, "chunks": 0})
+    seen = PhoneKeySet()
+    output = io.BytesIO()
+    read_rows = counted_rows = 0
+    try:
+        report("read", 0.0)
+        is_template, total_rows, sheet_names, raw_chunks = iter_upload_chunks(data, file_name, chunk_rows, sheets)
+        multi_sheet = not is_template and len(sheet_names) > 1
+
+        def counted():
+            nonlocal read_rows
+            for sheet, chunk in raw_chunks:
+                read_rows += len(chunk)
+                yield sheet, chunk
+
+        def extract_by_sheet():
+            # シートごとに抽出プロファイルを決めて、シートの中だけでチャンクの境目をつなぐ
+            for sheet, group in groupby(counted(), key=itemgetter(0)):
+                chunks = (chunk for _, chunk in group)
+                first = next(chunks)
+                used[sheet] = resolve_sheet_profile(first, profile, sheet)
+                for df in extract_chunks(chain([first], chunks), PROFILE_SCANNERS[used[sheet]], carry_logs):
+                    yield df.assign(**{SHEET_COLUMN: sheet}) if multi_sheet else df
+
+        used, carry_logs = {}, []  # carry_logs: 持ち越しを打ち切ったときの記録（次に書く削除ログへ足す）
+        if is_template:
+            extracted = (extract_template_master(c, header=(i == 0)) for i, (_, c) in enumerate(counted()))
+        else:
+            extracted = extract_by_sheet()
+
+        writer = StreamingXlsxWriter(output, {
+            CHUNKED_SHEET: OUTPUT_COLUMNS + ([SHEET_COLUMN] if multi_sheet else []) + list(EXPORT_KEY_COLUMNS.values()),
+            CHUNKED_LOG_SHEET: REMOVAL_LOG_COLUMNS + ["score"],
+        })
+        while True:
+            # 読み込みは抽出側から引っぱられるので、read は extract の時間に含まれる
+            with metrics.stage("extract") as m:
+                df = next(extracted, None)
+                m["rows_in"], m["rows_out"] = read_rows - counted_rows, (0 if df is None else len(df))
+                counted_rows = read_rows
+            if df is None:
+                break
+            report("chunk", min(read_rows / total_rows, 0.99) if total_rows else None)
+
+            with metrics.stage("clean", rows_in=len(df)) as m:
+                df = clean_dataframe_except_phone(df)
+                m["rows_out"] = len(df)
+            with metrics.stage("keys", rows_in=len(df)) as m:
+                df = add_match_keys(df)
+                m["rows_out"] = len(df)
+
+            chunk_result, chunk_logs = _new_result(), carry_logs[:]
+            carry_logs.clear()
+            df = run_filters(
+                df, metrics, chunk_result, chunk_logs, lambda stage: report(stage, None),
+                industry_option=industry_option, town_tokens=town_tokens,
+                ng_names=ng_names, ng_phones=ng_phones, ng_index=ng_index,
+                ng_fuzzy_threshold=ng_fuzzy_threshold, dedup_company_address=False, seen_phone_keys=seen,
+            )
+            for key in REMOVAL_COUNT_KEYS:
+                result[key] += chunk_result[key]
+
+            with metrics.stage("write", rows_in=len(df)) as m:
+                writer.append(CHUNKED_SHEET, cleaned_export_frame(df))
+                writer.append(CHUNKED_LOG_SHEET, removal_log_frame(chunk_logs))
+                m["rows_out"] = len(df)
+            result["rows"] += len(df)
+            result["chunks"] += 1
+
+        report("write", 0.99)
+        with metrics.stage("write") as m:
+            writer.close()  # 一時ファイルに書いておいた各シートを xlsx にまとめる
+        output.seek(0)
+        if not is_template:
+            # シートがすべて空なら extract_sheets と同じく、指定した抽出プロファイル（自動判定なら ""）
+            result["profile"] = profile_label(used) if used else ("" if profile == PROFILE_AUTO else profile)
+            result["sheets"] = [name for name in used if name]
+    finally:
+        metrics.finish()
+    metrics.collapse()
+
+    result.update({"df": None, "removal_logs": [], "output": output, "metrics": metrics})
+    return result
+
+
+# ===============================
+# 高速出力（整形済みデータ・削除ログを CSV / Parquet で）
+# ===============================
+EXPORT_FORMATS = ["csv", "parquet"]
+EXPORT_KEY_COLUMNS = {
+    "__phone_key": "電話キー",
+    "__phone_type": "電話種別",
+    "__pref": "都道府県",
+    "__municipality": "市区町村",
+}
+REMOVAL_LOG_COLUMNS = ["reason", "company", "phone_raw", "match"]
+
+def cleaned_export_frame(df: pd.DataFrame, df_export: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    下流システム向けの整形済みデータ。
+    企業名/業種/住所/電話番号（df_export を渡せばプレビュー編集後の値）に、
+    シート（複数シートから取り出した場合）と照合用の 電話キー・電話種別・都道府県・市区町村 を付けて返す。
+    """
+    base = df[["企業名", "業種", "住所", "電話番号"]] if df_export is None else df_export
+    if SHEET_COLUMN in df.columns:
+        base = base.join(df[[SHEET_COLUMN]])
+    keys = df[[c for c in EXPORT_KEY_COLUMNS if c in df.columns]].rename(columns=EXPORT_KEY_COLUMNS)
+    return base.join(keys).reset_index(drop=True)
+
+def removal_log_frame(removal_logs: list) -> pd.DataFrame:
+    return pd.DataFrame(removal_logs, columns=None if removal_logs else REMOVAL_LOG_COLUMNS)
+
+XLSX_MAX_ROWS = 1_048_576
+
+class StreamingXlsxWriter:
+    """
+    xlsxwriter の constant_memory モードで、シートの末尾へ行を書き足していく
+    （書いた行はその場で一時ファイルへ出るので、メモリに溜まらない）。
+    1シートの上限（1,048,576 行）を超えた分は『シート名_2』『シート名_3』… へ続ける。
+    文字列は数式・URL・数値に変換せず、そのまま書く。
+    """
+
+    def __init__(self, output, sheets: dict):
+        import xlsxwriter
+
+        self.workbook = xlsxwriter.Workbook(output, {
+            "constant_memory": True,
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+            "strings_to_numbers": False,
+        })
+        self.columns = dict(sheets)
+        self._sheets = {}  # シート名 -> [worksheet, 次に書く行, 何枚目か]
+        for name in self.columns:
+            self._add_sheet(name, 1)
+
+    def _add_sheet(self, name: str, part: int):
+        ws = self.workbook.add_worksheet(name if part == 1 else f"{name}_{part}")
+        ws.write_row(0, 0, self.columns[name])
+        self._sheets[name] = [ws, 1, part]
+
+    def append(self, name: str, frame: pd.DataFrame):
+        rows = frame.reindex(columns=self.columns[name]).astype(object)
+        for values in rows.where(rows.notna(), None).values.tolist():
+            state = self._sheets[name]
+            if state[1] >= XLSX_MAX_ROWS:
+                self._add_sheet(name, state[2] + 1)
+                state = self._sheets[name]
+            state[0].write_row(state[1], 0, values)
+            state[1] += 1
+
+    def close(self):
+        self.workbook.close()
+
+def export_frame_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    """DataFrame を CSV（UTF-8 BOM 付き、Excel でそのまま開ける）か Parquet のバイト列にする"""
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8-sig")
+    if fmt == "parquet":
+        buf = io.BytesIO()
+        try:
+            df.to_parquet(buf, index=False)
+        except ImportError:
+            raise ValueError("Parquet の出力には pyarrow が必要です（pip install pyarrow）。")
+        return buf.getvalue()
+    raise ValueError(f"未対応の出力形式です: {fmt}")
+
+
+# ===============================
+# 結果ストア（SQLite）… フィルタ前の整形済みの行を保存して、あとから作り直す
+# ===============================
+DEFAULT_STORE_PATH = Path(__file__).resolve().parent / "g_change_results.sqlite3"
+STORE_DISABLED_VALUES = ("", "0", "off", "none")
+STORE_DEFAULT_PATH_VALUES = ("1", "on", "true", "yes")
+STORE_MAX_FILES = 20  # これより古いリストは保存時に消す（GCHANGE_STORE_MAX_FILES で変更、0 なら無制限）
+STORE_COLUMNS = {
+    # DB の列名: DataFrame の列名
+    "company": "企業名",
+    "industry": "業種",
+    "address": "住所",
+    "phone": "電話番号",
+    "company_canon": "__company_canon",
+    "phone_digits": "__digits",
+    "phone_key": "__phone_key",
+    "phone_type": "__phone_type",
+    "pref": "__pref",
+    "municipality": "__municipality",
+    "sheet": SHEET_COLUMN,
+}
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name   TEXT NOT NULL,
+    profile     TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    row_count   INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    UNIQUE (source_hash, profile)
+);
+CREATE TABLE IF NOT EXISTS rows (
+    file_id       INTEGER NOT NULL,
+    row_no        INTEGER NOT NULL,
+    company       TEXT,
+    industry      TEXT,
+    address       TEXT,
+    phone         TEXT,
+    company_canon TEXT,
+    phone_digits  TEXT,
+    phone_key     INTEGER,
+    phone_type    TEXT,
+    pref          TEXT,
+    municipality  TEXT,
+    sheet         TEXT,
+    PRIMARY KEY (file_id, row_no)
+);
+CREATE INDEX IF NOT EXISTS idx_rows_phone_key ON rows (phone_key);
+CREATE INDEX IF NOT EXISTS idx_rows_company_canon ON rows (company_canon);
+CREATE INDEX IF NOT EXISTS idx_rows_municipality ON rows (file_id, municipality);
+CREATE INDEX IF NOT EXISTS idx_rows_industry ON rows (industry);
+"""
+
+class ResultStore:
+    """
+    処理したファイルごとに、抽出・正規化・比較キー付与まで済んだ行（フィルタ前）を保存する。
+    NGリストや市区町村フィルタを変えて作り直すときは、元ファイルの再アップロード・再抽出なしで
+    run_stored / process_stored から使う。
+    同じ内容のファイルを同じ抽出方式で再処理した場合は上書きする。
+    max_files を超えた分は、保存のたびに古いリストから消す（0 なら無制限）。
+    接続は操作ごとに開いて閉じ、書き込みは BEGIN IMMEDIATE で最初に書き込みロックを取ってから行うので、
+    複数のワーカーから同時に使ってよい（同じファイルの保存が重なっても、後の方が待ってから置き換える）。
+    """
+
+    def __init__(self, path, max_files: int = STORE_MAX_FILES):
+        self.path = str(path)
+        self.max_files = max_files
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        with self._connect(write=True) as conn:
+            for statement in STORE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            # シート列が無かったころに作ったストアには列を足す
+            if "sheet" not in {row[1] for row in conn.execute("PRAGMA table_info(rows)")}:
+                conn.execute("ALTER TABLE rows ADD COLUMN sheet TEXT")
+
+    @contextmanager
+    def _connect(self, write: bool = False):
+        """
+        接続を開き、抜けるときに必ず閉じる（ワーカーのスレッドに接続を残さない）。
+        write=True なら BEGIN IMMEDIATE で書き込みロックを取ってから始め、抜けるときに COMMIT（例外なら ROLLBACK）。
+        """
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as conn:
+            if not write:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def save(self, df: pd.DataFrame, *, file_name: str, profile: str, source_hash: str) -> int:
+        """比較キー付きの df を保存して file_id を返す"""
+        rows = df.reindex(columns=list(STORE_COLUMNS.values()), fill_value="")
+        rows["__phone_key"] = rows["__phone_key"].astype(object).where(rows["__phone_key"].notna(), None)
+        records = [(i, *rec) for i, rec in enumerate(rows.itertuples(index=False, name=None))]
+        with self._connect(write=True) as conn:
+            old = conn.execute(
+                "SELECT id FROM files WHERE source_hash = ? AND profile = ?", (source_hash, profile)
+            ).fetchone()
+            if old is not None:
+                conn.execute("DELETE FROM rows WHERE file_id = ?", old)
+                conn.execute("DELETE FROM files WHERE id = ?", old)
+            cur = conn.execute(
+                "INSERT INTO files (file_name, profile, source_hash, row_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                (file_name, profile, source_hash, len(rows), time.time()),
+            )
+            file_id = cur.lastrowid
+            conn.executemany(
+                f"INSERT INTO rows (file_id, row_no, {', '.join(STORE_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(STORE_COLUMNS) + 2))})",
+                [(file_id, *rec) for rec in records],
+            )
+            if self.max_files > 0:
+                conn.execute(
+                    "DELETE FROM files WHERE id NOT IN "
+                    "(SELECT id FROM files ORDER BY created_at DESC, id DESC LIMIT ?)", (self.max_files,)
+                )
+                conn.execute("DELETE FROM rows WHERE file_id NOT IN (SELECT id FROM files)")
+        return file_id
+
+    def find(self, source_hash: str, profile: str):
+        """同じファイル・同じ抽出方式で保存済みなら その file_id（無ければ None）"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM files WHERE source_hash = ? AND profile = ?", (source_hash, profile)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def list_files(self) -> pd.DataFrame:
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT id, file_name, profile, row_count, created_at FROM files ORDER BY created_at DESC", conn
+            )
+
+    def file_info(self, file_id: int):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, file_name, profile, row_count, created_at FROM files WHERE id = ?", (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["id", "file_name", "profile", "row_count", "created_at"], row))
+
+    def municipalities(self, file_id: int) -> pd.DataFrame:
+        """保存済みの行の 都道府県・市区町村 ごとの件数（多い順）"""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT pref, municipality, COUNT(*) AS rows FROM rows WHERE file_id = ? "
+                "GROUP BY pref, municipality ORDER BY rows DESC",
+                conn, params=(file_id,),
+            )
+
+    def load_rows(self, file_id: int, municipalities=None) -> pd.DataFrame:
+        """
+        保存済みの行を run_filters にそのまま渡せる形（比較キー列つき）で読み出す。
+        municipalities を渡すと、その市区町村の行だけを索引で絞り込んで返す。
+        """
+        sql = f"SELECT {', '.join(STORE_COLUMNS)} FROM rows WHERE file_id = ?"
+        params = [file_id]
+        if municipalities:
+            sql += f" AND municipality IN ({', '.join('?' * len(municipalities))})"
+            params += list(municipalities)
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql + " ORDER BY row_no", conn, params=params)
+        df = df.rename(columns=STORE_COLUMNS)
+        for col in STORE_COLUMNS.values():
+            if col != "__phone_key":
+                df[col] = df[col].fillna("").astype(str)
+        df["__phone_key"] = df["__phone_key"].astype("Int64")
+        if not (df[SHEET_COLUMN] != "").any():
+            df = df.drop(columns=SHEET_COLUMN)  # 1枚のシート（や CSV）から保存したリスト
+        return df
+
+    def delete(self, file_id: int):
+        with self._connect(write=True) as conn:
+            conn.execute("DELETE FROM rows WHERE file_id = ?", (file_id,))
+            conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+def open_result_store():
+    """
+    環境変数 GCHANGE_STORE_PATH で保存を有効にしたときだけ結果ストアを開く（既定は保存しない＝None）。
+    GCHANGE_STORE_PATH=1（on）ならアプリ直下の g_change_results.sqlite3、それ以外の値はその場所を使う。
+    保存しておくリストの数は GCHANGE_STORE_MAX_FILES（既定 STORE_MAX_FILES）。
+    """
+    path = os.environ.get("GCHANGE_STORE_PATH", "").strip()
+    if path.lower() in STORE_DISABLED_VALUES:
+        return None
+    if path.lower() in STORE_DEFAULT_PATH_VALUES:
+        path = str(DEFAULT_STORE_PATH)
+    return ResultStore(path, max_files=int(os.environ.get("GCHANGE_STORE_MAX_FILES", STORE_MAX_FILES)))
+
+
+# ===============================
+# 参照データのキャッシュと事前読み込み（KEN_ALL 町域辞書・NGリスト・template.xlsx）
+# ===============================
+# 画面と API で共有するプロセス内キャッシュ。path と mtime をキーにしているので、
+# ファイルが更新されたときだけ読み直す。
+TEMPLATE_FILENAME = "template.xlsx"
+PREWARM_ENABLED_VALUES = ("1", "true", "on", "yes")
+
+@lru_cache(maxsize=64)  # NGリストは数十件あり、prewarm で全部載せても追い出されない大きさにする
+def _ng_data(path: str, mtime: float):
+    ng_names, ng_phones = load_ng_list(path)
+    return ng_names, frozenset(ng_phones), NgNameIndex(ng_names)
+
+def cached_ng_data(path):
+    """NGリスト xlsx を (企業名リスト, 電話キー, あいまい照合用インデックス) にして返す"""
+    path = Path(path).resolve()
+    return _ng_data(str(path), path.stat().st_mtime)
+
+@lru_cache(maxsize=1)
+def _city_town_index(path: str, mtime: float) -> dict:
+    return build_city_town_index(read_ken_all(Path(path)))
+
+def cached_city_town_index(base: Path) -> dict:
+    """base 直下の KEN_ALL から (都道府県, 市区町村) -> 町域セット を返す（KEN_ALL が無ければ空）"""
+    path = find_ken_all(base)
+    if path is None:
+        return {}
+    return _city_town_index(str(path), path.stat().st_mtime)
+
+@lru_cache(maxsize=4)
+def _file_bytes(path: str, mtime: float) -> bytes:
+    return Path(path).read_bytes()
+
+def cached_template_bytes(path) -> bytes:
+    """template.xlsx のバイト列（読むのは更新されたときだけ）"""
+    path = Path(path).resolve()
+    return _file_bytes(str(path), path.stat().st_mtime)
+
+def find_nglists(base: Path) -> list:
+    """base 直下の『NGリスト〜.xlsx』（macOS 由来の濁点分解ファイル名も NFC にそろえて判定）"""
+    return sorted(p for p in Path(base).glob("*.xlsx") if "NGリスト" in unicodedata.normalize("NFC", p.stem))
+
+def nglist_name(path: Path) -> str:
+    """画面・API で使う NGリスト名（拡張子なし、NFC）"""
+    return unicodedata.normalize("NFC", Path(path).stem)
+
+def find_nglist(base: Path, name: str):
+    """
+    NGリスト名から base 直下のファイルを探し、ディスク上のパスを返す（無ければ None）。
+    ファイル名が NFC でなくても見つかり、prewarm で載せたキャッシュと同じキーになる。
+    """
+    want = unicodedata.normalize("NFC", name)
+    for path in find_nglists(base):
+        if nglist_name(path) == want:
+            return path
+    return None
+
+def prewarm_enabled() -> bool:
+    """環境変数 GCHANGE_PREWARM=1 なら起動時に prewarm() する"""
+    return os.environ.get("GCHANGE_PREWARM", "").strip().lower() in PREWARM_ENABLED_VALUES
+
+def prewarm(base: Path) -> dict:
+    """
+    最初のリクエストより前に、重い import と参照データの読み込みを済ませておく。
+    openpyxl・KEN_ALL 町域辞書・base 直下の NGリスト・template.xlsx をキャッシュに載せ、
+    {項目: 秒数} を返す。読めなかった項目はエラー文を入れて先へ進む（実際に使うときに改めて報告される）。
+    """
+    base = Path(base)
+    tasks = [("openpyxl", lambda: [import_module(m) for m in OPENPYXL_MODULES]),
+             ("ken_all", lambda: cached_city_town_index(base))]
+    tasks += [(f"nglist:{p.stem}", lambda p=p: cached_ng_data(p)) for p in find_nglists(base)]
+    if (base / TEMPLATE_FILENAME).exists():
+        tasks.append(("template", lambda: cached_template_bytes(base / TEMPLATE_FILENAME)))
+
+    timings = {}
+    for name, task in tasks:
+        t0 = time.perf_counter()
+        try:
+            task()
+        except Exception as e:
+            timings[name] = f"error: {e}"
+        else:
+            timings[name] = round(time.perf_counter() - t0, 3)
+    return timings
+
+
+# ===============================
+# バックグラウンド実行（ワーカープール＋進捗＋キャンセル）
+# ===============================
+class JobCancelled(Exception):
+    """キャンセル要求を受けたジョブの中で送出される"""
+
+
+class Job:
+    """
+    ワーカーで実行する1件の処理。
+    ・status : queued / running / done / failed / cancelled
+    ・stage, progress : 実行中のステージ名と進捗（0〜1）
+    ・result / error : 完了時の戻り値 / 失敗時の例外メッセージ
+    処理関数には progress=job.report が渡され、キャンセル後に呼ばれると JobCancelled になる。
+    """
+
+    def __init__(self, owner: str, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = "queued"
+        self.stage = ""
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    def report(self, stage: str, progress=None):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.stage = stage
+        if progress is not None:
+            self.progress = float(progress)
+
+    def cancel(self):
+        """キャンセルを要求する（実行中なら次の進捗通知で止まる）"""
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def _finish(self, status: str):
+        self.status = status
+        self.finished_at = time.time()
+        self._fn = self._args = self._kwargs = None  # 入力データへの参照を手放す
+        self._done.set()
+
+    def _run(self):
+        if self._cancel.is_set():
+            self._finish("cancelled")
+            return
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            self.result = self._fn(*self._args, progress=self.report, **self._kwargs)
+        except JobCancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self._finish("failed")
+        else:
+            self.progress = 1.0
+            self._finish("done")
+
+
+class JobManager:
+    """
+    上限つきのワーカープール。
+    ・max_workers : サーバー全体で同時に動かすジョブ数
+    ・per_owner_limit : 1利用者（セッション）あたり同時に動かすジョブ数
+      上限を超えた分は利用者ごとの待ち行列に積み、自分のジョブが終わるたびに1件ずつ流す。
+      重いファイルを大量に投げた利用者がプールを占有して、他の利用者を待たせないため。
+    """
+
+    def __init__(self, max_workers: int = 4, per_owner_limit: int = 2):
+        self.max_workers = max_workers
+        self.per_owner_limit = max(1, per_owner_limit)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gchange-job")
+        self._lock = threading.Lock()
+        self._running = {}
+        self._pending = {}
+
+    def submit(self, owner: str, fn, *args, **kwargs) -> Job:
+        job = Job(owner, fn, args, kwargs)
+        with self._lock:
+            if self._running.get(owner, 0) < self.per_owner_limit:
+                self._start(job)
+            else:
+                self._pending.setdefault(owner, deque()).append(job)
+        return job
+
+    def _start(self, job: Job):
+        # ※ self._lock を持った状態で呼ぶ
+        self._running[job.owner] = self._running.get(job.owner, 0) + 1
+        self._pool.submit(self._run, job)
+
+    def _run(self, job: Job):
+        try:
+            job._run()
+        finally:
+            with self._lock:
+                self._running[job.owner] -= 1
+                queue = self._pending.get(job.owner)
+                while queue:
+                    nxt = queue.popleft()
+                    if nxt.cancel_requested:
+                        nxt._finish("cancelled")
+                        continue
+                    self._start(nxt)
+                    break
+                if not queue:
+                    self._pending.pop(job.owner, None)
+                if not self._running[job.owner]:
+                    del self._running[job.owner]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": sum(self._running.values()),
+                "pending": sum(len(q) for q in self._pending.values()),
+                "max_workers": self.max_workers,
+            }
@@ -1,13 +1,14 @@
 import streamlit as st
-import pandas as pd
-import re
-import unicodedata
-import io
 import os
+import json
+import threading
+import time
+import uuid
 from pathlib import Path
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
-from openpyxl.worksheet.datavalidation import DataValidation
+
+# pandas / openpyxl / g_change_core は重いので、ログインを通ってから import する（ログイン画面を先に出すため）
+
+APP_DIR = Path(__file__).resolve().parent
 
 # ===============================
 # 簡易ログイン（パスワード認証）
@@ -55,619 +56,239 @@ def check_password():
 # ===============================
 st.set_page_config(page_title="G-Change Next", layout="wide")
 
+# ===============================
+# 事前読み込み（GCHANGE_PREWARM=1 のとき、サーバーで最初の1回だけ）
+# ===============================
+@st.cache_resource
+def start_prewarm():
+    """
+    KEN_ALL 町域辞書・NGリスト・template.xlsx の読み込みをバックグラウンドで始める。
+    ログイン画面はすぐに出し、パスワードを入れている間に準備を済ませておく。
+    """
+    def run():
+        from g_change_core import prewarm
+        prewarm(APP_DIR)
+
+    if os.environ.get("GCHANGE_PREWARM", "").strip().lower() in ("1", "true", "on", "yes"):
+        thread = threading.Thread(target=run, name="g-change-prewarm", daemon=True)
+        thread.start()
+        return thread
+    return None
+
+start_prewarm()
+
 # ▼ここでログインチェック。失敗したら以降の処理は実行されない
 if not check_password():
     st.stop()
 
+import pandas as pd  # noqa: E402
+
+from g_change_core import (  # noqa: E402
+    CHUNK_ROWS,
+    INPUT_EXTENSIONS,
+    OUTPUT_COLUMNS,
+    PROFILE_AUTO,
+    PROFILES,
+    TEMPLATE_FILENAME,
+    JobManager,
+    cached_city_town_index,
+    cached_ng_data,
+    cached_template_bytes,
+    cleaned_export_frame,
+    export_frame_bytes,
+    find_ken_all,
+    find_nglist,
+    find_nglists,
+    list_upload_sheets,
+    nglist_name,
+    normalize_text,
+    open_result_store,
+    removal_log_frame,
+    render_template,
+    run_pipeline,
+    run_pipeline_chunked,
+    run_stored,
+)
+
 st.title("🚗 G-Change Next｜企業情報整形＆NG除外ツール（Ver6.4 市区町村フィルタ対応）")
 
 # ===============================
-# テキスト正規化
+# KEN_ALL 町域辞書・NGリスト（プロセス内キャッシュ。使うときに初めて読み込む）
 # ===============================
-def nfkc(s: str) -> str:
-    return unicodedata.normalize("NFKC", s)
-
-def normalize_text(x):
-    if x is None or (isinstance(x, float) and pd.isna(x)):
-        return ""
-    s = str(x).replace("\u3000", " ").replace("\xa0", " ")
-    s = re.sub(r'[−–—―ー]', '-', s)
-    return nfkc(s).strip()
-
-def clean_address(address: str) -> str:
-    address = normalize_text(address)
-    return address.strip()
-
-def extract_industry(line: str) -> str:
-    return normalize_text(line)
+def load_city_town_dict():
+    """
+    (都道府県, 市区町村) -> 町域セット への辞書。
+    市区町村フィルタを使うときに初めて作り、以後はプロセス内で使い回す。
+    """
+    try:
+        with st.spinner("KEN_ALL から町域辞書を作成しています…"):
+            return cached_city_town_index(APP_DIR)
+    except Exception as e:
+        st.warning(f"KEN_ALL 読み込みでエラーが発生しました: {e}")
+        return {}
 
 # ===============================
-# 企業名正規化（NG照合用）
+# 実行サマリー（除外件数）
 # ===============================
-COMPANY_SUFFIXES = ["株式会社", "(株)", "（株）", "有限会社", "(有)", "（有）", "合同会社"]
-def canonical_company_name(name: str) -> str:
-    s = normalize_text(name)
-    for suf in sorted(COMPANY_SUFFIXES, key=len, reverse=True):
-        s = s.replace(suf, "")
-    s = re.sub(r"[\s\-・/,.·･\(\)（）【】＆&＋+_|]", "", s)
-    return s
+def summary_markdown(res: dict) -> str:
+    """run_pipeline / run_stored の結果から、ステージごとの除外件数の箇条書きを作る"""
+    return (
+        f"- 市区町村フィルタ除外: **{res['removed_by_city_filter']}** 件\n"
+        f"- フィルター除外（製造業/有限会社など）: **{res['removed_by_industry']}** 件\n"
+        f"- NG（企業名 部分一致）削除: **{res['company_removed']}** 件\n"
+        f"- NG（企業名 あいまい一致）削除: **{res['fuzzy_removed']}** 件\n"
+        f"- NG（電話番号 正規化キー一致）削除: **{res['phone_removed']}** 件\n"
+        f"- 重複（電話番号 正規化キー一致）削除: **{res['dup_removed']}** 件\n"
+        f"- 重複（企業名＋住所 類似）削除: **{res['company_dup_removed']}** 件\n"
+    )
 
 # ===============================
-# 電話番号処理（原文保持）
+# プレビュー（ページ分割・サーバー側検索・差分編集）
 # ===============================
-HYPHENS = "-‒–—―−－ー‐﹣\u2011"
-HYPHENS_CLASS = re.escape(HYPHENS)
-
-# 電話番号候補抽出（誤検出防止）: 数字＋ハイフン/空白が続く8文字以上の塊
-CANDIDATE_RE = re.compile(rf"[+]?\d(?:[\d{HYPHENS_CLASS}\s]{{6,}})\d")
-
-def pick_phone_token_raw(line: str) -> str:
-    """1行から電話番号らしい文字列を抽出。digits 長が 9〜11 以外は不採用。原文表記（ハイフン位置）をそのまま返す。"""
-    if not line:
-        return ""
-    s = unicodedata.normalize("NFKC", str(line))
-    raw_cands = CANDIDATE_RE.findall(s)
-    cands = []
-    for token in raw_cands:
-        tok = token.strip()
-        if ":" in tok:           # 時刻混入などは除外
-            continue
-        digits = re.sub(r"\D", "", tok)
-        if not (9 <= len(digits) <= 11):
-            continue             # 11-10 のような短い塊は除外
-        if not (digits.startswith("0") or digits.startswith("81")):
-            continue             # 国内先頭0 or 国番号81のみ許可
-        score = (len(digits), tok.count("-"))  # 長いdigits＆ハイフン多い＝電話っぽい
-        cands.append((score, tok))
-    if not cands:
-        return ""
-    cands.sort(key=lambda x: x[0], reverse=True)
-    return cands[0][1]
-
-def phone_digits_only(s: str) -> str:
-    """内部照合用に数字だけ抽出（原文表記は保持）"""
-    return re.sub(r"\D", "", str(s or ""))
+PREVIEW_COLUMNS = ["企業名", "業種", "住所", "電話番号"]
+PREVIEW_PAGE_SIZES = [100, 200, 500, 1000]
 
-# ===============================
-# 抽出プロファイル（既存3方式）
-# ===============================
-# 1) Google検索リスト（縦読み・電話上下）
-def extract_google_vertical(lines):
-    results = []
-    rows = [str(l) for l in lines if str(l).strip() != ""]
-    for i, line in enumerate(rows):
-        ph_raw = pick_phone_token_raw(line)
-        if ph_raw:
-            phone = ph_raw  # 原文保持
-            address = rows[i - 1] if i - 1 >= 0 else ""
-            industry = extract_industry(rows[i - 2]) if i - 2 >= 0 else ""
-            company = rows[i - 3] if i - 3 >= 0 else ""
-            results.append([company, industry, clean_address(address), phone])
-    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
-
-# 2) シゴトアルワ（縦積み）
-def extract_shigoto_arua(df_like: pd.DataFrame) -> pd.DataFrame:
-    df = df_like.copy()
-    if df.columns.size > 2:
-        df = df.iloc[:, :2]
-    df.columns = ["col0", "col1"]
-    df = df.fillna("")
-    current = {"企業名": "", "住所": "", "電話番号": "", "業種": ""}
-    out = []
-
-    def flush():
-        if current["企業名"]:
-            out.append([current["企業名"], current["業種"], current["住所"], current["電話番号"]])
-        current.update({"企業名": "", "住所": "", "電話番号": "", "業種": ""})
-
-    for _, row in df.iterrows():
-        k, v = str(row["col0"]), str(row["col1"])
-        if k in ["住所", "所在地", "本社所在地"]:
-            current["住所"] = clean_address(v)
-        elif k in ["電話", "電話番号", "TEL", "Tel", "tel"]:
-            current["電話番号"] = v  # 原文保持
-        elif k in ["業種", "事業内容", "産業分類", "製造業種"]:
-            current["業種"] = extract_industry(v)
-        elif k and not v:
-            if current["企業名"]:
-                flush()
-            current["企業名"] = k
-    if current["企業名"]:
-        flush()
-    return pd.DataFrame(out, columns=["企業名", "業種", "住所", "電話番号"])
-
-# 3) 日本倉庫協会（A=企業名, B=郵便番号＋住所, C=TEL/FAX, D=業種 型）
-def extract_warehouse_association(df_like: pd.DataFrame) -> pd.DataFrame:
+def filter_preview_index(df: pd.DataFrame, query: str) -> pd.Index:
     """
-    ・C列に「TEL」を含む行が1レコード
-      - 同じ行の A列: 企業名の1行目
-      - 同じ行の B列: 郵便番号（〒xxx-xxxx）
-      - 同じ行の D列: 業種
-    ・A列の下に営業所名などが続く場合:
-        A(企業行+1) 以降で「空白 or 会社HP」が出るまでを順に結合して企業名とする
-    ・住所:
-        B(郵便番号行+1) 〜 次の郵便番号行の手前まで、
-        B列の非空セルを上から順に結合して1つの住所にする
+    検索語（空白区切りは AND）を4列のどこかに含む行の index を返す。
+    ブラウザには送らず、サーバー側で絞り込むためのもの。
     """
-    df = df_like.fillna("")
-    # 列数が足りなければ4列まで埋める
-    while df.shape[1] < 4:
-        df[f"__pad{df.shape[1]}"] = ""
-    df = df.iloc[:, :4]
-    df.columns = ["colA", "colB", "colC", "colD"]
-
-    n_rows = len(df)
-
-    # 郵便番号判定用
-    def is_zip(x: str) -> bool:
-        t = normalize_text(x)
-        return bool(re.search(r"^〒?\d{3}-\d{4}", t))
-
-    # B列の郵便番号行インデックス一覧
-    zip_rows = [i for i, v in enumerate(df["colB"]) if is_zip(v)]
-    if not zip_rows:
-        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
-
-    # 次の郵便番号行を探しやすいように末尾に番兵を追加
-    zip_rows_sorted = sorted(zip_rows)
-    zip_rows_sorted.append(n_rows)
-
-    # 郵便番号行ごとの「次の郵便番号行」マップ
-    zip_to_next = {}
-    for idx in range(len(zip_rows_sorted) - 1):
-        zip_to_next[zip_rows_sorted[idx]] = zip_rows_sorted[idx + 1]
-
-    results = []
-
-    for start in zip_rows_sorted[:-1]:
-        end = zip_to_next[start]  # この郵便番号ブロックの終わり（次の郵便番号行）
-
-        # C列に TEL がなければレコードとして扱わない
-        c_text = normalize_text(df.at[start, "colC"])
-        if "TEL" not in c_text.upper():
-            continue
-
-        # --- 電話番号 ---
-        phone = pick_phone_token_raw(c_text)
-
-        # --- 業種（同じ行のD列）---
-        industry = extract_industry(df.at[start, "colD"])
-
-        # --- 企業名（A列）---
-        company_lines = []
-        first_name = normalize_text(df.at[start, "colA"])
-        if first_name:
-            company_lines.append(first_name)
-
-        # A列で、下方向に「空 or 会社HP」が出るまでを結合
-        for r in range(start + 1, end):
-            a_val = normalize_text(df.at[r, "colA"])
-            if not a_val or a_val == "会社HP":
-                break
-            company_lines.append(a_val)
-
-        company = "".join(company_lines)
-
-        # --- 住所（B列）---
-        address_lines = []
-        for r in range(start + 1, end):
-            b_val = normalize_text(df.at[r, "colB"])
-            if not b_val:
-                continue
-            # 郵便番号行は除外（start+1以降なので基本来ないが一応）
-            if is_zip(b_val):
-                break
-            address_lines.append(b_val)
-
-        address = "".join(address_lines)
-
-        # どれも空ならスキップ
-        if not (company or address or phone):
-            continue
-
-        results.append([company, industry, clean_address(address), phone])
-
-    if not results:
-        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
-
-    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
-
-
-# ===============================
-# ★ 新プロファイル用のヘルパー（ヘッダーなし・業種＋住所同セル）
-# ===============================
-JP_LOC_PATTERN = re.compile(r"(丁目|番地?|号|市|区|町|村|郡|県|府|道)")
-
-def is_hours_or_business_line(text: str) -> bool:
-    """営業時間・診療時間系の行かどうか（住所候補からは除外）"""
-    t = normalize_text(text)
-    if not t:
-        return False
-    keywords = [
-        "営業時間", "営業中", "営業時間外", "営業開始",
-        "まもなく営業開始", "診療時間", "診察時間", "24時間営業",
-    ]
-    return any(k in t for k in keywords)
-
-def is_address_like(text: str) -> bool:
-    """住所らしいかどうかのゆるい判定（Google縦型の旧ロジック用）"""
-    t = normalize_text(text)
-    if not t:
-        return False
-
-    # ★ 営業時間系の行は住所扱いしない
-    if is_hours_or_business_line(t):
-        return False
-
-    has_digit = bool(re.search(r"\d", t))
-    has_loc_word = bool(JP_LOC_PATTERN.search(t))
-    has_block = bool(re.search(r"\d{1,3}[-－ー‐]\d{1,3}", t))
-
-    if has_digit and (has_loc_word or has_block):
-        return True
-
-    # 数字がなくても「○○市」「○○町」など住所語だけのケースを弱めに許可
-    if has_loc_word and not has_digit:
-        return True
-
-    return False
-
-def split_industry_address(text: str):
-    """セル内の右端の「·/・/･」で業種と住所に分割"""
-    t = normalize_text(text)
-    if not t:
-        return "", ""
-    # 右から1つ目の区切りを探す
-    last_pos = -1
-    for ch in ["·", "・", "･"]:
-        p = t.rfind(ch)
-        if p > last_pos:
-            last_pos = p
-    if last_pos == -1:
-        # 区切りがなければ全体を住所扱い
-        return "", t.strip()
-    left = t[:last_pos].strip()
-    right = t[last_pos + 1 :].strip()
-    if not right:
-        # 右側が空なら住所扱いに倒す
-        return "", left
-    return left, right
-
-KANJI_KATA_HIRA = r"\u4E00-\u9FFF\u30A0-\u30FF\u3040-\u309F"
-
-def is_company_candidate(text: str) -> bool:
-    """企業名として使えそうかどうか"""
-    s = normalize_text(text)
-    if not s:
-        return False
-
-    # 無視したいキーワード
-    noise_words = [
-        "ウェブサイト", "Web サイト", "web サイト",
-        "オンラインで予約",
-        "ルート・乗換", "経路案内",
-        "共有",
-        "営業中", "営業時間", "営業時間外", "営業開始",
-        "まもなく営業開始", "クチコミはありません",
-        "口コミ", "クチコミ", "レビュー", "件の",
-    ]
-    if any(w in s for w in noise_words):
-        return False
-
-    # レビュー点数形式: 5.0(1) など
-    if re.match(r"^\d+(?:\.\d+)?\s*\(.+\)\s*$", s):
-        return False
-
-    # 数値や記号のみ (-22, 3.5 など) を除外
-    if re.match(r"^[\d\.\-＋\+マイナス\s]+$", s):
-        return False
-
-    # ひらがな・カタカナ・漢字・英字が少なくとも1つ
-    if not re.search(rf"[{KANJI_KATA_HIRA}A-Za-z]", s):
-        return False
-
-    return True
-
-def is_google_meta_line(text: str) -> bool:
-    """Google検索結果に出てくるメタ情報行かどうか（住所・業種候補からは除外）"""
-    t = normalize_text(text)
-    if not t:
-        return True  # 空行はメタ扱いで飛ばす
-
-    meta_keywords = [
-        "ルート・乗換", "経路案内",
-        "ウェブサイト", "Web サイト", "web サイト",
-        "オンラインで予約",
-        "共有",
-        "現在営業中", "営業時間", "営業時間外",
-        "営業開始", "まもなく営業開始", "24時間営業",
-        "クチコミはありません", "口コミ", "クチコミ", "レビュー",
-    ]
-    if any(k in t for k in meta_keywords):
-        return True
-
-    # 数値や記号だけの行（評価点、-22 など）
-    if re.match(r"^[\d\.\-＋\+マイナス\s]+$", t):
-        return True
-
-    return False
-
-def extract_google_free_vertical(df_like: pd.DataFrame) -> pd.DataFrame:
+    tokens = [t for t in normalize_text(query).split(" ") if t]
+    if not tokens:
+        return df.index
+    mask = pd.Series(True, index=df.index)
+    for tok in tokens:
+        hit = pd.Series(False, index=df.index)
+        for c in PREVIEW_COLUMNS:
+            hit |= df[c].str.contains(tok, case=False, regex=False, na=False)
+        mask &= hit
+    return df.index[mask]
+
+def apply_preview_edits(df: pd.DataFrame, edits: dict) -> pd.DataFrame:
+    """差分 {(行index, 列名): 値} を反映したコピーを返す（出力時に全件へ適用）"""
+    out = df.copy()
+    for (idx, col), val in edits.items():
+        if idx in out.index and col in out.columns:
+            out.at[idx, col] = val
+    return out
+
+def record_preview_edits(edits: dict, original: pd.DataFrame, edited: pd.DataFrame) -> None:
     """
-    Google検索結果（縦並び・ヘッダーなし・
-    「業種＋住所」が同じセルに入っているパターン）から
-
-      企業名 / 業種 / 住所 / 電話番号
-
-    を抽出する。
-    企業名は「電話から3〜4行上」のルールを優先しつつ、
-    その間の行から業種＋住所のセルを拾う。
+    表示中ページの編集結果を元データと比べ、変わったセルだけを edits に記録する。
+    元の値に戻されたセルは差分から外す。
     """
-    df0 = df_like.fillna("")
-    col = df0.iloc[:, 0].astype(str).tolist()
-    results = []
-
-    for i, line in enumerate(col):
-        ph_raw = pick_phone_token_raw(line)
-        if not ph_raw:
-            continue
-        phone = ph_raw
-
-        # --------------------------
-        # 1) 企業名の行を決める
-        # --------------------------
-        company_idx = None
-
-        # まず Jin さんルールで候補を決める
-        txt_m2 = normalize_text(col[i - 2]) if i - 2 >= 0 else ""
-        if i - 3 >= 0 and "クチコミはありません" in txt_m2:
-            # 電話の2行上に「クチコミはありません」→ 3行上が企業名候補
-            company_idx = i - 3
-        elif i - 4 >= 0:
-            # それ以外は基本4行上
-            company_idx = i - 4
-
-        # 候補が会社名として微妙なら、上方向にスキャンして会社名らしい行を探す
-        if company_idx is not None:
-            if not is_company_candidate(col[company_idx]):
-                company_idx = None
-
-        if company_idx is None:
-            for k in range(i - 1, -1, -1):
-                if is_company_candidate(col[k]):
-                    company_idx = k
-                    break
-
-        if company_idx is None:
-            # 企業名がどうしても見つからない場合はこの電話はスキップ
-            continue
-
-        company = normalize_text(col[company_idx])
-
-        # --------------------------
-        # 2) 業種＋住所セルを探す
-        # --------------------------
-        indaddr_idx = None
-        # 電話の1行上から企業名の1行下までを逆順に見て、
-        # メタ行を飛ばしながら最初に見つかった行を採用
-        for j in range(i - 1, company_idx, -1):
-            txt = normalize_text(col[j])
-            if not txt:
-                continue
-            if is_google_meta_line(txt):
-                continue
-            indaddr_idx = j
-            break
-
-        # どうしても見つからない場合の保険として、
-        # 電話の1行上から上方向にメタ以外の行を探す
-        if indaddr_idx is None:
-            for j in range(i - 1, -1, -1):
-                txt = normalize_text(col[j])
-                if not txt:
-                    continue
-                if is_google_meta_line(txt):
-                    continue
-                indaddr_idx = j
-                break
-
-        industry = ""
-        address = ""
-
-        if indaddr_idx is not None:
-            ind_raw, addr_raw = split_industry_address(col[indaddr_idx])
-
-            if addr_raw:
-                # 「業種・住所」のように分割できたケース
-                industry = extract_industry(ind_raw)
-                address = clean_address(addr_raw)
+    for idx in edited.index:
+        for col in PREVIEW_COLUMNS:
+            val = edited.at[idx, col]
+            val = "" if val is None or (isinstance(val, float) and pd.isna(val)) else str(val)
+            if val != original.at[idx, col]:
+                edits[(idx, col)] = val
             else:
-                # 区切り記号が無い → 全体を住所扱い
-                address = clean_address(col[indaddr_idx])
-
-        # --------------------------
-        # 3) 結果として追加
-        # --------------------------
-        results.append([company, industry, address, phone])
-
-    if not results:
-        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
-
-    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
-
+                edits.pop((idx, col), None)
 
 # ===============================
-# KEN_ALL 読み込み＆市区町村辞書（キャッシュ付き）
+# バックグラウンド実行（サーバー全体で1つのワーカープール）
 # ===============================
-@st.cache_data
-def load_ken_all_local():
+JOB_STAGE_LABELS = {
+    "": "順番待ち",
+    "read": "読み込み",
+    "load": "保存済みの行を読み込み",
+    "extract": "抽出",
+    "clean": "正規化",
+    "city_filter": "市区町村フィルタ",
+    "keys": "照合キー作成",
+    "store": "結果ストアへ保存",
+    "industry_filter": "業種フィルタ",
+    "ng_match": "NG照合",
+    "ng_fuzzy": "NGあいまい照合",
+    "dedup": "重複除去",
+    "dedup_company": "重複除去（企業名＋住所）",
+    "chunk": "分割処理",
+    "write": "書き出し",
+    "template_write": "テンプレート書き込み",
+}
+
+@st.cache_resource
+def get_job_manager():
     """
-    プロジェクト直下の KEN_ALL.xlsx / KEN_ALL.csv を読み込む。
-    G列=都道府県, H列=市区町村, I列=町域名 という前提。
-    読み込みと正規化はセッション中に1回だけ。
+    全セッション共有のワーカープール。
+    GCHANGE_MAX_WORKERS（全体の同時実行数）と
+    GCHANGE_MAX_JOBS_PER_SESSION（1セッションの同時実行数）で上限を調整できる。
     """
-    base = Path(__file__).resolve().parent
-    for fname in ["KEN_ALL.xlsx", "KEN_ALL.XLSX", "KEN_ALL.csv", "KEN_ALL.CSV"]:
-        path = base / fname
-        if path.exists():
-            try:
-                if fname.lower().endswith("xlsx"):
-                    df = pd.read_excel(path, engine="openpyxl").fillna("")
-                else:
-                    df = pd.read_csv(path, header=None, encoding="cp932").fillna("")
-                # ここで一度だけ正規化して保持しておく
-                df["__pref_norm"] = df.iloc[:, 6].map(normalize_text)
-                df["__city_norm"] = df.iloc[:, 7].map(normalize_text)
-                df["__town_norm"] = df.iloc[:, 8].map(normalize_text)
-                return df
-            except Exception as e:
-                st.warning(f"KEN_ALL 読み込みでエラーが発生しました: {e}")
-                return None
-    return None
-
+    return JobManager(
+        max_workers=int(os.environ.get("GCHANGE_MAX_WORKERS", "4")),
+        per_owner_limit=int(os.environ.get("GCHANGE_MAX_JOBS_PER_SESSION", "2")),
+    )
 
-@st.cache_data
-def build_city_town_dict():
+@st.cache_resource
+def get_result_store():
     """
-    (都道府県, 市区町村) -> 町域セット への辞書を作る。
-    これもセッション中に1回だけ。
+    処理済みの行を保存する SQLite（GCHANGE_STORE_PATH=1 でアプリ直下、パスを書けばその場所）。
+    GCHANGE_STORE_PATH を設定しなければ保存しない（None）。
     """
-    ken_df = load_ken_all_local()
-    if ken_df is None:
-        return {}
+    return open_result_store()
 
-    city_town = {}
-    for pref, city, town in zip(
-        ken_df["__pref_norm"],
-        ken_df["__city_norm"],
-        ken_df["__town_norm"],
-    ):
-        if not pref or not city or not town:
-            continue
-        if "以下に掲載がない場合" in town:
-            continue
-        key = (pref, city)
-        if key not in city_town:
-            city_town[key] = set()
-        city_town[key].add(town)
-
-    # キャッシュに載せやすいようにフリーズしておく
-    return {k: frozenset(v) for k, v in city_town.items()}
-
-def address_matches_city_towns(address: str, town_tokens: set) -> bool:
+def upload_sheet_names(uploaded_file) -> list:
     """
-    住所が、指定市区町村の町域セットにマッチするかどうか。
-    ・町名(I列)のどれかが住所に含まれていれば True
-    それ以外は False（＝別地域とみなして除外）
+    アップロードされた xlsx のシート名（複数シートから選ぶ用）。
+    ファイルが変わるまでは session_state に覚えておき、再実行のたびにブックを開かない。
+    読めないファイルは空リスト（エラーは整形処理のジョブ側で表示する）。
     """
-    t = normalize_text(address)
-    if not t:
-        return False
-
-    for token in town_tokens:
-        if token and token in t:
-            return True
-
-    return False
-
-
-# ===============================
-# 業種のフィルター/ハイライト
-# ===============================
-remove_exact = [
-    "オフィス機器レンタル業", "足場レンタル会社", "電気工", "廃棄物リサイクル業",
-    "プロパン販売業者", "看板専門店", "給水設備工場", "警備業", "建設会社",
-    "工務店", "写真店", "人材派遣業", "整備店", "倉庫", "肉店", "米販売店",
-    "スーパーマーケット", "ロジスティクスサービス", "建材店",
-    "自動車整備工場", "自動車販売店", "車体整備店", "協会/組織", "建設請負業者", "電器店", "家電量販店", "建築会社", "ハウス クリーニング業", "焼肉店",
-    "建築設計事務所", "左官", "作業服店", "空調設備工事業者", "金属スクラップ業者", "害獣駆除サービス", "モーター修理店", "アーチェリーショップ", "アスベスト検査業", "事務用品店",
-    "測量士", "配管業者", "労働組合", "ガス会社", "ガソリンスタンド", "ガラス/ミラー店", "ワイナリー", "屋根ふき業者", "高等学校", "金物店", "史跡", "商工会議所", "清掃業", "清掃業者", "配管工", "お手頃"
-]
-remove_partial = ["販売店", "販売業者"]
-
-highlight_partial = [
-    "運輸", "ロジスティクスサービス", "倉庫", "輸送サービス",
-    "運送会社企業のオフィス", "運送会社"
-]
-
-# ===============================
-# 業種ノイズ除去（レビュー/評価など）
-# ===============================
-def clean_industry_noise(s: str) -> str:
-    if not s:
-        return ""
-    t = str(s)
-    t = re.sub(r"\s+", " ", t).strip()
-
-    # 先頭の評価スコア + 件数
-    t = re.sub(r"^\s*\d+(?:\.\d+)?\s*[\(（]\s*\d+\s*[\)）]\s*(?:件)?\s*[・･]?\s*", "", t)
-
-    # --- レビュー / クチコミ 処理 ---
-    def norm_token(x: str) -> str:
-        return re.sub(r"\s+", "", x)
-
-    noise_basic = {"レビュー", "レビューなし", "レビュー無し", "クチコミ", "口コミ"}
-    noise_nashi = {"なし"}
-
-    if t.startswith("レビュー"):
-        parts = [p.strip() for p in re.split(r"[・･]", t) if p.strip()]
-        if not parts:
-            return ""
-        if all(norm_token(p) in noise_basic | noise_nashi for p in parts):
-            return ""
-        cleaned_parts = []
-        for p in parts:
-            pn = norm_token(p)
-            if pn in noise_basic or pn in noise_nashi:
-                continue
-            cleaned_parts.append(p)
-        t = "・".join(cleaned_parts)
-    else:
-        t = re.sub(r"(?:^|[・･])\s*(Google\s*の?\s*クチコミ|口コミ|クチコミ)\s*(?=[・･]|$)", "", t)
-        t = re.sub(r"[・･]?\s*\d+\s*件の?(レビュー|口コミ|クチコミ)\s*(?=[・･]|$)", "", t)
-
-    parts = [p.strip() for p in re.split(r"[・･]", t) if p.strip()]
-    t = "・".join(parts) if parts else ""
-    t = re.sub(r"[・･]{2,}", "・", t).strip(" ・･")
-
-    # --- 🎯 追加：末尾の特殊文字（絵文字・UI記号等）削除 ---
-    # 例： /  / ↗ / ★ など
-    t = re.sub(r"[^\w一-龥ぁ-んァ-ヶ・\s\-、,。/()（）]+$", "", t)
-
-    return t if t else ""
-
-# ===============================
-# 共通整形（電話は触らない）
-# ===============================
-def clean_dataframe_except_phone(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    for c in ["企業名", "業種", "住所"]:
-        df[c] = df[c].map(normalize_text)
-    df["業種"] = df["業種"].map(clean_industry_noise)
-    return df.fillna("")
+    cache = st.session_state.setdefault("upload_sheet_names", {})
+    key = (getattr(uploaded_file, "file_id", uploaded_file.name), uploaded_file.name, uploaded_file.size)
+    if key not in cache:
+        try:
+            cache[key] = list_upload_sheets(uploaded_file.getvalue(), uploaded_file.name)
+        except Exception:
+            cache[key] = []
+    return cache[key]
+
+def wait_for_job(job, label: str):
+    """
+    ジョブが終わるまで進捗バーを更新し続ける。
+    待っている間に入力が変わると Streamlit がこの再実行ごと打ち切り、
+    次の再実行で古いジョブがキャンセルされる。
+    """
+    if job.done:
+        return
+    bar = st.progress(0.0, text=f"{label}：{JOB_STAGE_LABELS['']}…")
+    while not job.wait(0.25):
+        stage = JOB_STAGE_LABELS.get(job.stage, job.stage) if job.status == "running" else JOB_STAGE_LABELS[""]
+        bar.progress(min(job.progress, 1.0), text=f"{label}：{stage}…")
+    bar.empty()
 
 # ===============================
 # UI（NGリスト選択・抽出方式・業種カテゴリ・市区町村フィルタ・テンプレート入力）
 # ===============================
 st.markdown("### 🛡️ 使用するNGリストを選択")
-nglist_files = [f for f in os.listdir() if f.endswith(".xlsx") and "NGリスト" in f]
-nglist_options = ["なし"] + [os.path.splitext(f)[0] for f in nglist_files]
+# API・prewarm と同じく APP_DIR から探し、名前は NFC にそろえる（起動したフォルダに左右されない）
+nglist_options = ["なし"] + [nglist_name(p) for p in find_nglists(APP_DIR)]
 selected_nglist = st.selectbox(
     "NGリスト",
     nglist_options,
     index=0,
-    help="同じフォルダにある『NGリスト〜.xlsx』を検出します。1列目=企業名、2列目=電話番号（任意）。"
+    help="同じフォルダにある『NGリスト〜.xlsx』を検出します。1列目=企業名、電話番号（任意）は見出しに「電話」を含む列（無ければ2列目）。"
+)
+use_ng_fuzzy = st.checkbox(
+    "NG企業名のあいまい照合も行う（誤字・表記ゆれ・支店名付きの企業名を検出）",
+    value=False,
+    help="部分一致で除外されなかった企業名を、NGリストの企業名と文字2-gramで照合し、類似度がしきい値以上なら除外します。"
+         "類似度は削除ログの score 列に残ります。カナ表記と漢字表記（例：トヨタボウショク／トヨタ紡織）は対象外です。",
+)
+ng_fuzzy_threshold = None
+if use_ng_fuzzy:
+    ng_fuzzy_threshold = st.slider("あいまい照合のしきい値（高いほど厳しい）", 0.70, 0.95, 0.80, 0.01)
+dedup_company_address = st.checkbox(
+    "企業名＋住所が似ている行も重複として除去する",
+    value=False,
+    help="電話番号が違う（または無い）同じ企業の重複を除去します。企業名の先頭と都道府県・市区町村が同じ行どうしだけを比べます。",
 )
 
 st.markdown("### 🧭 抽出方法を選択")
 profile = st.selectbox(
     "抽出プロファイル",
-    [
-        "Google検索リスト（縦読み・電話上下型）",
-        "Google検索リスト（ヘッダーなし・業種＋住所同セル）",
-        "シゴトアルワ検索リスト（縦積み）",
-        "日本倉庫協会リスト（4列型）",
-    ]
+    [PROFILE_AUTO] + PROFILES,
+    help="自動判定では、ファイルごとに先頭300行の並び（電話行の間隔・「業種 · 住所」セル・住所/電話番号の見出し・〒とTEL）から方式を選びます。",
 )
 
 st.markdown("### 🏭 業種カテゴリを選択")
@@ -681,11 +302,9 @@ target_pref = ""
 target_city = ""
 town_tokens = set()
 
-# 辞書を一度だけ構築（キャッシュされる）
-city_town_dict = build_city_town_dict()
-
-if not city_town_dict:
-    st.info("KEN_ALL.xlsx / KEN_ALL.CSV がプロジェクト直下に見つからないか、読込に失敗したため、市区町村フィルタは現在使用できません。")
+# 辞書は市区町村を指定したときに初めて作る（ここでは KEN_ALL があるかどうかだけ見る）
+if find_ken_all(APP_DIR) is None:
+    st.info("KEN_ALL.xlsx / KEN_ALL.CSV がプロジェクト直下に見つからないため、市区町村フィルタは現在使用できません。")
 else:
     use_city_filter = st.checkbox(
         "市区町村フィルタを使う（KEN_ALL を参照して、別地域の住所を除外）",
@@ -697,9 +316,12 @@ else:
         target_city = st.text_input("市区町村名（例：水戸市）").strip()
 
         if target_pref and target_city:
+            city_town_dict = load_city_town_dict()
             key = (normalize_text(target_pref), normalize_text(target_city))
             town_tokens = set(city_town_dict.get(key, []))
-            if not town_tokens:
+            if not city_town_dict:
+                use_city_filter = False
+            elif not town_tokens:
                 st.warning(f"KEN_ALL から『{target_pref} {target_city}』に該当する町域が見つかりませんでした。市区町村フィルタは一旦無効として処理します。")
                 use_city_filter = False
             else:
@@ -727,8 +349,7 @@ if template_source == "ここで template.xlsx をアップロードして使う
         template_bytes = template_upload.read()
 else:
     # プロジェクト直下から template.xlsx を読む
-    app_dir = Path(__file__).resolve().parent
-    template_path = app_dir / "template.xlsx"
+    template_path = APP_DIR / TEMPLATE_FILENAME
     if not template_path.exists():
         st.error(
             f"❌ template.xlsx が見つかりませんでした（期待パス: {template_path}）。"
@@ -736,19 +357,39 @@ else:
             "ファイルをプロジェクト直下に配置してください。"
         )
         st.stop()
-    # バイナリで読み込んで、bytes を保持する
-    with open(template_path, "rb") as f:
-        template_bytes = f.read()
+    # バイナリで読み込んで、bytes を保持する（更新されるまではプロセス内キャッシュを使う）
+    template_bytes = cached_template_bytes(template_path)
 
 # どちらのパターンでも template_bytes が None ならエラー
 if template_bytes is None:
     st.error("❌ template.xlsx を読み込めませんでした。設定を確認してください。")
     st.stop()
 
+track_memory = st.checkbox(
+    "⏱ ステージ計測でピークメモリも記録する（tracemalloc 使用・テンプレ書き込みが数倍遅くなります）",
+    value=False,
+    help="ピークはプロセス全体の値です。別のファイルの処理と重なったステージは memory_shared=True になり、他の処理分を含みます。",
+)
+
+chunked_mode = st.checkbox(
+    "🧱 大きなファイルを分割して処理する（100万行級向け・メモリ節約）",
+    value=False,
+    help=f"{CHUNK_ROWS:,}行ずつ 読み込み〜NG照合〜電話番号の重複除去 を行い、結果を『整形済み』『削除ログ』シートの xlsx に直接書き出します。"
+         "プレビュー編集・template.xlsx への書き込み・企業名＋住所の重複除去・結果ストアへの保存は行いません。",
+)
+
+FAST_EXPORT_OPTIONS = {"しない": None, "CSV": "csv", "Parquet": "parquet"}
+fast_export_format = FAST_EXPORT_OPTIONS[st.radio(
+    "⚡ template.xlsx とは別に、整形済みデータと削除ログを高速出力する",
+    list(FAST_EXPORT_OPTIONS),
+    horizontal=True,
+    help="下流システム連携用。電話キー・電話種別・都道府県・市区町村の列も付けて出力します。Parquet は pyarrow が必要です。",
+)]
+
 # ★ 複数ファイル対応：accept_multiple_files=True（ここは従来どおり）
 uploaded_files = st.file_uploader(
-    "📤 整形対象のExcelファイルをアップロード（複数選択可）",
-    type=["xlsx"],
+    "📤 整形対象のファイルをアップロード（xlsx / csv / tsv / parquet・複数選択可）",
+    type=INPUT_EXTENSIONS,
     accept_multiple_files=True
 )
 
@@ -757,157 +398,196 @@ uploaded_files = st.file_uploader(
 # ===============================
 ng_names = []
 ng_phones = set()
-if uploaded_files and selected_nglist != "なし":
-    ng_path = f"{selected_nglist}.xlsx"
-    if not os.path.exists(ng_path):
-        st.error(f"❌ 選択されたNGリストが見つかりません：{ng_path}")
+ng_index = None
+if selected_nglist != "なし":
+    ng_path = find_nglist(APP_DIR, selected_nglist)
+    if ng_path is None:
+        st.error(f"❌ 選択されたNGリストが見つかりません：{selected_nglist}.xlsx")
         st.stop()
-    ng_df = pd.read_excel(ng_path, engine="openpyxl").fillna("")
-    if ng_df.shape[1] < 1:
-        st.error("❌ NGリストは少なくとも1列（企業名）が必要です。2列目に電話番号があれば照合に利用します。")
+    try:
+        ng_names, ng_phones, ng_index = cached_ng_data(ng_path)
+    except ValueError as e:
+        st.error(f"❌ {e}")
         st.stop()
-    ng_df["__ng_company_canon"] = ng_df.iloc[:, 0].map(canonical_company_name)
-    if ng_df.shape[1] >= 2:
-        ng_df["__ng_digits"] = ng_df.iloc[:, 1].astype(str).map(phone_digits_only)
-    else:
-        ng_df["__ng_digits"] = ""
-    ng_names = [n for n in ng_df["__ng_company_canon"].tolist() if n]
-    ng_phones = set([d for d in ng_df["__ng_digits"].tolist() if d])
 
 # ===============================
 # メイン処理（★ファイルごとに独立して処理）
 # ===============================
+# 処理本体はバックグラウンドのワーカーで実行し、画面は進捗を表示するだけにする。
+# 入力（ファイル・オプション）が変わったら古いジョブはキャンセルして作り直し、
+# 変わっていなければ前回の結果をそのまま使う（プレビュー編集のたびに再処理しない）。
+job_manager = get_job_manager()
+job_owner = st.session_state.setdefault("job_owner", uuid.uuid4().hex)
+result_store = get_result_store()
+city_tokens = frozenset(town_tokens) if use_city_filter and town_tokens else frozenset()
+
 if uploaded_files:
+
+    # 1) 全ファイルのジョブを先に投入しておく（ファイル間はワーカー上で並行して進む）
+    pipeline_jobs = []
     for file_index, uploaded_file in enumerate(uploaded_files):
+        # シートが複数ある xlsx は、抽出するシートを選べるようにする（既定はすべて）
+        sheet_names = upload_sheet_names(uploaded_file)
+        selected_sheets = None
+        if len(sheet_names) > 1:
+            selected_sheets = st.multiselect(
+                f"📑 {uploaded_file.name} から抽出するシート（未選択ならすべて）",
+                sheet_names,
+                default=sheet_names,
+                key=f"sheets_{file_index}_{uploaded_file.name}",
+                help="選んだシートはワーカーで並行して抽出し、1つのリストにまとめてから NG照合・重複除去を行います。"
+                     "どのシートから取った行かは『シート』列に残ります（高速出力・分割処理の出力）。",
+            )
+        job_sig = (
+            getattr(uploaded_file, "file_id", uploaded_file.name),
+            uploaded_file.name,
+            uploaded_file.size,
+            tuple(selected_sheets or ()),
+            profile,
+            industry_option,
+            selected_nglist,
+            ng_fuzzy_threshold,
+            dedup_company_address,
+            hash(city_tokens),
+            track_memory,
+            chunked_mode,
+        )
+        job_key = f"pipeline_job_{file_index}"
+        entry = st.session_state.get(job_key)
+        if entry is None or entry["sig"] != job_sig or entry["job"].status == "cancelled":
+            if entry is not None:
+                entry["job"].cancel()
+            pipeline_kwargs = dict(
+                profile=profile,
+                industry_option=industry_option,
+                town_tokens=city_tokens,
+                ng_names=ng_names,
+                ng_phones=ng_phones,
+                ng_index=ng_index,
+                ng_fuzzy_threshold=ng_fuzzy_threshold,
+                file_name=uploaded_file.name,
+                sheets=selected_sheets,
+                track_memory=track_memory,
+            )
+            if chunked_mode:
+                job = job_manager.submit(job_owner, run_pipeline_chunked, uploaded_file.getvalue(), **pipeline_kwargs)
+            else:
+                job = job_manager.submit(
+                    job_owner,
+                    run_pipeline,
+                    uploaded_file.getvalue(),
+                    dedup_company_address=dedup_company_address,
+                    store=result_store,
+                    **pipeline_kwargs,
+                )
+            entry = {"sig": job_sig, "job": job}
+            st.session_state[job_key] = entry
+        pipeline_jobs.append(entry["job"])
+
+    # アップロードが減った分の古いジョブは止める
+    stale_index = len(uploaded_files)
+    while f"pipeline_job_{stale_index}" in st.session_state:
+        st.session_state.pop(f"pipeline_job_{stale_index}")["job"].cancel()
+        template_entry = st.session_state.pop(f"template_job_{stale_index}", None)
+        if template_entry is not None:
+            template_entry["job"].cancel()
+        stale_index += 1
+
+    # 2) ファイルごとに、終わるのを待って結果を表示
+    all_file_metrics = []
+    for file_index, (uploaded_file, job) in enumerate(zip(uploaded_files, pipeline_jobs)):
         st.markdown("---")
         st.markdown(f"## 📁 {uploaded_file.name}")
 
         filename_no_ext = os.path.splitext(uploaded_file.name)[0]
-        xl = pd.ExcelFile(uploaded_file, engine="openpyxl")
-
-        # --- 抽出 ---
-        if "入力マスター" in xl.sheet_names:
-            # template互換: 入力マスターから読み取り（電話は原文のまま）
-            df_raw = pd.read_excel(
-                xl,
-                sheet_name="入力マスター",
-                header=None,
-                engine="openpyxl"
-            ).fillna("")
-            df = pd.DataFrame({
-                "企業名": df_raw.iloc[1:, 1].astype(str),
-                "業種": df_raw.iloc[1:, 2].astype(str),
-                "住所": df_raw.iloc[1:, 3].astype(str),
-                "電話番号": df_raw.iloc[1:, 4].astype(str),
-            })
-        else:
-            df0 = pd.read_excel(uploaded_file, header=None, engine="openpyxl").fillna("")
-            if profile == "Google検索リスト（縦読み・電話上下型）":
-                lines = df0.iloc[:, 0].tolist()
-                df = extract_google_vertical(lines)
-            elif profile == "Google検索リスト（ヘッダーなし・業種＋住所同セル）":
-                df = extract_google_free_vertical(df0)
-            elif profile == "シゴトアルワ検索リスト（縦積み）":
-                df = extract_shigoto_arua(df0)
-            else:
-                df = extract_warehouse_association(df0)
-
-        # --- 非電話列のみ正規化 ---
-        df = clean_dataframe_except_phone(df)
-
-        # ★ 市区町村フィルタ（KEN_ALL の G/H/I を使用）
-        removed_by_city_filter = 0
-        if use_city_filter and town_tokens:
-            before_city = len(df)
-            df = df[df["住所"].apply(
-                lambda x: address_matches_city_towns(x, town_tokens)
-            )]
-            removed_by_city_filter = before_city - len(df)
-            st.info(f"🏙 市区町村フィルタ適用（{target_pref}{target_city}）：{removed_by_city_filter} 件を除外しました。")
 
-        # --- 比較キー ---
-        df["__company_canon"] = df["企業名"].map(canonical_company_name)
-        df["__digits"] = df["電話番号"].map(phone_digits_only)
-
-        # --- 業種フィルター（製造業のみ除外ルール適用） ---
-        removed_by_industry = 0
-        if industry_option == "製造業":
-            before = len(df)
-            all_ng_words = remove_exact + remove_partial
-            if all_ng_words:
-                pat = "|".join(map(re.escape, all_ng_words))
-                df = df[~df["業種"].str.contains(pat, na=False)]
-            removed_by_industry = before - len(df)
-
-        # --- 有限会社は全業種で除外 ---
-        yugen_pattern = r"(有限会社|\(有\)|（有）)"
-        before_yugen = len(df)
-        df = df[~df["企業名"].str.contains(yugen_pattern, na=False)]
-        removed_by_industry += before_yugen - len(df)
+        wait_for_job(job, "整形処理")
+        if job.status != "done":
+            if job.status == "failed":
+                st.error(f"❌ 処理に失敗しました：{job.error}")
+            else:
+                st.warning("⏹ 処理はキャンセルされました。")
+            continue
 
+        res = job.result
+        df = res["df"]
+        removal_logs = res["removal_logs"]
+        removed_by_city_filter = res["removed_by_city_filter"]
+        removed_by_industry = res["removed_by_industry"]
+
+        if len(res["sheets"]) > 1:
+            st.info(f"📑 {len(res['sheets'])}シートから抽出：{' / '.join(res['sheets'])}")
+        if profile == PROFILE_AUTO:
+            st.info(f"🧭 抽出プロファイル（自動判定）：{res['profile']}")
+        if city_tokens:
+            st.info(f"🏙 市区町村フィルタ適用（{target_pref}{target_city}）：{removed_by_city_filter} 件を除外しました。")
         st.warning(f"🏭 フィルター適用：有限会社・業種フィルタなどで {removed_by_industry}件を除外しました")
 
-        # --- NG照合（任意） ---
-        removal_logs = []
-        company_removed = 0
-        phone_removed = 0
-        dup_removed = 0
-
-        if ng_names or ng_phones:
-            # 企業名（部分一致・相互包含）
-            before = len(df)
-            hit_idx = []
-            for idx, row in df.iterrows():
-                c = row["__company_canon"]
-                if not c:
-                    continue
-                if any((n in c or c in n) for n in ng_names):
-                    removal_logs.append({
-                        "reason": "ng-company",
-                        "company": row["企業名"],
-                        "phone_raw": row["電話番号"],
-                        "match": c
-                    })
-                    hit_idx.append(idx)
-            if hit_idx:
-                df = df.drop(index=hit_idx)
-            company_removed = before - len(df)
-
-            # 電話番号digits一致
-            before = len(df)
-            mask = df["__digits"].isin(ng_phones)
-            if mask.any():
-                for idx, row in df[mask].iterrows():
-                    removal_logs.append({
-                        "reason": "ng-phone",
-                        "company": row["企業名"],
-                        "phone_raw": row["電話番号"],
-                        "match": row["__digits"]
-                    })
-                df = df[~mask]
-            phone_removed = before - len(df)
-
-        # --- 重複（電話digits）除去（※このファイル内だけ） ---
-        before = len(df)
-        dup_mask = df["__digits"].ne("").astype(bool) & df["__digits"].duplicated(keep="first")
-        if dup_mask.any():
-            for idx, row in df[dup_mask].iterrows():
-                removal_logs.append({
-                    "reason": "dup-phone",
-                    "company": row["企業名"],
-                    "phone_raw": row["電話番号"],
-                    "match": row["__digits"]
-                })
-            df = df[~dup_mask]
-        dup_removed = before - len(df)
-
-        # --- 空行の除去 ---
-        df = df[~((df["企業名"] == "") & (df["業種"] == "") & (df["住所"] == "") & (df["電話番号"] == ""))].reset_index(drop=True)
+        # --- 分割処理: 結果はもう xlsx に書き出してあるので、プレビューとテンプレ書き込みは飛ばす ---
+        if df is None:
+            stale_template = st.session_state.pop(f"template_job_{file_index}", None)
+            if stale_template is not None:
+                stale_template["job"].cancel()
+            st.success(f"✅ 整形完了：{res['rows']}件の企業データを取得しました（{CHUNK_ROWS:,}行ずつ分割処理・{res['chunks']}チャンク）。")
+            with st.expander(f"📊 実行サマリー（詳細） - {uploaded_file.name}", expanded=False):
+                st.markdown(summary_markdown(res))
+                st.dataframe(res["metrics"].to_frame(), use_container_width=True, hide_index=True)
+            st.download_button(
+                label=f"📥 整形済みリストをダウンロード（{filename_no_ext} / 整形済み＋削除ログ）",
+                data=res["output"].getvalue(),
+                file_name=f"{filename_no_ext}_整形済み.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key=f"download_btn_{file_index}",
+            )
+            all_file_metrics.append(res["metrics"].to_dict())
+            continue
 
         # --- 画面表示（編集可・確定ボタンなし） ---
+        # 全件をブラウザへ送らず、検索・ページ分割したページだけを data_editor に渡す。
+        # 編集は「セル単位の差分」として session_state に保持し、出力時に全件へ適用する。
         st.success(f"✅ 整形完了：{len(df)}件の企業データを取得しました。")
-        edited = st.data_editor(
-            df[["企業名", "業種", "住所", "電話番号"]],
+        df_base = df[PREVIEW_COLUMNS]
+
+        # 入力や設定が変わって元データが変わったら差分は破棄する
+        # （rev は data_editor のキーに入れる番号。変えると編集中の状態を持たない新しいエディタになる）
+        preview_sig = (
+            uploaded_file.name,
+            len(df_base),
+            int(pd.util.hash_pandas_object(df_base, index=False).sum()),
+        )
+        edits_key = f"preview_edits_{file_index}"
+        edits_state = st.session_state.get(edits_key)
+        if edits_state is None or edits_state["sig"] != preview_sig:
+            edits_state = {"sig": preview_sig, "edits": {}, "rev": 0}
+            st.session_state[edits_key] = edits_state
+        preview_edits = edits_state["edits"]
+
+        df_current = apply_preview_edits(df_base, preview_edits)
+
+        col_q, col_size, col_page = st.columns([3, 1, 1])
+        query = col_q.text_input(
+            "🔎 プレビュー内検索（企業名・業種・住所・電話番号、空白区切りでAND）",
+            key=f"preview_query_{file_index}",
+        )
+        page_size = col_size.selectbox(
+            "1ページの件数", PREVIEW_PAGE_SIZES, index=1, key=f"preview_size_{file_index}"
+        )
+        hit_index = filter_preview_index(df_current, query)
+        n_pages = max(1, -(-len(hit_index) // page_size))
+        page_key = f"preview_page_{file_index}"
+        if st.session_state.get(page_key, 1) > n_pages:
+            st.session_state[page_key] = n_pages
+        page = col_page.number_input("ページ", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+        start = (int(page) - 1) * page_size
+        page_index = hit_index[start:start + page_size]
+        st.caption(
+            f"{len(hit_index)}件中 {min(start + 1, len(hit_index))}〜{start + len(page_index)}件目を表示"
+            f"（全{len(df_base)}件 / {n_pages}ページ / 編集済み {len(preview_edits)}セル）"
+        )
+
+        edited_page = st.data_editor(
+            df_current.loc[page_index],
             use_container_width=True,
             num_rows="fixed",
             column_config={
@@ -918,23 +598,26 @@ if uploaded_files:
                     help="原文の配列を保持。必要ならここで手動修正してください。編集内容はそのまま出力に反映されます。"
                 ),
             },
-            key=f"editable_preview_{file_index}",
+            # data_editor は編集を「何行目か」で覚えているので、元データ（preview_sig）が変わったときや
+            # 表示する行が入れ替わったときに同じキーのままだと、前の編集が別の企業の行に当たってしまう
+            key=f"editable_preview_{file_index}_{hash(preview_sig)}_{edits_state['rev']}_{page}_{query}",
         )
+        record_preview_edits(preview_edits, df_base, edited_page)
+        if query and not filter_preview_index(apply_preview_edits(df_base, preview_edits), query).equals(hit_index):
+            # 編集で検索に当たる行が変わった（行が消えた・増えた）→ 新しいエディタで表示し直す
+            edits_state["rev"] += 1
+            st.rerun()
 
-        # 確定ボタンは廃止。edited をそのまま出力用に使う
-        df_export = edited.copy()
+        # 確定ボタンは廃止。差分を全件に適用したものをそのまま出力用に使う
+        df_export = apply_preview_edits(df_base, preview_edits)
 
         # --- サマリー＆削除ログDL ---
-        with st.expander(f"📊 実行サマリー（詳細） - {uploaded_file.name}", expanded=False):
-            st.markdown(
-                f"- 市区町村フィルタ除外: **{removed_by_city_filter}** 件\n"
-                f"- フィルター除外（製造業/有限会社など）: **{removed_by_industry}** 件\n"
-                f"- NG（企業名 部分一致）削除: **{company_removed}** 件\n"
-                f"- NG（電話 digits一致）削除: **{phone_removed}** 件\n"
-                f"- 重複（電話 digits一致）削除: **{dup_removed}** 件\n"
-            )
+        # ステージ計測はテンプレ書き込み後に同じエキスパンダーへ追記する
+        summary_box = st.expander(f"📊 実行サマリー（詳細） - {uploaded_file.name}", expanded=False)
+        with summary_box:
+            st.markdown(summary_markdown(res))
             if removal_logs:
-                log_df = pd.DataFrame(removal_logs)
+                log_df = removal_log_frame(removal_logs)
                 st.dataframe(log_df.head(300), use_container_width=True)
                 csv_bytes = log_df.to_csv(index=False).encode("utf-8-sig")
                 st.download_button(
@@ -945,83 +628,244 @@ if uploaded_files:
                     key=f"removal_log_btn_{file_index}",
                 )
 
-        # ===============================
-        # template.xlsx へ書き込み（高速版）
-        # ===============================
-
-        # ループのたびに「テンプレのバイト」から新しい Workbook を作る
-        wb = load_workbook(io.BytesIO(template_bytes))
-
-        if "入力マスター" not in wb.sheetnames:
-            st.error("❌ template.xlsx に『入力マスター』というシートが存在しません。")
-            st.stop()
-
-        sheet_master = wb["入力マスター"]
-
-        # ※ここでは「既存データを全クリアする処理」は不要
-        #   毎回、まっさらな template.xlsx から作り直している前提。
-        #   もしテンプレにサンプル行が入っている場合は、
-        #   そのサンプルを消した「空テンプレ」を1つ作っておくとさらに速くなります。
-
-        # 物流ハイライト（業種に特定語が含まれる場合、C列を赤く）
-        red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-
-        def is_logi(val: str) -> bool:
-            v = (val or "").strip()
-            return any(word in v for word in highlight_partial)
-
-        # データ書き込み（B=企業名, C=業種, D=住所, E=電話）
-        for idx_row, row in df_export.iterrows():
-            r = idx_row + 2
-            sheet_master.cell(row=r, column=2, value=row["企業名"])
-            sheet_master.cell(row=r, column=3, value=row["業種"])
-            sheet_master.cell(row=r, column=4, value=row["住所"])
-            sheet_master.cell(row=r, column=5, value=row["電話番号"])
-            if industry_option == "物流業" and is_logi(row["業種"]):
-                sheet_master.cell(row=r, column=3).fill = red_fill
+        # --- 高速出力（CSV / Parquet、テンプレ書き込みを待たずに使える） ---
+        if fast_export_format:
+            try:
+                cleaned_bytes = export_frame_bytes(cleaned_export_frame(df, df_export), fast_export_format)
+                log_bytes = export_frame_bytes(removal_log_frame(removal_logs), fast_export_format)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            else:
+                mime = "text/csv" if fast_export_format == "csv" else "application/vnd.apache.parquet"
+                col_data, col_log = st.columns(2)
+                col_data.download_button(
+                    f"⚡ 整形済みデータ（{fast_export_format.upper()}）",
+                    data=cleaned_bytes,
+                    file_name=f"{filename_no_ext}_cleaned.{fast_export_format}",
+                    mime=mime,
+                    key=f"fast_export_btn_{file_index}",
+                )
+                col_log.download_button(
+                    f"⚡ 削除ログ（{fast_export_format.upper()}）",
+                    data=log_bytes,
+                    file_name=f"removal_logs_{filename_no_ext}.{fast_export_format}",
+                    mime=mime,
+                    key=f"fast_log_btn_{file_index}",
+                )
 
         # ===============================
-        # 開拓先リストシートのプルダウン＆印刷範囲設定
+        # template.xlsx へ書き込み（『Excel作成』を押したときだけワーカーで実行する）
         # ===============================
-        if "開拓先リスト" in wb.sheetnames:
-            sheet_k = wb["開拓先リスト"]
-
-            # プルダウン（データ検証）: H列の H3, H9, H15, ... に設定
-            try:
-                dv = DataValidation(
-                    type="list",
-                    formula1='"-,アポ,見込み,断り,留守,担当者不在,不使用,削除依頼"',
-                    allow_blank=True,
+        # template.xlsx の読み込みは数十秒かかり途中でキャンセルできないので、プレビューの編集のたびには作らない。
+        # 同じ内容のジョブが待機中・実行中なら、ボタンを押し直しても出し直さない。
+        template_sig = (
+            preview_sig,
+            hash(frozenset(preview_edits.items())),
+            industry_option,
+            hash(template_bytes),
+            track_memory,
+        )
+        template_key = f"template_job_{file_index}"
+        template_entry = st.session_state.get(template_key)
+        is_current = template_entry is not None and template_entry["sig"] == template_sig
+        if template_entry is not None and not is_current:
+            template_entry["job"].cancel()  # 古い内容のジョブ（待機中ならワーカーを使わずに終わる）
+        if st.button(f"📄 Excel作成（{filename_no_ext} / template.xlsx 反映）", key=f"template_btn_{file_index}"):
+            if not is_current or template_entry["job"].status in ("failed", "cancelled"):
+                template_entry = {
+                    "sig": template_sig,
+                    "job": job_manager.submit(
+                        job_owner,
+                        render_template,
+                        df_export,
+                        template_bytes,
+                        industry_option,
+                        file_name=uploaded_file.name,
+                        track_memory=track_memory,
+                    ),
+                }
+                st.session_state[template_key] = template_entry
+                is_current = True
+
+        metrics = res["metrics"]
+        if not is_current:
+            if template_entry is None:
+                st.info("『Excel作成』を押すと、template.xlsx に書き込んだリストを作ります（数十秒かかります）。")
+            else:
+                st.info("プレビューの編集などが変わりました。『Excel作成』を押して作り直してください。")
+        else:
+            template_job = template_entry["job"]
+            wait_for_job(template_job, "template.xlsx 書き込み")
+            if template_job.status == "done":
+                # ダウンロード（ファイルごとに別ボタン）
+                st.download_button(
+                    label=f"📥 整形済みリストをダウンロード（{filename_no_ext} / template.xlsx 反映）",
+                    data=template_job.result["output"].getvalue(),
+                    file_name=f"{filename_no_ext}リスト.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"download_btn_{file_index}",
                 )
-                sheet_k.add_data_validation(dv)
-
-                max_row_k = sheet_k.max_row or 200
-                row = 3
-                while row <= max_row_k:
-                    cell_ref = f"H{row}"
-                    dv.add(sheet_k[cell_ref])
-                    row += 6
-            except Exception:
-                pass
-
-            # 印刷範囲を A〜L 全行に設定
-            try:
-                max_row_k = sheet_k.max_row or 200
-                sheet_k.print_area = f"A1:L{max_row_k}"
-            except Exception:
-                pass
-
-        # ダウンロード（ファイルごとに別ボタン）
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+                metrics = res["metrics"].combine(template_job.result["metrics"])
+            elif template_job.status == "failed":
+                st.error(f"❌ {template_job.error}")
+            else:
+                st.warning("⏹ template.xlsx の書き込みはキャンセルされました。")
+
+        # --- ステージ計測（時間・行数・ピークメモリ） ---
+        all_file_metrics.append(metrics.to_dict())
+        with summary_box:
+            st.markdown("**⏱ ステージ別計測**")
+            st.dataframe(metrics.to_frame(), use_container_width=True, hide_index=True)
+            st.download_button(
+                "⏱ 計測結果をJSONでダウンロード",
+                data=json.dumps(metrics.to_dict(), ensure_ascii=False, indent=2).encode("utf-8"),
+                file_name=f"metrics_{filename_no_ext}.json",
+                mime="application/json",
+                key=f"metrics_btn_{file_index}",
+            )
+
+    if len(all_file_metrics) > 1:
+        st.markdown("---")
         st.download_button(
-            label=f"📥 整形済みリストをダウンロード（{filename_no_ext} / template.xlsx 反映）",
-            data=output,
-            file_name=f"{filename_no_ext}リスト.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key=f"download_btn_{file_index}",
+            "⏱ 全ファイルの計測結果をJSONでダウンロード",
+            data=json.dumps(all_file_metrics, ensure_ascii=False, indent=2).encode("utf-8"),
+            file_name="metrics_all.json",
+            mime="application/json",
+            key="metrics_btn_all",
         )
 
 else:
-    st.info("Excelファイルをアップロードしてください。NGリストxlsxは同フォルダに置くか、プロジェクト直下に配置してください。")
+    st.info("Excel / CSV / TSV / Parquet ファイルをアップロードしてください。NGリストxlsxは同フォルダに置くか、プロジェクト直下に配置してください。")
+
+# ===============================
+# 保存済みのリストから作り直す（再アップロード・再抽出なし）
+# ===============================
+# 上で選んだ NGリスト・業種カテゴリ・市区町村フィルタ・テンプレートをそのまま使い、
+# 結果ストアに保存してあるフィルタ前の行からフィルタ〜重複除去だけをやり直す（テンプレ書き込みは『Excel作成』で）。
+stored_files = result_store.list_files() if result_store is not None else pd.DataFrame()
+if not stored_files.empty:
+    st.markdown("---")
+    with st.expander("🗄 保存済みのリストから作り直す（再アップロード不要）", expanded=False):
+        stored_labels = {
+            int(row.id): (
+                f"{row.file_name}（{row.profile} / {row.row_count}件 / "
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row.created_at))}）"
+            )
+            for row in stored_files.itertuples()
+        }
+        stored_id = st.selectbox(
+            "保存済みのリスト",
+            [None] + list(stored_labels),
+            format_func=lambda i: "選択してください" if i is None else stored_labels[i],
+            key="stored_file",
+        )
+        if stored_id is not None:
+            areas = result_store.municipalities(stored_id)
+            stored_areas = st.multiselect(
+                "住所の市区町村で絞り込む（空なら全件）",
+                [m for m in areas["municipality"] if m],
+                key=f"stored_areas_{stored_id}",
+            )
+            # フィルタ〜重複除去（run_stored）は選んだ時点で実行し、template.xlsx への書き込みは
+            # アップロードしたファイルと同じく『Excel作成』を押したときだけ行う（読み込みが数十秒かかり途中で止められないため）
+            stored_sig = (
+                stored_id,
+                tuple(stored_areas),
+                industry_option,
+                selected_nglist,
+                ng_fuzzy_threshold,
+                dedup_company_address,
+                hash(city_tokens),
+                track_memory,
+            )
+            stored_entry = st.session_state.get("stored_job")
+            if (stored_entry is None or stored_entry["sig"] != stored_sig
+                    or stored_entry["job"].status == "cancelled"):
+                if stored_entry is not None:
+                    stored_entry["job"].cancel()
+                stored_entry = {
+                    "sig": stored_sig,
+                    "job": job_manager.submit(
+                        job_owner,
+                        run_stored,
+                        result_store,
+                        stored_id,
+                        industry_option=industry_option,
+                        municipalities=stored_areas or None,
+                        town_tokens=city_tokens,
+                        ng_names=ng_names,
+                        ng_phones=ng_phones,
+                        ng_index=ng_index,
+                        ng_fuzzy_threshold=ng_fuzzy_threshold,
+                        dedup_company_address=dedup_company_address,
+                        track_memory=track_memory,
+                    ),
+                }
+                st.session_state["stored_job"] = stored_entry
+            stored_job = stored_entry["job"]
+
+            wait_for_job(stored_job, "保存済みリストから作り直し")
+            stored_render = st.session_state.get("stored_template_job")
+            if stored_job.status == "done":
+                stored_res = stored_job.result
+                stored_stem = os.path.splitext(stored_res["metrics"].file_name)[0]
+                st.success(f"✅ {len(stored_res['df'])}件で作り直しました。")
+                st.markdown(summary_markdown(stored_res))
+                if stored_res["removal_logs"]:
+                    st.download_button(
+                        "🧾 削除ログをCSVでダウンロード",
+                        data=export_frame_bytes(removal_log_frame(stored_res["removal_logs"]), "csv"),
+                        file_name=f"removal_logs_{stored_stem}.csv",
+                        mime="text/csv",
+                        key="stored_removal_log_btn",
+                    )
+
+                render_sig = (stored_sig, hash(template_bytes))
+                is_current = stored_render is not None and stored_render["sig"] == render_sig
+                if stored_render is not None and not is_current:
+                    stored_render["job"].cancel()  # 古い内容のジョブ（待機中ならワーカーを使わずに終わる）
+                if st.button(f"📄 Excel作成（{stored_stem} / template.xlsx 反映）", key="stored_template_btn"):
+                    if not is_current or stored_render["job"].status in ("failed", "cancelled"):
+                        stored_render = {
+                            "sig": render_sig,
+                            "job": job_manager.submit(
+                                job_owner,
+                                render_template,
+                                stored_res["df"][OUTPUT_COLUMNS].reset_index(drop=True),
+                                template_bytes,
+                                industry_option,
+                                file_name=stored_res["metrics"].file_name,
+                                track_memory=track_memory,
+                            ),
+                        }
+                        st.session_state["stored_template_job"] = stored_render
+                        is_current = True
+                if not is_current:
+                    st.info("『Excel作成』を押すと、template.xlsx に書き込んだリストを作ります（数十秒かかります）。")
+                else:
+                    render_job = stored_render["job"]
+                    wait_for_job(render_job, "template.xlsx 書き込み")
+                    if render_job.status == "done":
+                        st.download_button(
+                            f"📥 整形済みリストをダウンロード（{stored_stem} / template.xlsx 反映）",
+                            data=render_job.result["output"].getvalue(),
+                            file_name=f"{stored_stem}リスト.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            key="stored_download_btn",
+                        )
+                    elif render_job.status == "failed":
+                        st.error(f"❌ {render_job.error}")
+                    else:
+                        st.warning("⏹ template.xlsx の書き込みはキャンセルされました。")
+            elif stored_job.status == "failed":
+                st.error(f"❌ {stored_job.error}")
+
+            if st.button("🗑 このリストを保存から削除する", key="stored_delete_btn"):
+                stored_job.cancel()
+                st.session_state.pop("stored_job", None)
+                if stored_render is not None:
+                    stored_render["job"].cancel()
+                    st.session_state.pop("stored_template_job", None)
+                result_store.delete(stored_id)
+                st.rerun()
+
@@ -0,0 +1,11 @@
+"""
+テスト共通の設定。リポジトリ直下（g_change_core）と benchmarks（合成データ）を import できるようにする。
+実行: リポジトリ直下で python -m pytest -q（pytest が必要）
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
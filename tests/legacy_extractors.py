@@ -0,0 +1,326 @@
+"""
+user-036 で JSON の抽出プロファイル（ProfileScanner）に置き換える前の抽出関数。
+スキャナーが以前と同じ結果を返すかを比べる基準として、当時のコードをそのまま残している（変更しないこと）。
+"""
+import re
+
+import pandas as pd
+
+from g_change_core import (
+    clean_address,
+    extract_industry,
+    normalize_text,
+    pick_phone_token_raw,
+    split_industry_address,
+)
+
+# ===============================
+# 抽出関数（既存3方式＋Google縦型の業種＋住所同セル）
+# ===============================
+# 1) Google検索リスト（縦読み・電話上下）
+def extract_google_vertical(lines):
+    results = []
+    rows = [str(l) for l in lines if str(l).strip() != ""]
+    for i, line in enumerate(rows):
+        ph_raw = pick_phone_token_raw(line)
+        if ph_raw:
+            phone = ph_raw  # 原文保持
+            address = rows[i - 1] if i - 1 >= 0 else ""
+            industry = extract_industry(rows[i - 2]) if i - 2 >= 0 else ""
+            company = rows[i - 3] if i - 3 >= 0 else ""
+            results.append([company, industry, clean_address(address), phone])
+    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
+
+# 2) シゴトアルワ（縦積み）
+SHIGOTO_ADDRESS_KEYS = ["住所", "所在地", "本社所在地"]
+SHIGOTO_PHONE_KEYS = ["電話", "電話番号", "TEL", "Tel", "tel"]
+SHIGOTO_INDUSTRY_KEYS = ["業種", "事業内容", "産業分類", "製造業種"]
+
+def extract_shigoto_arua(df_like: pd.DataFrame) -> pd.DataFrame:
+    df = df_like.copy()
+    if df.columns.size > 2:
+        df = df.iloc[:, :2]
+    df.columns = ["col0", "col1"]
+    df = df.fillna("")
+    current = {"企業名": "", "住所": "", "電話番号": "", "業種": ""}
+    out = []
+
+    def flush():
+        if current["企業名"]:
+            out.append([current["企業名"], current["業種"], current["住所"], current["電話番号"]])
+        current.update({"企業名": "", "住所": "", "電話番号": "", "業種": ""})
+
+    for _, row in df.iterrows():
+        k, v = str(row["col0"]), str(row["col1"])
+        if k in SHIGOTO_ADDRESS_KEYS:
+            current["住所"] = clean_address(v)
+        elif k in SHIGOTO_PHONE_KEYS:
+            current["電話番号"] = v  # 原文保持
+        elif k in SHIGOTO_INDUSTRY_KEYS:
+            current["業種"] = extract_industry(v)
+        elif k and not v:
+            if current["企業名"]:
+                flush()
+            current["企業名"] = k
+    if current["企業名"]:
+        flush()
+    return pd.DataFrame(out, columns=["企業名", "業種", "住所", "電話番号"])
+
+# 3) 日本倉庫協会（A=企業名, B=郵便番号＋住所, C=TEL/FAX, D=業種 型）
+def extract_warehouse_association(df_like: pd.DataFrame) -> pd.DataFrame:
+    """
+    ・C列に「TEL」を含む行が1レコード
+      - 同じ行の A列: 企業名の1行目
+      - 同じ行の B列: 郵便番号（〒xxx-xxxx）
+      - 同じ行の D列: 業種
+    ・A列の下に営業所名などが続く場合:
+        A(企業行+1) 以降で「空白 or 会社HP」が出るまでを順に結合して企業名とする
+    ・住所:
+        B(郵便番号行+1) 〜 次の郵便番号行の手前まで、
+        B列の非空セルを上から順に結合して1つの住所にする
+    """
+    df = df_like.fillna("")
+    # 列数が足りなければ4列まで埋める
+    while df.shape[1] < 4:
+        df[f"__pad{df.shape[1]}"] = ""
+    df = df.iloc[:, :4]
+    df.columns = ["colA", "colB", "colC", "colD"]
+
+    n_rows = len(df)
+
+    # 郵便番号判定用
+    def is_zip(x: str) -> bool:
+        t = normalize_text(x)
+        return bool(re.search(r"^〒?\d{3}-\d{4}", t))
+
+    # B列の郵便番号行インデックス一覧
+    zip_rows = [i for i, v in enumerate(df["colB"]) if is_zip(v)]
+    if not zip_rows:
+        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
+
+    # 次の郵便番号行を探しやすいように末尾に番兵を追加
+    zip_rows_sorted = sorted(zip_rows)
+    zip_rows_sorted.append(n_rows)
+
+    # 郵便番号行ごとの「次の郵便番号行」マップ
+    zip_to_next = {}
+    for idx in range(len(zip_rows_sorted) - 1):
+        zip_to_next[zip_rows_sorted[idx]] = zip_rows_sorted[idx + 1]
+
+    results = []
+
+    for start in zip_rows_sorted[:-1]:
+        end = zip_to_next[start]  # この郵便番号ブロックの終わり（次の郵便番号行）
+
+        # C列に TEL がなければレコードとして扱わない
+        c_text = normalize_text(df.at[start, "colC"])
+        if "TEL" not in c_text.upper():
+            continue
+
+        # --- 電話番号 ---
+        phone = pick_phone_token_raw(c_text)
+
+        # --- 業種（同じ行のD列）---
+        industry = extract_industry(df.at[start, "colD"])
+
+        # --- 企業名（A列）---
+        company_lines = []
+        first_name = normalize_text(df.at[start, "colA"])
+        if first_name:
+            company_lines.append(first_name)
+
+        # A列で、下方向に「空 or 会社HP」が出るまでを結合
+        for r in range(start + 1, end):
+            a_val = normalize_text(df.at[r, "colA"])
+            if not a_val or a_val == "会社HP":
+                break
+            company_lines.append(a_val)
+
+        company = "".join(company_lines)
+
+        # --- 住所（B列）---
+        address_lines = []
+        for r in range(start + 1, end):
+            b_val = normalize_text(df.at[r, "colB"])
+            if not b_val:
+                continue
+            # 郵便番号行は除外（start+1以降なので基本来ないが一応）
+            if is_zip(b_val):
+                break
+            address_lines.append(b_val)
+
+        address = "".join(address_lines)
+
+        # どれも空ならスキップ
+        if not (company or address or phone):
+            continue
+
+        results.append([company, industry, clean_address(address), phone])
+
+    if not results:
+        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
+
+    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
+
+KANJI_KATA_HIRA = r"\u4E00-\u9FFF\u30A0-\u30FF\u3040-\u309F"
+
+def is_company_candidate(text: str) -> bool:
+    """企業名として使えそうかどうか"""
+    s = normalize_text(text)
+    if not s:
+        return False
+
+    # 無視したいキーワード
+    noise_words = [
+        "ウェブサイト", "Web サイト", "web サイト",
+        "オンラインで予約",
+        "ルート・乗換", "経路案内",
+        "共有",
+        "営業中", "営業時間", "営業時間外", "営業開始",
+        "まもなく営業開始", "クチコミはありません",
+        "口コミ", "クチコミ", "レビュー", "件の",
+    ]
+    if any(w in s for w in noise_words):
+        return False
+
+    # レビュー点数形式: 5.0(1) など
+    if re.match(r"^\d+(?:\.\d+)?\s*\(.+\)\s*$", s):
+        return False
+
+    # 数値や記号のみ (-22, 3.5 など) を除外
+    if re.match(r"^[\d\.\-＋\+マイナス\s]+$", s):
+        return False
+
+    # ひらがな・カタカナ・漢字・英字が少なくとも1つ
+    if not re.search(rf"[{KANJI_KATA_HIRA}A-Za-z]", s):
+        return False
+
+    return True
+
+def is_google_meta_line(text: str) -> bool:
+    """Google検索結果に出てくるメタ情報行かどうか（住所・業種候補からは除外）"""
+    t = normalize_text(text)
+    if not t:
+        return True  # 空行はメタ扱いで飛ばす
+
+    meta_keywords = [
+        "ルート・乗換", "経路案内",
+        "ウェブサイト", "Web サイト", "web サイト",
+        "オンラインで予約",
+        "共有",
+        "現在営業中", "営業時間", "営業時間外",
+        "営業開始", "まもなく営業開始", "24時間営業",
+        "クチコミはありません", "口コミ", "クチコミ", "レビュー",
+    ]
+    if any(k in t for k in meta_keywords):
+        return True
+
+    # 数値や記号だけの行（評価点、-22 など）
+    if re.match(r"^[\d\.\-＋\+マイナス\s]+$", t):
+        return True
+
+    return False
+
+def extract_google_free_vertical(df_like: pd.DataFrame) -> pd.DataFrame:
+    """
+    Google検索結果（縦並び・ヘッダーなし・
+    「業種＋住所」が同じセルに入っているパターン）から
+
+      企業名 / 業種 / 住所 / 電話番号
+
+    を抽出する。
+    企業名は「電話から3〜4行上」のルールを優先しつつ、
+    その間の行から業種＋住所のセルを拾う。
+    """
+    df0 = df_like.fillna("")
+    col = df0.iloc[:, 0].astype(str).tolist()
+    results = []
+
+    for i, line in enumerate(col):
+        ph_raw = pick_phone_token_raw(line)
+        if not ph_raw:
+            continue
+        phone = ph_raw
+
+        # --------------------------
+        # 1) 企業名の行を決める
+        # --------------------------
+        company_idx = None
+
+        # まず Jin さんルールで候補を決める
+        txt_m2 = normalize_text(col[i - 2]) if i - 2 >= 0 else ""
+        if i - 3 >= 0 and "クチコミはありません" in txt_m2:
+            # 電話の2行上に「クチコミはありません」→ 3行上が企業名候補
+            company_idx = i - 3
+        elif i - 4 >= 0:
+            # それ以外は基本4行上
+            company_idx = i - 4
+
+        # 候補が会社名として微妙なら、上方向にスキャンして会社名らしい行を探す
+        if company_idx is not None:
+            if not is_company_candidate(col[company_idx]):
+                company_idx = None
+
+        if company_idx is None:
+            for k in range(i - 1, -1, -1):
+                if is_company_candidate(col[k]):
+                    company_idx = k
+                    break
+
+        if company_idx is None:
+            # 企業名がどうしても見つからない場合はこの電話はスキップ
+            continue
+
+        company = normalize_text(col[company_idx])
+
+        # --------------------------
+        # 2) 業種＋住所セルを探す
+        # --------------------------
+        indaddr_idx = None
+        # 電話の1行上から企業名の1行下までを逆順に見て、
+        # メタ行を飛ばしながら最初に見つかった行を採用
+        for j in range(i - 1, company_idx, -1):
+            txt = normalize_text(col[j])
+            if not txt:
+                continue
+            if is_google_meta_line(txt):
+                continue
+            indaddr_idx = j
+            break
+
+        # どうしても見つからない場合の保険として、
+        # 電話の1行上から上方向にメタ以外の行を探す
+        if indaddr_idx is None:
+            for j in range(i - 1, -1, -1):
+                txt = normalize_text(col[j])
+                if not txt:
+                    continue
+                if is_google_meta_line(txt):
+                    continue
+                indaddr_idx = j
+                break
+
+        industry = ""
+        address = ""
+
+        if indaddr_idx is not None:
+            ind_raw, addr_raw = split_industry_address(col[indaddr_idx])
+
+            if addr_raw:
+                # 「業種・住所」のように分割できたケース
+                industry = extract_industry(ind_raw)
+                address = clean_address(addr_raw)
+            else:
+                # 区切り記号が無い → 全体を住所扱い
+                address = clean_address(col[indaddr_idx])
+
+        # --------------------------
+        # 3) 結果として追加
+        # --------------------------
+        results.append([company, industry, address, phone])
+
+    if not results:
+        return pd.DataFrame(columns=["企業名", "業種", "住所", "電話番号"])
+
+    return pd.DataFrame(results, columns=["企業名", "業種", "住所", "電話番号"])
+
@@ -0,0 +1,195 @@
+"""HTTP API（make_server）: ジョブの投入〜結果取得・同時ジョブ数の上限・トークン・不正なパラメータ"""
+import io
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import g_change_api
+import synthetic
+from g_change_core import CHUNKED_LOG_SHEET, CHUNKED_SHEET, TEMPLATE_MASTER_SHEET, JobManager
+
+TOKEN = "secret-token"
+NGLIST = "NGリスト_テスト"
+
+
+def small_template() -> bytes:
+    # 入力マスターだけのテンプレ（本物の template.xlsx は読み込みだけで数十秒かかる）
+    wb = Workbook()
+    wb.active.title = TEMPLATE_MASTER_SHEET
+    wb.active.append(["No", "企業名", "業種", "住所", "電話番号"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def upload_bytes(n: int = 60) -> bytes:
+    buf = io.BytesIO()
+    synthetic.google_vertical(n).to_excel(buf, index=False, header=False)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """127.0.0.1 の空いているポートで立てたサーバーに、トークンつきでリクエストを送る関数を返す"""
+    template = small_template()
+    monkeypatch.setattr(g_change_api, "APP_DIR", tmp_path)
+    monkeypatch.setattr(g_change_api, "template_bytes", lambda: template)
+    synthetic.ng_list(20).to_excel(tmp_path / f"{NGLIST}.xlsx", index=False)
+
+    manager = JobManager(max_workers=1, per_owner_limit=1)
+    server = g_change_api.make_server("127.0.0.1", 0, token=TOKEN, manager=manager, store=None)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def request(method, path, body=None, headers=None):
+        headers = {"Authorization": f"Bearer {TOKEN}", **(headers or {})}
+        req = urllib.request.Request(base + path, data=body, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as res:
+                return res.status, res.read(), res.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+    request.server = server
+    request.manager = manager
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def as_json(body: bytes) -> dict:
+    return json.loads(body.decode("utf-8"))
+
+
+def wait_done(api, job_id: str, timeout: float = 60) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, body, _ = api("GET", f"/jobs/{job_id}")
+        assert status == 200
+        job = as_json(body)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"ジョブが終わりません: {job_id}")
+
+
+def test_whole_file_job(api):
+    status, body, _ = api("POST", "/jobs?industry=other&name=" + quote("list.xlsx"), upload_bytes())
+    assert status == 202
+    job = wait_done(api, as_json(body)["id"])
+    assert job["status"] == "done" and job["rows"] > 0
+
+    status, body, headers = api("GET", f"/jobs/{job['id']}/result")
+    assert status == 200
+    assert "list%E3%83%AA%E3%82%B9%E3%83%88.xlsx" in headers["Content-Disposition"]  # list リスト.xlsx
+    master = pd.read_excel(io.BytesIO(body), sheet_name=TEMPLATE_MASTER_SHEET, dtype=str)
+    assert len(master) == job["rows"]
+
+    status, body, _ = api("GET", f"/jobs/{job['id']}/cleaned?format=csv")
+    assert status == 200 and len(pd.read_csv(io.BytesIO(body))) == job["rows"]
+    status, _, _ = api("GET", f"/jobs/{job['id']}/removals")
+    assert status == 200
+    status, _, _ = api("GET", f"/jobs/{job['id']}/removals?format=json")
+    assert status == 400
+
+
+def test_chunked_job(api):
+    status, body, _ = api("POST", "/jobs?chunked=1&profile=google_vertical", upload_bytes())
+    assert status == 202
+    job = wait_done(api, as_json(body)["id"])
+    assert job["status"] == "done" and job["rows"] > 0
+
+    status, body, _ = api("GET", f"/jobs/{job['id']}/result")
+    assert status == 200
+    sheets = pd.read_excel(io.BytesIO(body), sheet_name=None)
+    assert set(sheets) == {CHUNKED_SHEET, CHUNKED_LOG_SHEET}
+    assert len(sheets[CHUNKED_SHEET]) == job["rows"]
+    for part in ("removals", "cleaned"):
+        status, body, _ = api("GET", f"/jobs/{job['id']}/{part}")
+        assert status == 400, part
+        assert "/result" in as_json(body)["error"]
+
+
+def test_active_job_cap(api):
+    api.server.RequestHandlerClass.registry.max_active = 1
+    # 別の利用者のジョブでワーカー（1本）を塞ぎ、API のジョブを待機中のままにする
+    release = threading.Event()
+    blocker = api.manager.submit("other", lambda progress: release.wait(30))
+    try:
+        status, body, _ = api("POST", "/jobs", upload_bytes())
+        assert status == 202 and as_json(body)["status"] == "queued"
+        status, body, _ = api("POST", "/jobs", upload_bytes())
+        assert status == 429
+        assert "上限" in as_json(body)["error"]
+    finally:
+        release.set()
+    blocker.wait(30)
+    for job in list(api.server.RequestHandlerClass.registry._jobs.values()):
+        assert job.wait(60)
+    status, _, _ = api("POST", "/jobs", upload_bytes())
+    assert status == 202
+
+
+@pytest.mark.parametrize("headers", [
+    {"Authorization": ""},
+    {"Authorization": "Bearer wrong"},
+    {"Authorization": "", "X-API-Token": "wrong"},
+    {"Authorization": TOKEN},  # Bearer なし
+])
+def test_missing_or_wrong_token_is_rejected(api, headers):
+    status, body, _ = api("GET", "/health", headers=headers)
+    assert status == 401
+    assert "error" in as_json(body)
+    status, _, _ = api("POST", "/jobs", upload_bytes(), headers=headers)
+    assert status == 401
+
+
+def test_token_headers_are_accepted(api):
+    assert api("GET", "/health")[0] == 200
+    assert api("GET", "/health", headers={"Authorization": "", "X-API-Token": TOKEN})[0] == 200
+
+
+@pytest.mark.parametrize("query", [
+    "profile=unknown",
+    "industry=" + quote("建設業"),
+    f"nglist={quote(NGLIST)}&fuzzy=abc",
+    f"nglist={quote(NGLIST)}&fuzzy=0",
+    f"nglist={quote(NGLIST)}&fuzzy=1.5",
+    f"nglist={quote('NGリスト_無い')}",
+    "pref=" + quote("愛知県"),
+])
+def test_invalid_parameters_are_400(api, query):
+    status, body, _ = api("POST", f"/jobs?{query}", upload_bytes())
+    assert status == 400, query
+    assert as_json(body)["error"]
+
+
+def test_valid_fuzzy_threshold_is_accepted(api):
+    status, body, _ = api("POST", f"/jobs?nglist={quote(NGLIST)}&fuzzy=0.8", upload_bytes())
+    assert status == 202
+    assert wait_done(api, as_json(body)["id"])["status"] == "done"
+
+
+def test_empty_body_is_400(api):
+    assert api("POST", "/jobs", b"")[0] == 400
+
+
+@pytest.mark.parametrize("method, path", [
+    ("GET", "/jobs/" + "0" * 32),
+    ("GET", "/jobs/" + "0" * 32 + "/result"),
+    ("DELETE", "/jobs/" + "0" * 32),
+    ("GET", "/jobs/not-a-job"),
+    ("GET", "/unknown"),
+])
+def test_unknown_job_or_path_is_404(api, method, path):
+    status, body, _ = api(method, path)
+    assert status == 404
+    assert as_json(body)["error"]
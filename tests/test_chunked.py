@@ -0,0 +1,113 @@
+"""分割処理（extract_chunks / run_pipeline_chunked）が一括処理と同じ結果になるか"""
+import io
+
+import pandas as pd
+import pytest
+
+import g_change_core
+import synthetic
+from g_change_core import (
+    CHUNKED_LOG_SHEET,
+    CHUNKED_SHEET,
+    PROFILE_AUTO,
+    PROFILE_GOOGLE_FREE_VERTICAL,
+    PROFILE_GOOGLE_VERTICAL,
+    PROFILE_SCANNERS,
+    PROFILE_SHIGOTO_ARUA,
+    PROFILE_WAREHOUSE,
+    cleaned_export_frame,
+    extract_chunks,
+    removal_log_frame,
+    run_pipeline,
+    run_pipeline_chunked,
+)
+
+CHUNK_SIZES = [7, 13, 50, 333]
+GENERATORS = {
+    PROFILE_GOOGLE_VERTICAL: synthetic.google_vertical,
+    PROFILE_GOOGLE_FREE_VERTICAL: synthetic.google_free_vertical,
+    PROFILE_SHIGOTO_ARUA: synthetic.shigoto_arua,
+    PROFILE_WAREHOUSE: synthetic.warehouse_association,
+}
+
+
+def split_rows(raw: pd.DataFrame, size: int):
+    return [raw.iloc[i:i + size].reset_index(drop=True) for i in range(0, len(raw), size)]
+
+
+def xlsx_bytes(sheets: dict) -> bytes:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as writer:
+        for name, raw in sheets.items():
+            raw.to_excel(writer, sheet_name=name, index=False, header=False)
+    return buf.getvalue()
+
+
+def as_strings(df: pd.DataFrame) -> list:
+    return df.astype(object).where(df.notna(), "").astype(str).values.tolist()
+
+
+def assert_chunked_matches_whole(data: bytes, chunk_rows: int, profile: str = PROFILE_AUTO, file_name: str = "",
+                                 **options):
+    # 自動判定は最初のチャンクだけを見るので、7行のような小さいチャンクでは profile を指定する
+    whole = run_pipeline(data, profile=profile, file_name=file_name, dedup_company_address=False, **options)
+    chunked = run_pipeline_chunked(data, profile=profile, file_name=file_name, chunk_rows=chunk_rows, **options)
+    sheets = pd.read_excel(chunked["output"], sheet_name=None, dtype=str, keep_default_na=False)
+    expected = cleaned_export_frame(whole["df"])
+    assert list(sheets[CHUNKED_SHEET].columns) == list(expected.columns)
+    assert as_strings(sheets[CHUNKED_SHEET]) == as_strings(expected)
+    assert as_strings(sheets[CHUNKED_LOG_SHEET][["reason", "company", "phone_raw", "match"]]) == \
+        as_strings(removal_log_frame(whole["removal_logs"]))
+    assert chunked["rows"] == len(whole["df"])
+    assert chunked["sheets"] == whole["sheets"]
+    for key in ("removed_by_industry", "company_removed", "phone_removed", "dup_removed"):
+        assert chunked[key] == whole[key], key
+    return chunked
+
+
+@pytest.mark.parametrize("profile", list(GENERATORS))
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_extract_chunks_matches_whole_extract(profile, size):
+    raw = GENERATORS[profile](200)
+    scanner = PROFILE_SCANNERS[profile]
+    logs = []
+    chunked = pd.concat(list(extract_chunks(split_rows(raw, size), scanner, logs)), ignore_index=True)
+    assert as_strings(chunked) == as_strings(scanner.extract(raw))
+    assert logs == []
+
+
+@pytest.mark.parametrize("profile", list(GENERATORS))
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_run_pipeline_chunked_matches_run_pipeline(profile, size):
+    raw = GENERATORS[profile](150)
+    # 後ろに先頭の一部を繰り返して、チャンクをまたぐ電話の重複除去も確かめる
+    data = xlsx_bytes({"Sheet1": pd.concat([raw, raw.head(120)], ignore_index=True)})
+    chunked = assert_chunked_matches_whole(data, size, profile, industry_option="その他")
+    assert chunked["dup_removed"] > 0
+
+
+@pytest.mark.parametrize("size", [7, 50])
+def test_chunked_csv_matches_whole(size):
+    raw = synthetic.shigoto_arua(150)
+    data = raw.to_csv(index=False, header=False).encode("utf-8-sig")
+    assert_chunked_matches_whole(data, size, PROFILE_SHIGOTO_ARUA, file_name="list.csv", industry_option="製造業")
+
+
+@pytest.mark.parametrize("size", [13, 333])
+def test_chunked_multi_sheet_matches_whole(size):
+    data = xlsx_bytes({
+        "google": synthetic.google_vertical(120),
+        "empty": pd.DataFrame({0: [""]}),
+        "warehouse": synthetic.warehouse_association(80),
+    })
+    chunked = assert_chunked_matches_whole(data, size, industry_option="物流業")
+    assert chunked["sheets"] == ["google", "warehouse"]
+
+
+def test_carry_limit_is_logged(monkeypatch):
+    monkeypatch.setattr(g_change_core, "CHUNK_MAX_CARRY_ROWS", 1)
+    raw = synthetic.google_vertical(60)
+    logs = []
+    list(extract_chunks(split_rows(raw, 7), PROFILE_SCANNERS[PROFILE_GOOGLE_VERTICAL], logs))
+    assert logs
+    assert {entry["reason"] for entry in logs} == {"chunk-carry-truncated"}
@@ -0,0 +1,97 @@
+"""企業名＋住所の重複除去（remove_duplicate_companies）と、住所からの都道府県・市区町村の取り出し"""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from g_change_core import add_match_keys, remove_duplicate_companies, resolve_municipality
+
+TOWN2CITY = Path(__file__).resolve().parent.parent / "jp_town2city.csv"
+
+
+def keyed(rows) -> pd.DataFrame:
+    return add_match_keys(pd.DataFrame(rows, columns=["企業名", "業種", "住所", "電話番号"]))
+
+
+def dedup(rows):
+    logs = []
+    df, removed = remove_duplicate_companies(keyed(rows), logs)
+    assert removed == len(logs)
+    return df["企業名"].tolist(), logs
+
+
+def test_same_company_in_the_same_block_is_removed():
+    kept, logs = dedup([
+        ["株式会社山田製作所", "製造業", "愛知県豊田市元城町1-2", "0565-11-1111"],
+        ["（株）山田製作所", "", "愛知県豊田市元城町1-2", ""],
+        ["山田製作所", "", "愛知県豊田市元城町1-2（本社）", "0565-22-2222"],
+    ])
+    assert kept == ["株式会社山田製作所"]
+    assert logs[0] == {"reason": "dup-company-address", "company": "（株）山田製作所", "phone_raw": "",
+                       "match": "株式会社山田製作所", "score": 1.0}
+    assert logs[1]["company"] == "山田製作所" and logs[1]["phone_raw"] == "0565-22-2222"
+    assert logs[1]["match"] == "株式会社山田製作所"
+    assert 0.85 <= logs[1]["score"] < 1.0
+
+
+@pytest.mark.parametrize("other", [
+    ["山田製作所", "", "愛知県豊明市元城町1-2", ""],   # 市区町村が違う
+    ["山田製作所", "", "山口県豊田市元城町1-2", ""],   # 都道府県が違う
+    ["新山田製作所", "", "山形県豊田市元城町1-2", ""],  # 企業名の先頭が違う
+])
+def test_rows_in_different_blocks_are_not_compared(other):
+    # どれも住所・企業名の類似度はしきい値を超えるが、ブロックが違うので比べない
+    kept, logs = dedup([["山田製作所", "", "山形県豊田市元城町1-2", ""], other])
+    assert len(kept) == 2 and logs == []
+
+
+@pytest.mark.parametrize("first, second", [
+    (["山田製作所 第2工場", "愛知県豊田市元城町1-2"], ["山田製作所 第3工場", "愛知県豊田市元城町1-2"]),
+    (["山田製作所", "愛知県豊田市元城町1-2"], ["山田製作所", "愛知県豊田市元城町1-3"]),
+])
+def test_mismatched_digits_are_different_companies(first, second):
+    kept, logs = dedup([[first[0], "", first[1], ""], [second[0], "", second[1], ""]])
+    assert len(kept) == 2 and logs == []
+
+
+def test_empty_address_needs_an_exact_name():
+    kept, logs = dedup([
+        ["山田製作所", "", "", "0565-11-1111"],
+        ["株式会社山田製作所", "", "", ""],
+        ["山田製作所本店", "", "", ""],
+    ])
+    assert kept == ["山田製作所", "山田製作所本店"]
+    assert [(e["company"], e["match"], e["score"]) for e in logs] == [("株式会社山田製作所", "山田製作所", 1.0)]
+
+
+def test_rows_without_a_company_name_are_kept():
+    kept, logs = dedup([["", "", "愛知県豊田市元城町1-2", "0565-11-1111"], ["", "", "愛知県豊田市元城町1-2", ""]])
+    assert kept == ["", ""] and logs == []
+
+
+@pytest.mark.parametrize("address, pref, city", [
+    ("三重県四日市市諏訪町1-5", "三重県", "四日市市"),
+    ("千葉県市川市八幡1-1-1", "千葉県", "市川市"),
+    ("愛知県名古屋市中区栄1-2-3", "愛知県", "名古屋市中区"),
+    ("〒460-0008 愛知県名古屋市中区栄3-1", "愛知県", "名古屋市中区"),
+    ("名古屋市中区栄1", "", "名古屋市中区"),
+    ("広島県廿日市市下平良1-11-1", "広島県", "廿日市市"),
+    ("東京都東村山市本町1-2-3", "東京都", "東村山市"),
+    ("東京都千代田区丸の内1-1", "東京都", "千代田区"),
+    ("愛知県北設楽郡設楽町田口1", "愛知県", "北設楽郡設楽町"),
+    ("北海道余市郡余市町黒川町1", "北海道", "余市郡余市町"),
+    ("奈良県大和郡山市北郡山町1", "奈良県", "大和郡山市"),
+    ("三重県鈴鹿市郡山町1", "三重県", "鈴鹿市"),      # 町域の「郡」を郡部と取り違えない
+    ("北海道富良野市上五区1", "北海道", "富良野市"),  # 政令市でない市の「○○区」は町域
+    ("", "", ""),
+])
+def test_resolve_municipality(address, pref, city):
+    area = resolve_municipality(pd.Series([address]))
+    assert area.iloc[0].tolist() == [pref, city]
+
+
+def test_resolve_municipality_for_every_municipality():
+    towns = pd.read_csv(TOWN2CITY, dtype=str, keep_default_na=False)
+    area = resolve_municipality(towns["prefecture"] + towns["municipality"] + towns["town_keyword"] + "1-2-3")
+    wrong = towns[(area["pref"] != towns["prefecture"]) | (area["city"] != towns["municipality"])]
+    assert wrong.empty, wrong.drop_duplicates("municipality").head(20)
@@ -0,0 +1,144 @@
+"""ジョブ管理（JobManager / Job）: 利用者ごとの同時実行数・キャンセル・失敗"""
+import threading
+import time
+
+import pytest
+
+from g_change_core import JobCancelled, JobManager
+
+TIMEOUT = 10
+
+
+class Gate:
+    """started で開始を知らせ、release されるまで止まっている処理"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, progress):
+        self.started.set()
+        assert self.release.wait(TIMEOUT)
+        return "ok"
+
+
+@pytest.fixture
+def gates():
+    made = []
+
+    def make():
+        made.append(Gate())
+        return made[-1]
+
+    yield make
+    for gate in made:
+        gate.release.set()
+
+
+def wait_until(cond):
+    deadline = time.time() + TIMEOUT
+    while not cond():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_done_job_keeps_the_result():
+    job = JobManager(max_workers=1).submit("a", lambda x, progress: progress("step", 0.5) or x * 2, 21)
+    assert job.wait(TIMEOUT)
+    assert (job.status, job.result, job.error, job.progress, job.stage) == ("done", 42, None, 1.0, "step")
+    assert job.started_at <= job.finished_at
+
+
+def test_per_owner_limit_does_not_starve_other_owners(gates):
+    manager = JobManager(max_workers=2, per_owner_limit=1)
+    a = [gates() for _ in range(3)]
+    a_jobs = [manager.submit("a", gate) for gate in a]
+    b = gates()
+    b_job = manager.submit("b", b)
+
+    # a の2件目以降は a の待ち行列に積まれ、空いているワーカーは b が使う
+    assert a[0].started.wait(TIMEOUT) and b.started.wait(TIMEOUT)
+    assert not a[1].started.is_set()
+    assert [j.status for j in a_jobs] == ["running", "queued", "queued"]
+    assert manager.stats() == {"running": 2, "pending": 2, "max_workers": 2}
+
+    b.release.set()
+    assert b_job.wait(TIMEOUT)
+    assert not a[1].started.is_set()  # b が終わっても a の上限は 1 件のまま
+
+    # a の実行中が終わるたびに、a の待ち行列から1件ずつ流れる
+    for k in range(3):
+        assert a[k].started.wait(TIMEOUT)
+        if k + 1 < 3:
+            assert not a[k + 1].started.is_set()
+        a[k].release.set()
+        assert a_jobs[k].wait(TIMEOUT)
+    assert [j.status for j in a_jobs] == ["done"] * 3
+    wait_until(lambda: manager.stats()["running"] == 0)
+    assert manager.stats()["pending"] == 0
+
+
+def test_cancel_pending_job_never_runs(gates):
+    manager = JobManager(max_workers=2, per_owner_limit=1)
+    first = gates()
+    running = manager.submit("a", first)
+    ran = threading.Event()
+    pending = manager.submit("a", lambda progress: ran.set())
+    after = manager.submit("a", lambda progress: "after")
+    assert first.started.wait(TIMEOUT)
+
+    pending.cancel()
+    assert pending.status == "queued" and pending.cancel_requested
+    first.release.set()
+    assert pending.wait(TIMEOUT) and after.wait(TIMEOUT)
+    assert pending.status == "cancelled" and not ran.is_set()
+    assert pending.started_at is None
+    assert (running.status, after.status, after.result) == ("done", "done", "after")
+
+
+def test_cancel_running_job_stops_at_the_next_progress_report():
+    started, stopped = threading.Event(), threading.Event()
+
+    def work(progress):
+        started.set()
+        try:
+            for i in range(10_000):
+                progress("loop", i / 10_000)
+                time.sleep(0.001)
+        except JobCancelled:
+            stopped.set()
+            raise
+        return "finished"
+
+    job = JobManager(max_workers=1).submit("a", work)
+    assert started.wait(TIMEOUT)
+    assert job.status == "running"
+    job.cancel()
+    assert job.wait(TIMEOUT)
+    assert stopped.is_set()
+    assert (job.status, job.result, job.error) == ("cancelled", None, None)
+
+
+def test_job_cancelled_raised_inside_the_job_is_cancelled():
+    def work(progress):
+        raise JobCancelled()
+
+    job = JobManager(max_workers=1).submit("a", work)
+    assert job.wait(TIMEOUT)
+    assert job.status == "cancelled" and job.error is None
+
+
+def test_failed_job_exposes_the_error():
+    def work(progress):
+        progress("parse", 0.3)
+        raise ValueError("壊れたファイルです")
+
+    manager = JobManager(max_workers=1)
+    job = manager.submit("a", work)
+    assert job.wait(TIMEOUT)
+    assert job.status == "failed"
+    assert job.error == "ValueError: 壊れたファイルです"
+    assert job.result is None and job.stage == "parse"
+    # 失敗しても利用者の枠は空く
+    assert manager.submit("a", lambda progress: "next").wait(TIMEOUT)
+    wait_until(lambda: manager.stats() == {"running": 0, "pending": 0, "max_workers": 1})
@@ -0,0 +1,106 @@
+"""NG企業名のあいまい照合（NgNameIndex の候補探し・しきい値・削除ログ）"""
+import io
+
+import pandas as pd
+import pytest
+
+import g_change_core
+import synthetic
+from g_change_core import (
+    NG_FUZZY_TOP_K,
+    PROFILE_AUTO,
+    NgNameIndex,
+    add_match_keys,
+    canonical_company_name,
+    extract_google_vertical,
+    fuzzy_name_score,
+    remove_ng_fuzzy_matches,
+    run_pipeline,
+)
+
+
+def keyed(names) -> pd.DataFrame:
+    return add_match_keys(pd.DataFrame({"企業名": names, "業種": "", "住所": "", "電話番号": "052-123-4567"}))
+
+
+def test_short_names_are_not_indexed():
+    index = NgNameIndex(["山田製作所", "鈴木工業所", "日本", "山田製作所"])
+    assert index.names == ["山田製作所", "鈴木工業所"]
+    assert len(index) == 2
+
+
+def test_candidates_share_enough_bigrams():
+    index = NgNameIndex(["山田製作所", "佐藤精機製作所", "鈴木工業所"])
+    # 山田製作所 は 2-gram 4つすべて、佐藤精機製作所 は 6つのうち 2つ（製作・作所）を共有する
+    assert index.candidates("山田製作所本社") == ["山田製作所"]
+    assert index.candidates("山田製作所本社", min_overlap=0.3) == ["山田製作所", "佐藤精機製作所"]
+    assert index.candidates("まったく別の会社") == []
+
+
+def test_candidates_are_capped_at_top_k():
+    index = NgNameIndex([f"山田製作所{i}" for i in range(NG_FUZZY_TOP_K + 3)])
+    assert len(index.candidates("山田製作所", min_overlap=0.3)) == NG_FUZZY_TOP_K
+
+
+def test_common_bigrams_are_not_used_for_candidates(monkeypatch):
+    index = NgNameIndex(["山田製作所", "佐藤製作所"])
+    assert sorted(index.candidates("高橋製作所")) == ["佐藤製作所", "山田製作所"]
+    # 製作・作所 は 2件のNG名に出てくるので、上限1件なら候補探しに使わない
+    monkeypatch.setattr(g_change_core, "NG_FUZZY_MAX_POSTING", 1)
+    assert index.candidates("高橋製作所") == []
+    assert index.candidates("山田製作所") == ["山田製作所"]
+
+
+def test_threshold_is_inclusive():
+    index = NgNameIndex(["山田製作所"])
+    score = fuzzy_name_score("山田製作書", "山田製作所")
+    assert score == pytest.approx(0.8)
+    assert index.best_match("山田製作書", score) == ("山田製作所", score)
+    assert index.best_match("山田製作書", score + 1e-9) == (None, 0.0)
+
+
+def test_branch_suffix_matches_by_prefix():
+    assert fuzzy_name_score("山田製作所名古屋支店", "山田製作所") == 1.0
+
+
+def test_removal_log_has_the_score():
+    index = NgNameIndex([canonical_company_name("株式会社山田製作所")])
+    df = keyed(["株式会社山田製作書", "鈴木工業所", "山田"])
+    logs = []
+    out, removed = remove_ng_fuzzy_matches(df, index, 0.8, logs)
+    assert removed == 1
+    assert out["企業名"].tolist() == ["鈴木工業所", "山田"]
+    assert logs == [{"reason": "ng-company-fuzzy", "company": "株式会社山田製作書", "phone_raw": "052-123-4567",
+                     "match": "山田製作所", "score": 0.8}]
+
+
+def test_empty_index_or_frame_is_a_no_op():
+    logs = []
+    df = keyed(["株式会社山田製作書"])
+    assert remove_ng_fuzzy_matches(df, NgNameIndex([]), 0.8, logs)[1] == 0
+    assert remove_ng_fuzzy_matches(df.iloc[:0], NgNameIndex(["山田製作所"]), 0.8, logs)[1] == 0
+    assert logs == []
+
+
+@pytest.fixture(scope="module")
+def upload_and_ng():
+    raw = synthetic.google_vertical(120)
+    buf = io.BytesIO()
+    raw.to_excel(buf, index=False, header=False)
+    # 入力の企業名の一部を1文字だけ変えたNG名（部分一致では当たらず、あいまい照合でだけ当たる）
+    names = [canonical_company_name(x) for x in extract_google_vertical(raw.iloc[:, 0].tolist())["企業名"]]
+    ng_names = [name[:1] + "＊" + name[2:] for name in names[:10] if len(name) >= 5]
+    return buf.getvalue(), ng_names
+
+
+def test_threshold_none_skips_the_stage(upload_and_ng):
+    data, ng_names = upload_and_ng
+    options = dict(profile=PROFILE_AUTO, industry_option="その他", ng_names=ng_names)
+    fuzzy = run_pipeline(data, ng_index=NgNameIndex(ng_names), ng_fuzzy_threshold=0.7, **options)
+    assert fuzzy["fuzzy_removed"] > 0
+    skipped = run_pipeline(data, ng_index=NgNameIndex(ng_names), ng_fuzzy_threshold=None, **options)
+    plain = run_pipeline(data, **options)
+    assert skipped["fuzzy_removed"] == 0
+    assert not any(e["reason"] == "ng-company-fuzzy" for e in skipped["removal_logs"])
+    pd.testing.assert_frame_equal(skipped["df"], plain["df"])
+    assert "ng_fuzzy" not in {s["stage"] for s in skipped["metrics"].to_dict()["stages"]}
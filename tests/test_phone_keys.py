@@ -0,0 +1,68 @@
+"""canonical_phone_keys（NG照合・重複判定用の電話キー）の境界ケース"""
+import pandas as pd
+import pytest
+
+from g_change_core import canonical_phone_keys
+
+
+def keys_of(*phones):
+    return canonical_phone_keys(pd.Series(list(phones), dtype=object))
+
+
+@pytest.mark.parametrize("raw", [
+    "052-123-4567",
+    "052 123 4567",
+    "０５２－１２３－４５６７",
+    "+81 52-123-4567",
+    "+81-(0)52-123-4567",
+    "81521234567",
+    "521234567",       # Excel で数値になり先頭の0が落ちた
+    "521234567.0",
+    521234567,
+])
+def test_same_landline_gets_same_key(raw):
+    out = keys_of(raw)
+    assert out["digits"].iloc[0] == "0521234567"
+    assert out["key"].iloc[0] == 521234567
+    assert out["type"].iloc[0] == "landline"
+
+
+@pytest.mark.parametrize("raw, digits, phone_type", [
+    ("090-1234-5678", "09012345678", "mobile"),
+    ("+81 90 1234 5678", "09012345678", "mobile"),
+    ("9012345678", "09012345678", "mobile"),
+    ("0120-123-456", "0120123456", "free"),
+    ("0800-123-4567", "08001234567", "free"),
+    ("050-1234-5678", "05012345678", "other"),
+    ("0570-123-456", "0570123456", "other"),
+])
+def test_types(raw, digits, phone_type):
+    out = keys_of(raw)
+    assert out["digits"].iloc[0] == digits
+    assert out["type"].iloc[0] == phone_type
+
+
+@pytest.mark.parametrize("raw", ["", "nan", "000-0000-0000", "0000000000", "00-1234-5678", "12345", "03-1234", "012345678901"])
+def test_invalid_numbers_have_no_key(raw):
+    out = keys_of(raw)
+    assert out["digits"].iloc[0] == ""
+    assert pd.isna(out["key"].iloc[0])
+    assert out["type"].iloc[0] == ""
+
+
+def test_nine_digit_number_with_leading_zero_keeps_raw_digits():
+    # 03-1234-567 のような桁落ちは補正せず、原文の数字のままキーにする
+    out = keys_of("03-1234-567", "03 1234 567", "000-123-456")
+    assert out["digits"].tolist() == ["031234567", "031234567", ""]
+    assert out["key"].iloc[0] == out["key"].iloc[1] == 31234567
+    assert out["type"].iloc[0] == "other"
+
+
+def test_keys_of_different_lengths_never_collide():
+    out = keys_of("031234567", "0312345670", "03123456700")
+    assert out["key"].nunique() == 3
+
+
+def test_index_is_kept():
+    phones = pd.Series(["052-123-4567", ""], index=[10, 20])
+    assert canonical_phone_keys(phones).index.tolist() == [10, 20]
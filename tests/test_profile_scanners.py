@@ -0,0 +1,75 @@
+"""profiles/*.json から作った ProfileScanner が、置き換える前の抽出関数と同じ結果を返すか"""
+import pandas as pd
+import pytest
+
+import legacy_extractors as legacy
+import synthetic
+from g_change_core import (
+    PROFILE_GOOGLE_FREE_VERTICAL,
+    PROFILE_GOOGLE_VERTICAL,
+    PROFILE_SCANNERS,
+    PROFILE_SHIGOTO_ARUA,
+    PROFILE_WAREHOUSE,
+    detect_profile,
+)
+
+CASES = {
+    PROFILE_GOOGLE_VERTICAL: (synthetic.google_vertical, lambda df: legacy.extract_google_vertical(df.iloc[:, 0].tolist())),
+    PROFILE_GOOGLE_FREE_VERTICAL: (synthetic.google_free_vertical, legacy.extract_google_free_vertical),
+    PROFILE_SHIGOTO_ARUA: (synthetic.shigoto_arua, legacy.extract_shigoto_arua),
+    PROFILE_WAREHOUSE: (synthetic.warehouse_association, legacy.extract_warehouse_association),
+}
+
+# 合成データでは出てこない並び（レコードの途中で始まる・終わる、キーの欠け、空行の連続など）
+EDGE_INPUTS = {
+    PROFILE_GOOGLE_VERTICAL: [
+        pd.DataFrame({0: ["052-123-4567", "住所だけ", "090-1111-2222"]}),
+        pd.DataFrame({0: ["株式会社A", "", "", "製造業", "愛知県名古屋市中区栄1-2-3", "052-123-4567", "", "末尾の企業"]}),
+        pd.DataFrame({0: ["株式会社A", "製造業", "愛知県豊田市元城町1", "TEL 0565-12-3456 / FAX 0565-12-3457"]}),
+    ],
+    PROFILE_GOOGLE_FREE_VERTICAL: [
+        pd.DataFrame({0: ["052-123-4567"]}),
+        pd.DataFrame({0: ["4.5(10)", "ウェブサイト", "052-123-4567"]}),
+        pd.DataFrame({0: ["株式会社A", "クチコミはありません", "製造業 · 愛知県名古屋市中区栄1", "052-123-4567",
+                          "株式会社B", "3.1(2)", "愛知県豊田市元城町1", "共有", "0565-12-3456"]}),
+        pd.DataFrame({0: ["株式会社A", "製造業 ·", "営業時間外", "ルート・乗換", "052-123-4567"]}),
+    ],
+    PROFILE_SHIGOTO_ARUA: [
+        pd.DataFrame([["住所", "愛知県名古屋市"], ["株式会社A", ""], ["TEL", "052-123-4567"]]),
+        pd.DataFrame([["株式会社A", ""], ["株式会社B", ""], ["電話", "052-123-4567"], ["業種", "製造業"], ["株式会社C", ""]]),
+        pd.DataFrame([["株式会社A", "", "余分な列"], ["所在地", "愛知県豊田市", "x"]]),
+    ],
+    PROFILE_WAREHOUSE: [
+        pd.DataFrame([["株式会社A", "〒460-0001", "FAX 052-123-4568", "普通倉庫"], ["", "愛知県名古屋市", "", ""]]),
+        pd.DataFrame([["株式会社A", "〒460-0001", "TEL 052-123-4567", "普通倉庫"],
+                      ["本社", "愛知県名古屋市中区", "", ""], ["", "栄1-2-3", "", ""], ["会社HP", "", "", ""]]),
+        pd.DataFrame([["株式会社A", "〒460-0001", "TEL 052-123-4567"]]),
+        pd.DataFrame([["", "", "", ""]]),
+    ],
+}
+
+
+def assert_same(new: pd.DataFrame, old: pd.DataFrame):
+    assert list(new.columns) == list(old.columns)
+    assert new.reset_index(drop=True).astype(str).values.tolist() == old.reset_index(drop=True).astype(str).values.tolist()
+
+
+@pytest.mark.parametrize("profile", list(CASES))
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_scanner_matches_legacy_extractor(profile, seed):
+    make, old_extract = CASES[profile]
+    raw = make(150, seed=seed)
+    new = PROFILE_SCANNERS[profile].extract(raw)
+    assert len(new) > 0
+    assert_same(new, old_extract(raw))
+
+
+@pytest.mark.parametrize("profile, raw", [(p, raw) for p, raws in EDGE_INPUTS.items() for raw in raws])
+def test_scanner_matches_legacy_extractor_on_edge_cases(profile, raw):
+    assert_same(PROFILE_SCANNERS[profile].extract(raw), CASES[profile][1](raw))
+
+
+@pytest.mark.parametrize("profile", list(CASES))
+def test_detect_profile_picks_the_generating_profile(profile):
+    raw = CASES[profile][0](100)
+    assert detect_profile(raw.head(300))[0] == profile
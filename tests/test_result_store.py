@@ -0,0 +1,168 @@
+"""結果ストア（ResultStore）の保存・置き換え・読み出しと、run_stored が run_pipeline と同じ結果になるか"""
+import io
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import synthetic
+from g_change_core import (
+    DEFAULT_STORE_PATH,
+    PROFILE_AUTO,
+    NgNameIndex,
+    ResultStore,
+    add_match_keys,
+    clean_dataframe_except_phone,
+    extract_google_vertical,
+    load_ng_list,
+    open_result_store,
+    run_pipeline,
+    run_stored,
+)
+
+
+def xlsx_bytes(raw: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    raw.to_excel(buf, index=False, header=False)
+    return buf.getvalue()
+
+
+def keyed_rows(n: int, seed: int = 1) -> pd.DataFrame:
+    raw = synthetic.google_vertical(n, seed=seed)
+    return add_match_keys(clean_dataframe_except_phone(extract_google_vertical(raw.iloc[:, 0].tolist())))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(tmp_path / "store.sqlite3")
+
+
+@pytest.fixture(scope="module")
+def upload():
+    # 後ろに先頭の一部を繰り返して、電話・企業名＋住所の重複除去も効くようにする
+    raw = synthetic.google_vertical(300)
+    return xlsx_bytes(pd.concat([raw, raw.head(200)], ignore_index=True))
+
+
+@pytest.fixture(scope="module")
+def ng(tmp_path_factory):
+    # 入力の一部を混ぜた NGリスト。先頭10件は企業名を変えて、電話だけで当たるようにする
+    source = extract_google_vertical(synthetic.google_vertical(300).iloc[:, 0].tolist())
+    ng_df = synthetic.ng_list(40, source=source, overlap=0.5)
+    ng_df.loc[:9, "企業名"] = [f"無関係商事{i}" for i in range(10)]
+    path = tmp_path_factory.mktemp("ng") / "NGリスト_test.xlsx"
+    ng_df.to_excel(path, index=False)
+    ng_names, ng_phones = load_ng_list(path)
+    return {"ng_names": ng_names, "ng_phones": frozenset(ng_phones), "ng_index": NgNameIndex(ng_names)}
+
+
+def test_save_and_load_round_trip(store):
+    df = keyed_rows(120)
+    file_id = store.save(df, file_name="a.xlsx", profile="p", source_hash="h1")
+    loaded = store.load_rows(file_id)
+    pd.testing.assert_frame_equal(loaded, df[loaded.columns].reset_index(drop=True), check_dtype=False)
+    assert loaded["__phone_key"].dtype == "Int64"
+    assert store.file_info(file_id)["row_count"] == len(df)
+    assert store.find("h1", "p") == file_id
+    assert store.find("h1", "other") is None
+
+
+def test_save_replaces_the_same_source_and_profile(store):
+    first = store.save(keyed_rows(50, seed=1), file_name="a.xlsx", profile="p", source_hash="h1")
+    second = store.save(keyed_rows(30, seed=2), file_name="a.xlsx", profile="p", source_hash="h1")
+    assert second != first
+    assert store.list_files()["id"].tolist() == [second]
+    assert len(store.load_rows(second)) == 30
+    with sqlite3.connect(store.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM rows WHERE file_id = ?", (first,)).fetchone()[0] == 0
+
+
+def test_concurrent_saves_of_the_same_upload(store):
+    df = keyed_rows(500)
+    barrier = threading.Barrier(6)
+    ids, errors = [], []
+
+    def save():
+        barrier.wait()
+        try:
+            ids.append(store.save(df, file_name="a.xlsx", profile="p", source_hash="same"))
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    files = store.list_files()
+    assert len(files) == 1
+    assert len(store.load_rows(int(files["id"][0]))) == len(df)
+
+
+def test_old_lists_are_pruned_past_max_files(tmp_path):
+    store = ResultStore(tmp_path / "store.sqlite3", max_files=2)
+    ids = [store.save(keyed_rows(10, seed=i), file_name=f"{i}.xlsx", profile="p", source_hash=f"h{i}") for i in range(4)]
+    assert sorted(store.list_files()["id"].tolist()) == ids[2:]
+    with sqlite3.connect(store.path) as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT file_id) FROM rows").fetchone()[0] == 2
+
+
+def test_delete(store):
+    file_id = store.save(keyed_rows(10), file_name="a.xlsx", profile="p", source_hash="h1")
+    store.delete(file_id)
+    assert store.file_info(file_id) is None
+    assert store.load_rows(file_id).empty
+
+
+def test_load_rows_by_municipality(store):
+    df = keyed_rows(200)
+    file_id = store.save(df, file_name="a.xlsx", profile="p", source_hash="h1")
+    areas = store.municipalities(file_id)
+    assert areas["rows"].sum() == len(df)
+    picked = areas["municipality"].iloc[0]
+    loaded = store.load_rows(file_id, [picked])
+    assert len(loaded) == areas["rows"].iloc[0]
+    assert set(loaded["__municipality"]) == {picked}
+
+
+def test_run_pipeline_saves_only_on_first_extraction(store, upload):
+    first = run_pipeline(upload, profile=PROFILE_AUTO, industry_option="その他", store=store, file_name="a.xlsx")
+    created_at = store.file_info(first["store_file_id"])["created_at"]
+    again = run_pipeline(upload, profile=PROFILE_AUTO, industry_option="製造業", store=store, file_name="a.xlsx")
+    assert again["store_file_id"] == first["store_file_id"]
+    assert store.file_info(first["store_file_id"])["created_at"] == created_at
+
+
+@pytest.mark.parametrize("industry_option", ["製造業", "物流業", "その他"])
+@pytest.mark.parametrize("fuzzy", [None, 0.8])
+@pytest.mark.parametrize("dedup_company_address", [True, False])
+def test_run_stored_matches_run_pipeline(store, upload, ng, industry_option, fuzzy, dedup_company_address):
+    options = dict(industry_option=industry_option, ng_fuzzy_threshold=fuzzy,
+                   dedup_company_address=dedup_company_address, **ng)
+    direct = run_pipeline(upload, profile=PROFILE_AUTO, store=store, file_name="a.xlsx", **options)
+    stored = run_stored(store, direct["store_file_id"], **options)
+    pd.testing.assert_frame_equal(stored["df"].reset_index(drop=True), direct["df"].reset_index(drop=True),
+                                  check_dtype=False)
+    assert stored["removal_logs"] == direct["removal_logs"]
+    assert direct["phone_removed"] > 0 and direct["dup_removed"] > 0
+    for key in ("removed_by_industry", "company_removed", "fuzzy_removed", "phone_removed", "dup_removed",
+                "company_dup_removed"):
+        assert stored[key] == direct[key], key
+
+
+def test_open_result_store_is_opt_in(monkeypatch, tmp_path):
+    monkeypatch.delenv("GCHANGE_STORE_PATH", raising=False)
+    assert open_result_store() is None
+    monkeypatch.setenv("GCHANGE_STORE_PATH", "off")
+    assert open_result_store() is None
+    monkeypatch.setenv("GCHANGE_STORE_PATH", str(tmp_path / "x.sqlite3"))
+    monkeypatch.setenv("GCHANGE_STORE_MAX_FILES", "5")
+    store = open_result_store()
+    assert store.path == str(tmp_path / "x.sqlite3")
+    assert store.max_files == 5
+    monkeypatch.setattr("g_change_core.DEFAULT_STORE_PATH", tmp_path / "default.sqlite3")
+    monkeypatch.setenv("GCHANGE_STORE_PATH", "on")
+    assert open_result_store().path == str(tmp_path / "default.sqlite3")
+    assert DEFAULT_STORE_PATH.name == "g_change_results.sqlite3"
@@ -0,0 +1,53 @@
+"""複数シートの読み込み・抽出（シートがすべて空のとき・列が足りないときの自動判定）"""
+import io
+
+import pandas as pd
+import pytest
+
+import synthetic
+from g_change_core import (
+    PROFILE_AUTO,
+    PROFILE_SCANNERS,
+    PROFILE_SHIGOTO_ARUA,
+    detect_profile,
+    extract_sheets,
+    run_pipeline,
+    run_pipeline_chunked,
+)
+
+
+def empty_workbook(*names) -> bytes:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf) as writer:
+        for name in names:
+            pd.DataFrame().to_excel(writer, sheet_name=name, index=False)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("profile, expected", [(PROFILE_AUTO, ""), (PROFILE_SHIGOTO_ARUA, PROFILE_SHIGOTO_ARUA)])
+def test_all_empty_sheets_give_an_empty_result(profile, expected):
+    df, used = extract_sheets({"a": pd.DataFrame(), "b": pd.DataFrame()}, profile)
+    assert df.empty and used == {"": expected}
+
+    data = empty_workbook("a", "b")
+    whole = run_pipeline(data, profile=profile, industry_option="その他")
+    chunked = run_pipeline_chunked(data, profile=profile, industry_option="その他", chunk_rows=10)
+    for result in (whole, chunked):
+        assert result["profile"] == expected
+        assert result["sheets"] == []
+    assert whole["df"].empty and chunked["rows"] == 0
+
+
+@pytest.mark.parametrize("frame", [pd.DataFrame(), pd.DataFrame(index=range(5)), pd.DataFrame({0: ["株式会社A"] * 5})])
+def test_scores_are_zero_when_columns_are_missing(frame):
+    for scanner in PROFILE_SCANNERS.values():
+        assert scanner.score(frame) == 0.0
+    assert detect_profile(frame)[0] is None
+
+
+def test_mixed_sheets_are_detected_per_sheet():
+    frames = {"google": synthetic.google_vertical(40), "empty": pd.DataFrame(), "shigoto": synthetic.shigoto_arua(40)}
+    df, used = extract_sheets(frames, PROFILE_AUTO)
+    assert list(used) == ["google", "shigoto"]
+    assert used["shigoto"] == PROFILE_SHIGOTO_ARUA
+    assert df["シート"].unique().tolist() == ["google", "shigoto"]
@@ -0,0 +1,126 @@
+"""template.xlsx への書き込み: 開拓先リストのカード枚数・プルダウン・印刷範囲を件数に合わせる（fit_lead_cards）"""
+import io
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles import Font
+
+from g_change_core import (
+    LEAD_CARD_FIRST_ROW,
+    LEAD_CARD_ROWS,
+    LEAD_SHEET,
+    LEAD_STATUS_CHOICES,
+    TEMPLATE_MASTER_SHEET,
+    fit_lead_cards,
+    write_template_workbook,
+)
+
+TEMPLATE_CARDS = 3
+
+
+def card_top(k: int) -> int:
+    return LEAD_CARD_FIRST_ROW + k * LEAD_CARD_ROWS
+
+
+def lead_template():
+    """6行のカードを TEMPLATE_CARDS 枚持つ小さなテンプレ（本物の template.xlsx と同じ並び）"""
+    wb = Workbook()
+    master = wb.active
+    master.title = TEMPLATE_MASTER_SHEET
+    master.append(["No", "企業名", "業種", "住所", "電話番号"])
+    for r in range(2, TEMPLATE_CARDS + 2):
+        master.cell(row=r, column=1, value="=ROW()-1")
+
+    ws = wb.create_sheet(LEAD_SHEET)
+    ws["A1"] = "開拓先リスト"
+    for k in range(TEMPLATE_CARDS):
+        top = card_top(k)
+        ws.cell(row=top, column=1, value=k + 1).font = Font(bold=True)
+        ws.cell(row=top, column=2, value=f"=VLOOKUP(A{top},入力マスター!$A:$E,2,FALSE)")
+        ws.cell(row=top + 1, column=2, value=f"=$A$1&A{top}")
+        ws.cell(row=top + 1, column=7, value="架電結果")
+        ws.merge_cells(f"B{top}:F{top}")
+        ws.merge_cells(f"I{top + 2}:L{top + 5}")
+        for i in range(LEAD_CARD_ROWS):
+            ws.row_dimensions[top + i].height = 18 + i
+    status_cells = " ".join(f"H{card_top(k) + 1}" for k in range(TEMPLATE_CARDS))
+    ws.conditional_formatting.add(status_cells, FormulaRule(formula=['H3="アポ"'], font=Font(color="FF0000")))
+    ws.conditional_formatting.add(f"A{card_top(TEMPLATE_CARDS - 1)}:L{card_top(TEMPLATE_CARDS - 1) + 5}",
+                                  FormulaRule(formula=['$H15="断り"'], font=Font(strike=True)))
+    return wb
+
+
+def template_bytes() -> bytes:
+    buf = io.BytesIO()
+    lead_template().save(buf)
+    return buf.getvalue()
+
+
+def merges(ws) -> set:
+    return {cr.coord for cr in ws.merged_cells.ranges}
+
+
+def formats(ws) -> dict:
+    return {str(cf.sqref): [f for rule in cf.rules for f in rule.formula] for cf in ws.conditional_formatting}
+
+
+def test_grow_copies_the_last_card():
+    ws = lead_template()[LEAD_SHEET]
+    fit_lead_cards(ws, 5)
+    assert ws.max_row == card_top(5) - 1
+    for k in range(5):
+        top = card_top(k)
+        assert ws.cell(row=top, column=2).value == f"=VLOOKUP(A{top},入力マスター!$A:$E,2,FALSE)"
+        assert ws.cell(row=top + 1, column=2).value == f"=$A$1&A{top}"
+        assert ws.cell(row=top + 1, column=7).value == "架電結果"
+        assert ws.cell(row=top, column=1).font.bold
+        assert [ws.row_dimensions[top + i].height for i in range(LEAD_CARD_ROWS)] == [18 + i for i in range(6)]
+        assert {f"B{top}:F{top}", f"I{top + 2}:L{top + 5}"} <= merges(ws)
+    # 番号はテンプレの最後のカードの値を写す（書き込み時に入力マスターの No で引き直す）
+    assert ws.cell(row=card_top(4), column=1).value == TEMPLATE_CARDS
+    assert formats(ws) == {
+        "H3 H9 H15 H21 H27": ['H3="アポ"'],
+        "A14:L19 A20:L25 A26:L31": ['$H15="断り"'],
+    }
+
+
+def test_shrink_drops_the_trailing_cards():
+    ws = lead_template()[LEAD_SHEET]
+    fit_lead_cards(ws, 2)
+    assert ws.max_row == card_top(2) - 1
+    assert merges(ws) == {f"B{card_top(k)}:F{card_top(k)}" for k in range(2)} | \
+        {f"I{card_top(k) + 2}:L{card_top(k) + 5}" for k in range(2)}
+    assert all(r < card_top(2) for r in ws.row_dimensions)
+    assert formats(ws) == {"H3 H9": ['H3="アポ"']}
+
+
+def test_same_count_is_left_alone():
+    ws = lead_template()[LEAD_SHEET]
+    before = (ws.max_row, merges(ws), formats(ws))
+    fit_lead_cards(ws, TEMPLATE_CARDS)
+    assert (ws.max_row, merges(ws), formats(ws)) == before
+
+
+@pytest.mark.parametrize("n", [1, TEMPLATE_CARDS, 7])
+def test_write_template_workbook_fits_cards_validation_and_print_area(n):
+    df = pd.DataFrame({
+        "企業名": [f"株式会社テスト{i}" for i in range(n)],
+        "業種": "製造業",
+        "住所": "愛知県豊田市元城町1",
+        "電話番号": "0565-12-3456",
+    })
+    wb = load_workbook(write_template_workbook(df, template_bytes(), "その他"))
+    last = card_top(n) - 1
+
+    master = wb[TEMPLATE_MASTER_SHEET]
+    assert [master.cell(row=r, column=2).value for r in range(2, n + 2)] == df["企業名"].tolist()
+    assert all(master.cell(row=r, column=1).value == "=ROW()-1" for r in range(2, max(n, TEMPLATE_CARDS) + 2))
+
+    ws = wb[LEAD_SHEET]
+    assert ws.max_row == last
+    status = [dv for dv in ws.data_validations.dataValidation if dv.formula1 == LEAD_STATUS_CHOICES]
+    assert len(status) == 1
+    assert str(status[0].sqref) == " ".join(f"H{card_top(k) + 1}" for k in range(n))
+    assert ws.print_area == f"'{LEAD_SHEET}'!$A$1:$L${last}"